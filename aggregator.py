@@ -0,0 +1,502 @@
+import asyncio
+import heapq
+import json
+import socket
+import ssl
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlencode, urlsplit
+from stats import event_seconds
+from metrics import PEER_DUPLICATES, PEER_EVENTS, PEER_RECONNECTS
+
+'''
+aggregator is a module that merges the events of several Parrot instances (nodes) into one stream.
+
+A club or a ham with several hotspots runs a LogDogAPI on each of them, and watching all of them meant a tab per hotspot. In aggregator
+mode (peers set in the config.json file) one instance holds a single connection to the /watch stream of the events of each peer and
+reconnects to it with a backoff when it drops, resuming each log from its cursor (the id of its snapshot or of its last event), so no
+event is lost while a peer restarts and no snapshot is merged twice. The events of the local logs are added under the node id of the
+instance. The events of every node are merged into one stream that is served to local clients by /aggregate: each upstream is read
+once whatever the number of viewers, and a viewer costs the aggregator a bounded SubscriberQueue like the clients of the local logs.
+
+Merge:
+    Each event waits aggregate_window seconds (0.5 by default) after it is received, and the events that are due are released in the
+    order of their log timestamps, so the events of nodes whose streams arrive with different delays come out in time order. An event
+    received later than the window is still sent, after the events released before it.
+
+Deduplication:
+    Nodes linked to the same talkgroup or reflector hear the same network transmission. A network header or end event with the same
+    mode, callsign and destination (mode and slot for a watchdog without a callsign) as one of another node less than
+    aggregate_dedupe_window seconds (2 by default) apart is a copy: it is not sent again and the node is added to the nodes of the first
+    event, which shows them if it has not been released yet. RF transmissions are heard by one hotspot only and are never deduplicated.
+
+Each merged event is the event of the node (see events.py) with the node that heard it first, the nodes that heard it and its log:
+    {"type": "header", "time": "...", "callsign": "K3JLP", ..., "node": "shack", "nodes": ["shack", "mobile"], "log": "MMDVM"}
+Its SSE id is "epoch:sequence", a client that reconnects with it is sent the events it missed if they are still in the last
+aggregate_size events, a new client is sent those events as a snapshot first.
+
+Classes:
+    MergedRecord: An event of a node with its place in the merged stream
+    PeerStream: The connection to the stream of one peer
+    Aggregator: The merge of the events of every node and its subscribers
+
+Functions:
+    read_body: A function that yields the body of an HTTP response as it arrives
+'''
+
+
+async def read_body(reader: asyncio.StreamReader, chunked: bool):
+    '''
+    read_body is a function that yields the body of an HTTP response as it arrives, decoding the chunked transfer encoding.
+
+    Parameters:
+        reader: An asyncio.StreamReader object positioned after the headers of the response
+        chunked: A boolean that represents whether the body is sent with the chunked transfer encoding
+
+    Returns:
+        bytes: The parts of the body (yielded), until the response ends
+
+    Exceptions:
+        ConnectionError: An exception that is raised when the connection is closed in the middle of a chunk
+    '''
+    if not chunked:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+    while True:
+        size = (await reader.readline()).split(b';', 1)[0].strip()
+        if not size:
+            raise ConnectionError('Connection closed')
+        size = int(size, 16)
+        if size == 0:
+            return
+        try:
+            data = await reader.readexactly(size + 2)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError('Connection closed')
+        yield data[:-2]
+
+
+class MergedRecord:
+    __slots__ = ('node', 'log', 'event', 'time', 'seconds', 'deadline', 'nodes', 'id', 'sequence', 'json')
+
+    def __init__(self, node: str, log: str, event: dict, deadline: float):
+        '''
+        MergedRecord constructor.
+
+        Parameters:
+            node: A string that represents the node the event was received from
+            log: A string that represents the log of the node the event was parsed from
+            event: A dictionary that represents the event (see LogEvent.to_dict)
+            deadline: A float that represents the loop time at which the event is released
+
+        Variables:
+            seconds: A float that represents the timestamp of the event in seconds, None if it is malformed
+            nodes: A list of strings that represent the nodes that heard the event, the first one first
+            id: A string that represents the cursor of the event in the merged stream, set when it is released
+            sequence: An integer that represents the position of the event in the merged stream, set when it is released
+            json: A string that represents the merged event as JSON, set when it is released
+
+        Returns:
+            None
+        '''
+        self.node = node
+        # SubscriberQueue keeps the newest record of each log with the latest policy, the stream of a log of a node here
+        self.log = f'{node}/{log}'
+        self.event = event
+        self.time = event.get('time') or ''
+        self.seconds = event_seconds(self.time)
+        self.deadline = deadline
+        self.nodes = [node]
+        self.id = None
+        self.sequence = 0
+        self.json = None
+
+    def __lt__(self, other):
+        '''
+        __lt__ is a method that orders the records of the pending heap by timestamp.
+        '''
+        return self.time < other.time
+
+
+class PeerStream:
+    def __init__(self, aggregator, node: str, url: str, logs: list, backoff_max: float = 30, timeout: float = 10):
+        '''
+        PeerStream constructor.
+
+        Parameters:
+            aggregator: The Aggregator object the events are added to
+            node: A string that represents the node id of the peer
+            url: A string that represents the base URL of the LogDogAPI of the peer (e.g. http://192.168.1.21:8001)
+            logs: A list of strings that represent the logs of the peer to follow
+            backoff_max: A float that represents the maximum number of seconds between two connection attempts
+            timeout: A float that represents the number of seconds to wait for the connection and the headers of the response
+
+        Variables:
+            cursors: A dictionary that maps each log of the peer to its cursor, from the snapshot of the log and the ids of the events,
+                sent as Last-Event-ID (log=cursor,...) when reconnecting
+            connected: A boolean that represents whether the stream of the peer is open
+            connects: An integer that represents the number of times the stream was opened
+            error: A string that represents the last connection error, None once connected
+            last_event: A string that represents the timestamp of the last event received
+
+        Returns:
+            None
+        '''
+        self.aggregator = aggregator
+        self.node = node
+        self.url = url.rstrip('/')
+        self.logs = logs
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cursors = {}
+        self.connected = False
+        self.connects = 0
+        self.error = None
+        self.last_event = None
+        self.reconnects = PEER_RECONNECTS.labels(node)
+
+    def status(self):
+        '''
+        status is a method that returns the state of the connection to the peer.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary with the node, url, connected, connects, error and last_event of the peer
+        '''
+        return {'node': self.node, 'url': self.url, 'connected': self.connected, 'connects': self.connects, 'error': self.error,
+                'last_event': self.last_event}
+
+    async def run(self):
+        '''
+        run is a coroutine that keeps the stream of the peer open until it is cancelled.
+
+        When the stream cannot be opened or drops, it is opened again after a delay that doubles after each failure, up to backoff_max
+        seconds, and is reset once an event is received.
+
+        Parameters:
+            None
+
+        Variables:
+            delay: A float that represents the number of seconds to wait before the next attempt
+
+        Returns:
+            None
+        '''
+        delay = 1
+        try:
+            while True:
+                received = False
+                try:
+                    async for _ in self.read():
+                        received = True
+                    self.error = 'Stream closed by the peer'
+                except (OSError, ValueError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    self.error = str(e) or type(e).__name__
+                if self.connected:
+                    print(f'Stream of peer {self.node} closed: {self.error}')
+                self.connected = False
+                self.reconnects.inc()
+                delay = 1 if received else min(delay * 2, self.backoff_max)
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.connected = False
+
+    async def read(self):
+        '''
+        read is a coroutine that opens the /watch stream of the events of the peer and adds each event it receives to the aggregator.
+
+        Parameters:
+            None
+
+        Variables:
+            url: A SplitResult object of the URL of the peer
+            fields: A dictionary that holds the fields of the SSE frame being read
+
+        Returns:
+            None (yields once per event received)
+
+        Exceptions:
+            ConnectionError: An exception that is raised when the peer answers with another status than 200 or closes the connection
+            OSError: An exception that is raised when the peer cannot be reached
+        '''
+        url = urlsplit(self.url)
+        secure = url.scheme == 'https'
+        path = f'{url.path}/watch?{urlencode([("log", log) for log in self.logs] + [("events", "true")])}'
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, url.port or (443 if secure else 80), ssl=ssl.create_default_context() if secure else None),
+            timeout=self.timeout)
+        try:
+            # The stream is silent while nobody transmits, keepalive notices a peer that disappeared without closing the connection
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            request = (f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nAccept: text/event-stream\r\nCache-Control: no-cache\r\n'
+                       f'Connection: close\r\n')
+            if self.cursors:
+                request += f'Last-Event-ID: {",".join(f"{log}={cursor}" for log, cursor in self.cursors.items())}\r\n'
+            writer.write((request + '\r\n').encode())
+            await writer.drain()
+            status = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+            if status.split(b' ', 2)[1:2] != [b'200']:
+                raise ConnectionError(f'Unexpected response: {status.decode(errors="replace").strip() or "none"}')
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+            self.connected = True
+            self.connects += 1
+            self.error = None
+            print(f'Following the events of peer {self.node} at {self.url}')
+            buffer = b''
+            fields = {}
+            async for data in read_body(reader, 'chunked' in headers.get('transfer-encoding', '')):
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    line = line.rstrip(b'\r').decode('utf-8', errors='replace')
+                    if line:
+                        name, _, value = line.partition(':')
+                        value = value[1:] if value.startswith(' ') else value
+                        fields[name] = f'{fields[name]}\n{value}' if name == 'data' and name in fields else value
+                        continue
+                    if 'data' in fields and self.frame(fields):
+                        yield
+                    fields = {}
+        finally:
+            writer.close()
+
+    def frame(self, fields: dict):
+        '''
+        frame is a method that adds the events of an SSE frame of the peer to the aggregator.
+
+        Parameters:
+            fields: A dictionary that maps the fields of the frame (event, id and data) to their values
+
+        Returns:
+            bool: True if the frame held an event
+        '''
+        try:
+            data = json.loads(fields['data'])
+        except ValueError:
+            return False
+        name = fields.get('event')
+        if name == 'snapshot':
+            # Sent for the logs the cursors do not cover, the recent events of the log before its new ones. Its id is the cursor of
+            # the log, kept so a quiet log (e.g. YSFGateway on a DMR only hotspot) is resumed and not sent as a snapshot again
+            if data.get('log') and data.get('id'):
+                self.cursors[data['log']] = data['id']
+            for event in data.get('events', []):
+                self.aggregator.add(self.node, data.get('log'), event)
+            return False
+        if not isinstance(data, dict) or not name:
+            return False
+        for item in (fields.get('id') or '').split(','):
+            log, _, cursor = item.partition('=')
+            if log and cursor:
+                self.cursors[log] = cursor
+        self.last_event = data.get('time')
+        self.aggregator.add(self.node, name, data)
+        return True
+
+
+class Aggregator:
+    def __init__(self, peers: dict, logs: list, window: float = .5, dedupe_window: float = 2, size: int = 200, backoff_max: float = 30):
+        '''
+        Aggregator constructor.
+
+        Parameters:
+            peers: A dictionary that maps the node id of each peer to the base URL of its LogDogAPI
+            logs: A list of strings that represent the logs of each peer to follow
+            window: A float that represents the number of seconds an event waits for the events of the other nodes before it is released
+            dedupe_window: A float that represents the maximum number of seconds between two copies of a network transmission
+            size: An integer that represents the number of merged events kept for new and reconnecting clients
+            backoff_max: A float that represents the maximum number of seconds between two connection attempts to a peer
+
+        Variables:
+            streams: A list of PeerStream objects, one per peer
+            pending: A heap of the MergedRecord objects waiting to be released, by timestamp
+            seen: An OrderedDict object that maps each recent network transmission (type, mode, callsign, destination) to its MergedRecord
+            recent: A deque object of the last released MergedRecord objects
+            subscribers: A set of the SubscriberQueue objects of the clients
+            epoch: An integer that identifies this run in the cursors, a cursor of a previous run gets a snapshot
+            sequence: An integer that represents the number of events released
+
+        Returns:
+            None
+        '''
+        self.window = window
+        self.dedupe_window = dedupe_window
+        self.streams = [PeerStream(self, node, url, logs, backoff_max) for node, url in peers.items()]
+        self.pending = []
+        self.seen = OrderedDict()
+        self.recent = deque(maxlen=size)
+        self.subscribers = set()
+        self.epoch = int(time.time())
+        self.sequence = 0
+        self.wake = None
+
+    def add(self, node: str, log: str, event: dict):
+        '''
+        add is a method that adds an event of a node to the merge, unless it is a copy of a network transmission of another node.
+
+        Parameters:
+            node: A string that represents the node the event was received from
+            log: A string that represents the log of the node the event was parsed from
+            event: A dictionary that represents the event
+
+        Variables:
+            key: A tuple that identifies a network transmission, None for the events that are never deduplicated
+            first: The MergedRecord object of the last event with the same key, a copy unless its node already heard it
+
+        Returns:
+            MergedRecord: The MergedRecord object of the event, or None if it is a duplicate
+        '''
+        now = time.monotonic()
+        record = MergedRecord(node, log, event, now + self.window)
+        key = None
+        if event.get('source') == 'network' and record.seconds is not None:
+            if event.get('callsign'):
+                key = (event.get('type'), event.get('mode'), event['callsign'], event.get('destination'))
+            else:
+                # A network watchdog that expired only logs the mode and the slot
+                key = (event.get('type'), event.get('mode'), event.get('slot'))
+            first = self.seen.get(key)
+            if first is not None and node not in first.nodes and abs(record.seconds - first.seconds) <= self.dedupe_window:
+                first.nodes.append(node)
+                PEER_DUPLICATES.labels(node).inc()
+                return None
+            self.seen.pop(key, None)
+            self.seen[key] = record
+        PEER_EVENTS.labels(node).inc()
+        heapq.heappush(self.pending, record)
+        if self.wake is not None:
+            self.wake.set()
+        return record
+
+    def release(self):
+        '''
+        release is a method that publishes the events whose window has passed, in the order of their timestamps.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        now = time.monotonic()
+        while self.pending and self.pending[0].deadline <= now:
+            self.publish(heapq.heappop(self.pending))
+        # A copy can only follow its transmission by dedupe_window seconds plus the delay of the slowest stream
+        expired = now - self.window - self.dedupe_window * 2
+        while self.seen:
+            key, record = next(iter(self.seen.items()))
+            if record.deadline > expired:
+                break
+            del self.seen[key]
+
+    def publish(self, record: MergedRecord):
+        '''
+        publish is a method that gives a released event its cursor and offers it to every client.
+
+        Parameters:
+            record: A MergedRecord object
+
+        Returns:
+            None
+        '''
+        self.sequence += 1
+        record.sequence = self.sequence
+        record.id = f'{self.epoch}:{self.sequence}'
+        record.json = json.dumps(dict(record.event, node=record.node, nodes=record.nodes, log=record.log.split('/', 1)[1]),
+                                 separators=(',', ':'))
+        self.recent.append(record)
+        for queue in self.subscribers:
+            queue.offer(record)
+
+    def subscribe(self, cursor: str = None, queue=None):
+        '''
+        subscribe is a method that registers a client of the merged stream.
+
+        Parameters:
+            cursor: A string that represents the cursor of the last event the client received, or None for a new client
+            queue: The SubscriberQueue object the events are offered to
+
+        Variables:
+            oldest: An integer that represents the oldest cursor the kept events can resume from, a client that missed events that are no
+                longer kept gets a snapshot instead of a partial backlog
+
+        Returns:
+            tuple: A tuple of (queue, backlog, snapshot) where backlog is a list of the MergedRecord objects released after the cursor and
+                snapshot is a string that represents the recent events and the peers as JSON, None with a cursor this run can resume from
+        '''
+        self.subscribers.add(queue)
+        epoch, _, sequence = (cursor or '').partition(':')
+        oldest = self.recent[0].sequence - 1 if self.recent else self.sequence
+        if epoch == str(self.epoch) and sequence.isdigit() and oldest <= int(sequence) <= self.sequence:
+            return queue, [record for record in self.recent if record.sequence > int(sequence)], None
+        snapshot = (f'{{"id":{json.dumps(self.recent[-1].id if self.recent else None)},'
+                    f'"events":[{",".join(record.json for record in self.recent)}],"peers":{json.dumps(self.status())}}}')
+        return queue, [], snapshot
+
+    def unsubscribe(self, queue):
+        '''
+        unsubscribe is a method that removes a client of the merged stream.
+
+        Parameters:
+            queue: The SubscriberQueue object passed to subscribe
+
+        Returns:
+            None
+        '''
+        self.subscribers.discard(queue)
+
+    def status(self):
+        '''
+        status is a method that returns the state of the connection to every peer.
+
+        Parameters:
+            None
+
+        Returns:
+            list: A list of dictionaries, see PeerStream.status
+        '''
+        return [stream.status() for stream in self.streams]
+
+    async def run(self):
+        '''
+        run is a coroutine that follows every peer and releases the merged events until it is cancelled.
+
+        Parameters:
+            None
+
+        Variables:
+            tasks: A list of asyncio.Task objects that read the streams of the peers
+
+        Returns:
+            None
+        '''
+        self.wake = asyncio.Event()
+        tasks = [asyncio.create_task(stream.run()) for stream in self.streams]
+        try:
+            while True:
+                if not self.pending:
+                    self.wake.clear()
+                    await self.wake.wait()
+                await asyncio.sleep(max(0, self.pending[0].deadline - time.monotonic()) if self.pending else 0)
+                self.release()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
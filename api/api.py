@@ -1,25 +1,96 @@
 import asyncio
+import contextlib
+import itertools
+import json
+import os
+import re
 import socket
-from starlette.responses import StreamingResponse
-from fastapi import FastAPI, Request
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from starlette.responses import PlainTextResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from logdog import LogDog
+from logdog import CursorExpired, LogDog
+from tailer import SubscriberQueue, TailHub
+from history import CallHistory
+from stats import ActivityStats
+from callbook import Callbook
+from aggregator import Aggregator
+from sessions import SessionTracker
+import events
+from filters import shared_filter
+from metrics import LOOP_LAG, STREAM_LINES, STREAM_WRITES, Gauge, registry
+from api.sockets import SocketClient
 
 '''
 LogDogAPI is a class that extends Parrot and adds an API to the Parrot application.
 
 LogDogAPI is responsible for using the Parrot class to read the desired log file and serve the log lines using FastAPI.
 FastAPI was chosen for its simplicity and raw performance along with being ideal for supporting a large number of concurrent connections.
-Additionally, adding a websocket to the API would be trivial if needed in the future due to FastAPI's support for websockets being built-in.
-LogDogAPI provides two routes: /read_log and /watch_log. /read_log reads the log file and returns the log lines as a response.
+FastAPI's built-in support for websockets is used by the /ws route for clients that need backpressure.
+LogDogAPI provides the routes below. /read_log streams a page of log lines as NDJSON, with opaque cursors to the older and newer pages.
 /watch_log reads the log file and returns the log lines as a response in real-time using Server-Sent Events (SSE).
+/events streams the same lines parsed into events (transmission header and end, reflector link and unlink) as compact JSON using SSE.
+/watch streams several logs (raw lines or events) over a single SSE connection, using the log name as the SSE event name.
+/ws is a WebSocket alternative to the SSE routes with a bounded queue per client and an overflow policy for slow clients (see api/sockets.py).
+All /watch_log clients of the same log share one TailHub tailer, so the log file is only read once per poll no matter how many clients are connected.
+A new streaming client is first sent a snapshot of the recent events of each log and of the state they lead to (last heard, transmissions
+in progress and linked reflector, see recent.py), so a dashboard is populated as soon as it connects without reading the log file.
+The streaming routes accept filter, regex, callsign and type query parameters that are applied on the server by the tailer (see filters.py).
+/search streams the lines written during a time range across all the rotated files of a log as NDJSON.
+/history returns the transmissions stored by the background ingest in a local SQLite database (see history.py), with keyset pagination.
+/stats returns rolling activity statistics (top callsigns, calls per hour and day, RF against network, airtime) kept by a background
+ingest and checkpointed to disk (see stats.py).
+/callbook returns the name and location of a callsign from the local RadioID user database, which also enriches the events (see callbook.py).
+/aggregate streams the events of this instance and of its peers (the other hotspots set in peers) merged in time order, with the node
+that heard each event and the copies of network transmissions heard by several nodes removed, using SSE (see aggregator.py).
+/peers returns the state of the connection to each peer.
+/sessions returns the transmissions in progress and the last ones, paired from their header and end by the server with their duration, BER
+and packet loss (see sessions.py). /watch?sessions=true also streams their tx_start and tx_end state changes as SSE events named sessions.
+/stream_stats returns the average number of lines coalesced into each SSE write.
+/metrics returns the counters of the tail, parse and fan-out paths, the clients and their queues in the Prometheus text format (see metrics.py).
+Blocking file work (the polls of the tailers, the backlogs of new clients, /read_log and the history writes) runs in a bounded pool of
+io_workers threads so a slow SD card never stalls the event loop, and the lag of the event loop is measured by monitor_loop.
 
 Attributes:
     app: A FastAPI object that represents the API application
+    hub: A TailHub object that shares one background tailer per log between all /watch_log clients
+    executor: A ThreadPoolExecutor object that runs the blocking file and database work of the API
+    history: A CallHistory object that stores the transmissions, None if history is disabled in the config.json file
+    stats: An ActivityStats object that keeps the activity statistics, None if statistics are disabled in the config.json file
+    callbook: A Callbook object that looks up the callsigns of the events, None if the callbook is disabled in the config.json file
+    aggregator: An Aggregator object that merges the events of the peers, None if no peers are set in the config.json file
+    sessions: A SessionTracker object that pairs the headers and ends of the transmissions, None if sessions are disabled in the config.json file
+    node_id: A string that represents the node of the events of this instance in the merged stream, the hostname by default
     origins: A list of strings that represent the origins allowed to access the API
     
 Methods:
+    get_log: A coroutine that streams a page of log lines as NDJSON, with the cursors of the older and newer pages
     watch_log: A method that reads the log file and returns the log lines as a response in real-time using Server-Sent Events (SSE)
+    watch_events: A method that returns the events parsed from the log lines as JSON in real-time using Server-Sent Events (SSE)
+    watch: A method that streams several logs over a single Server-Sent Events (SSE) connection
+    stream: A method that builds the Server-Sent Events (SSE) response shared by the streaming routes
+    websocket: A coroutine that serves a WebSocket client that subscribes to logs with JSON messages
+    search: A method that streams the log lines written during a time range as NDJSON
+    get_history: A method that returns a page of the stored transmissions
+    get_stats: A method that returns the activity statistics
+    get_callbook: A method that returns the name and location of a callsign
+    aggregate: A method that streams the merged events of this instance and its peers using Server-Sent Events (SSE)
+    get_peers: A method that returns the state of the connection to each peer
+    get_sessions: A method that returns the transmissions in progress and the last ones
+    stream_stats: A method that returns the number of SSE writes and the average number of lines per write
+    metrics: A method that returns the metrics in the Prometheus text format
+    collect_metrics: A method that builds the metrics of the connected clients when /metrics is read
+    ingest_history: A coroutine that writes the events of the log to the history database in batches
+    flush_history: A coroutine that writes the buffered events to the history database and logs a failed write
+    ingest_stats: A coroutine that counts the events of the log into the activity statistics and checkpoints them
+    monitor_loop: A coroutine that measures how late the event loop wakes up a sleeping task
+    refresh_callbook: A coroutine that rebuilds the callbook index when the user database export changes
+    aggregate_local: A coroutine that adds the events of the local logs to the merged stream
+    track_sessions: A coroutine that pairs the headers and ends of the log into sessions and times out the ones that are never ended
+    lifespan: A context manager that starts and stops the background tasks of the API
     get_server_ip: A method that gets the IP address of the server (Used for CORS to allow connections from the server)
     run: A method that runs the API application
 
@@ -38,9 +109,43 @@ class LogDogAPI(LogDog):
         
         '''
         super().__init__()
-        self.app = FastAPI()
+        self.app = FastAPI(lifespan=self.lifespan)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(getattr(self, 'io_workers', 4))), thread_name_prefix='logdog-io')
+        self.hub = TailHub(self, interval=getattr(self, 'watch_interval', .1), queue_size=getattr(self, 'watch_queue_size', 100),
+                           replay_limit=getattr(self, 'watch_replay_limit', 1000), executor=self.executor,
+                           recent_size=int(getattr(self, 'recent_size', 100)), seed_bytes=int(getattr(self, 'recent_seed_bytes', 262144)))
+        self.batch_max = max(1, int(getattr(self, 'stream_batch_max', 64)))
+        self.batch_window = min(float(getattr(self, 'stream_batch_window', .02)), float(getattr(self, 'stream_max_latency', .05)))
+        self.writes_sent = STREAM_WRITES.labels('sse')
+        self.lines_sent = STREAM_LINES.labels('sse')
+        registry.add_collector(self.collect_metrics)
+        self.history = None
+        if getattr(self, 'history_enabled', True):
+            # The history is kept across reboots in cache_directory, history_max_rows and history_days bound its size
+            self.history = CallHistory(os.path.join(self.cache_directory, 'history.db'), batch_size=getattr(self, 'history_batch_size', 100),
+                                       max_rows=getattr(self, 'history_max_rows', 100000), days=getattr(self, 'history_days', 365))
+        self.stats = None
+        if getattr(self, 'stats_enabled', True):
+            self.stats = ActivityStats(os.path.join(self.data_directory, 'stats.json'), days=getattr(self, 'stats_days', 7))
+        self.callbook = None
+        if getattr(self, 'callbook_enabled', True):
+            # The index of the RadioID export is about 15 MB, it does not fit in the tmpfs of data_directory and is kept across reboots
+            self.callbook = Callbook(getattr(self, 'callbook_file', '/usr/local/etc/user.csv'), os.path.join(self.cache_directory, 'callbook.idx'),
+                                     cache_size=int(getattr(self, 'callbook_cache_size', 1024)))
+            events.callbook = self.callbook
+        self.sessions = None
+        if getattr(self, 'sessions_enabled', True):
+            self.sessions = SessionTracker(self.log_file, timeout=float(getattr(self, 'session_timeout', 300)),
+                                           size=int(getattr(self, 'sessions_size', 50)))
         self.server_ip = self.get_server_ip()
         self.hostname = socket.gethostname()
+        self.node_id = getattr(self, 'node_id', None) or self.hostname
+        self.aggregate_logs = getattr(self, 'aggregate_logs', [self.log_file, 'YSFGateway'])
+        self.aggregator = None
+        if getattr(self, 'peers', None):
+            self.aggregator = Aggregator(self.peers, self.aggregate_logs, window=float(getattr(self, 'aggregate_window', .5)),
+                                         dedupe_window=float(getattr(self, 'aggregate_dedupe_window', 2)),
+                                         size=int(getattr(self, 'aggregate_size', 200)), backoff_max=float(getattr(self, 'peer_backoff_max', 30)))
         self.origins = [self.server_ip, f'http://{self.server_ip}', f'http://{self.server_ip}:{self.web_port}', f'http://{self.hostname}', f'http://{self.hostname}:{self.web_port}',
                         f'http://{self.hostname}.local', f'http://{self.hostname}.local:{self.web_port}'] # Allow connections from the server, server IP, server hostname, and server hostname + .local
         print(f'Allowed origins: {self.origins}')
@@ -51,9 +156,330 @@ class LogDogAPI(LogDog):
             allow_methods=["*"],
             allow_headers=["*"],
         )
-        self.app.add_api_route('/read_log', self.read_log)
+        self.app.add_api_route('/read_log', self.get_log)
         self.app.add_api_route('/watch_log', self.watch_log)
+        self.app.add_api_route('/events', self.watch_events)
+        self.app.add_api_route('/watch', self.watch)
+        self.app.add_api_websocket_route('/ws', self.websocket)
+        self.app.add_api_route('/search', self.search)
+        self.app.add_api_route('/history', self.get_history)
+        self.app.add_api_route('/stats', self.get_stats)
+        self.app.add_api_route('/callbook', self.get_callbook)
+        self.app.add_api_route('/aggregate', self.aggregate)
+        self.app.add_api_route('/peers', self.get_peers)
+        self.app.add_api_route('/sessions', self.get_sessions)
+        self.app.add_api_route('/stream_stats', self.stream_stats)
+        self.app.add_api_route('/metrics', self.metrics)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        '''
+        lifespan is a context manager that starts the background tasks when the API starts and stops them when it shuts down.
+        
+        Parameters:
+            app: The FastAPI object that is starting
+        
+        The tailers of recent_logs (the MMDVMHost log and YSFGateway by default) are kept running so their recent events are current when
+        a dashboard connects. The callbook index of the previous run is loaded first so those events are enriched.
+        
+        Variables:
+            tasks: A list of asyncio.Task objects that represent the background tasks
+        
+        Returns:
+            None
+        '''
+        if self.callbook is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.callbook.open)
+        if self.hub.recent_size > 0:
+            for log in getattr(self, 'recent_logs', [self.log_file, 'YSFGateway']):
+                await self.hub.keep(log)
+        tasks = [asyncio.create_task(self.monitor_loop())]
+        if self.history is not None:
+            tasks.append(asyncio.create_task(self.ingest_history()))
+        if self.stats is not None:
+            tasks.append(asyncio.create_task(self.ingest_stats()))
+        if self.callbook is not None:
+            tasks.append(asyncio.create_task(self.refresh_callbook()))
+        if self.sessions is not None:
+            tasks.append(asyncio.create_task(self.track_sessions()))
+        if self.aggregator is not None:
+            tasks.append(asyncio.create_task(self.aggregator.run()))
+            if getattr(self, 'aggregate_local', True):
+                tasks.append(asyncio.create_task(self.aggregate_local()))
+        yield
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.history is not None:
+            try:
+                self.history.close()
+            except sqlite3.Error as e:
+                print(f'Error writing the history of {self.log_file}: {e}')
+        self.executor.shutdown(wait=False)
+
+    async def ingest_history(self):
+        '''
+        ingest_history is a coroutine that subscribes to the log and writes its header and end events to the history database.
+        
+        The subscription resumes from the cursor stored with the last batch, so the lines written while the API was stopped are ingested too
+        (up to watch_replay_limit lines). On the first start (no stored cursor) the current log file is read from its start in a thread
+        (see CallHistory.backfill) and the subscription starts where it stopped, so the history starts with the transmissions of the day.
+        Events are written in one transaction once history_batch_size events are buffered or history_flush_interval seconds have passed,
+        whichever comes first. Writes run in a thread so the event loop is never blocked. The queue is unbounded, so no event is dropped
+        while a write is in progress. A write that fails (see flush_history) is retried with the next one, at most once per interval.
+        
+        Parameters:
+            None
+        
+        Variables:
+            queue: A SubscriberQueue object that receives the new log lines from the tailer
+            cursor: A string that represents the cursor stored with the last batch, read in a thread
+            backlog: A list of TailRecord objects that were written since the stored cursor
+            deadline: A float that represents the time at which the buffered events are written even if the batch is not full
+            failed: A boolean that represents whether the last write failed, full batches then wait for the deadline
+        
+        Returns:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        flush_interval = getattr(self, 'history_flush_interval', 1.0)
+        # Unbounded, every event has to be written and the cursor must not move past a dropped one
+        queue = SubscriberQueue(maxsize=0, client='ingest', stream='history')
+        try:
+            cursor = await loop.run_in_executor(self.executor, self.history.cursor, self.log_file)
+            if cursor is None:
+                tailer = self.hub.tailer(self.log_file)
+                await tailer.start()
+                published = tailer.published
+                if published is not None:
+                    backfill = lambda: self.history.backfill(tailer.read_from(published[1], 0, published) or (), self.log_file)
+                    try:
+                        written = await loop.run_in_executor(self.executor, backfill)
+                        print(f'History of {self.log_file} backfilled with {written} events')
+                    except sqlite3.Error as e:
+                        print(f'Error writing the history of {self.log_file}: {e}')
+                    cursor = f'{published[1]}:{published[2]}'
+            queue, backlog, _ = await self.hub.subscribe(self.log_file, cursor, queue)
+            for record in backlog:
+                self.history.add(record.event, self.log_file, record.id)
+            failed = not await self.flush_history()
+            deadline = time.monotonic() + flush_interval
+            while True:
+                try:
+                    record = await asyncio.wait_for(queue.get(), timeout=max(0, deadline - time.monotonic()))
+                    full = self.history.add(record.event, self.log_file, record.id) and not failed
+                except asyncio.TimeoutError:
+                    full = True
+                if full:
+                    failed = not await self.flush_history()
+                    deadline = time.monotonic() + flush_interval
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.hub.unsubscribe(self.log_file, queue)
+
+    async def flush_history(self):
+        '''
+        flush_history is a coroutine that writes the buffered events to the history database in a thread.
+
+        A database that is locked or a full disk does not stop the ingest: the error is logged and the events stay buffered for the
+        next write (see CallHistory.flush).
+
+        Parameters:
+            None
+
+        Returns:
+            bool: True if the events were written, False if the write failed
+        '''
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.history.flush)
+            return True
+        except sqlite3.Error as e:
+            print(f'Error writing the history of {self.log_file}: {e}')
+            return False
+
+    async def ingest_stats(self):
+        '''
+        ingest_stats is a coroutine that counts the events of the log into the activity statistics.
+        
+        The statistics are loaded from their checkpoint and the lines written since its cursor are counted in a thread (see
+        ActivityStats.catch_up), then the coroutine subscribes to the log from the cursor it reached and counts each new event as it is
+        published. The checkpoint is written every stats_checkpoint_interval seconds when events were counted, and when the API stops.
+        The queue is unbounded, so no event is dropped while the checkpoint is written.
+        
+        Parameters:
+            None
+        
+        Variables:
+            tailer: The LogTailer object of the log
+            queue: A SubscriberQueue object that receives the new log lines from the tailer
+            deadline: A float that represents the time at which the checkpoint is written
+        
+        Returns:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        interval = float(getattr(self, 'stats_checkpoint_interval', 60))
+        # Unbounded, like the history ingest, a dropped event would be missing from the counts for good
+        queue = SubscriberQueue(maxsize=0, client='ingest', stream='stats')
+        changed = False
+        try:
+            await loop.run_in_executor(self.executor, self.stats.load)
+            tailer = self.hub.tailer(self.log_file)
+            await tailer.start()
+            cursor = self.stats.cursor
+            if tailer.published is not None:
+                start = time.monotonic()
+                cursor = await loop.run_in_executor(self.executor, self.stats.catch_up, tailer, tailer.published)
+                print(f'Statistics of {self.log_file} caught up in {time.monotonic() - start:.2f} seconds')
+                changed = True
+            queue, backlog, _ = await self.hub.subscribe(self.log_file, cursor, queue)
+            for record in backlog:
+                self.stats.add(record.event, record.id)
+            deadline = time.monotonic() + interval
+            while True:
+                try:
+                    record = await asyncio.wait_for(queue.get(), timeout=max(0, deadline - time.monotonic()))
+                    self.stats.add(record.event, record.id)
+                    changed = True
+                except asyncio.TimeoutError:
+                    if changed:
+                        await loop.run_in_executor(self.executor, self.stats.save)
+                        changed = False
+                    deadline = time.monotonic() + interval
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.hub.unsubscribe(self.log_file, queue)
+            if changed:
+                try:
+                    self.stats.save()
+                except OSError as e:
+                    print(f'Error writing the statistics checkpoint: {e}')
+
+    async def monitor_loop(self):
+        '''
+        monitor_loop is a coroutine that measures the lag of the event loop, the time it was blocked and could not serve any client.
+        
+        It sleeps loop_lag_interval seconds (0.25 by default) and observes how much later than asked it was woken up in the
+        logdog_event_loop_lag_seconds histogram of /metrics. A lag of more than a few milliseconds means something blocks the loop.
+        
+        Parameters:
+            None
+        
+        Variables:
+            interval: A float that represents the number of seconds slept between two measures
+            expected: A float that represents the time at which the coroutine should wake up
+        
+        Returns:
+            None
+        '''
+        interval = float(getattr(self, 'loop_lag_interval', .25))
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                expected = loop.time() + interval
+                await asyncio.sleep(interval)
+                LOOP_LAG.observe(max(0, loop.time() - expected))
+        except asyncio.CancelledError:
+            pass
     
+    async def refresh_callbook(self):
+        '''
+        refresh_callbook is a coroutine that rebuilds the callbook index when the user database export changes.
+        
+        The export is checked when the API starts and then every callbook_check_interval seconds (300 by default). The index is built
+        by a separate process and swapped in atomically, see Callbook.refresh.
+        
+        Parameters:
+            None
+        
+        Returns:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        interval = float(getattr(self, 'callbook_check_interval', 300))
+        try:
+            while True:
+                try:
+                    if await loop.run_in_executor(self.executor, self.callbook.refresh):
+                        print(f'Callbook index rebuilt from {self.callbook.source}: {self.callbook.current.count} callsigns')
+                except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                    print(f'Error building the callbook index from {self.callbook.source}: {e}')
+                await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            pass
+
+    async def track_sessions(self):
+        '''
+        track_sessions is a coroutine that adds the header and end events of the log to the session tracker.
+        
+        The tracker is seeded with the recent events of the log (its snapshot) without publishing them, so a transmission in progress when
+        the API starts is known. The coroutine wakes up when the oldest open session times out even if no line is written.
+        
+        Parameters:
+            None
+        
+        Variables:
+            queue: A SubscriberQueue object that receives the header and end lines of the log
+            timeout: A float that represents the number of seconds until the oldest open session times out, None when none is open
+        
+        Returns:
+            None
+        '''
+        queue = SubscriberQueue(maxsize=self.hub.queue_size, client='ingest', stream='sessions')
+        try:
+            queue, _, snapshot = await self.hub.subscribe(self.log_file, None, queue, shared_filter(types=['header', 'end']))
+            if snapshot is not None:
+                for event in json.loads(snapshot)['events']:
+                    self.sessions.add(events.LogEvent(**event), publish=False)
+            self.sessions.expire()
+            while True:
+                timeout = self.sessions.next_expiry()
+                try:
+                    record = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    self.sessions.expire()
+                    continue
+                if record is not None and record.event is not None:
+                    self.sessions.add(record.event)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.hub.unsubscribe(self.log_file, queue)
+
+    async def aggregate_local(self):
+        '''
+        aggregate_local is a coroutine that adds the events of the local logs to the merged stream under node_id.
+        
+        The recent events of each log (its snapshot) are added first, like the snapshot a peer sends when the aggregator connects to it.
+        
+        Parameters:
+            None
+        
+        Variables:
+            queue: A SubscriberQueue object that receives the new lines of every log in aggregate_logs
+        
+        Returns:
+            None
+        '''
+        queue = SubscriberQueue(maxsize=self.hub.queue_size * len(self.aggregate_logs), client='aggregate', stream='aggregate')
+        try:
+            for log in self.aggregate_logs:
+                _, _, snapshot = await self.hub.subscribe(log, None, queue)
+                if snapshot is not None:
+                    for event in json.loads(snapshot)['events']:
+                        self.aggregator.add(self.node_id, log, event)
+            while True:
+                record = await queue.get()
+                if record is not None and record.event is not None:
+                    self.aggregator.add(self.node_id, record.log, record.event.to_dict())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for log in self.aggregate_logs:
+                self.hub.unsubscribe(log, queue)
+
     def get_server_ip(self):
         '''
         get_server_ip is a method that gets the IP address of the server.
@@ -79,41 +505,538 @@ class LogDogAPI(LogDog):
         finally:
             s.close()
         return ip
+
+    def check_log_name(self, log: str):
+        '''
+        check_log_name is a method that rejects a log name that is not a plain file prefix of log_directory.
+
+        It is shared by the routes that take a log name from the client (watch_log, watch_events, watch, read_log and search), a name
+        with a / or that starts with . could read a file outside of log_directory (e.g. ../../../etc/passwd).
+
+        Parameters:
+            log: A string that represents the log file prefix passed by the client
+
+        Returns:
+            None
+
+        Exceptions:
+            HTTPException: An exception that is raised when the log name is not a plain file prefix (400)
+        '''
+        if not log or '/' in log or log.startswith('.'):
+            raise HTTPException(status_code=400, detail=f'Invalid log name: {log}')
     
-    async def watch_log(self, request: Request, interval: int = .1):
+    def stream(self, request: Request, logs: list, events: bool = False, named: bool = False, sessions: bool = False):
         '''
-        watch_log is a method that reads the log file and returns the log lines as a response in real-time using Server-Sent Events (SSE).
+        stream is a method that builds the Server-Sent Events (SSE) response shared by watch_log, watch_events and watch.
+        
+        The client gets one queue that is subscribed to the shared tailer of every requested log, so a single connection and a single
+        loop serve all the logs of a client. Lines that arrive together (e.g. a burst of network traffic) are coalesced into a single write
+        of up to stream_batch_max frames, waiting at most stream_batch_window seconds after the first line (capped by stream_max_latency).
+        The filter, regex, callsign and type query parameters build a StreamFilter (see filters.py) that is shared with every client that
+        uses the same one, lines that do not pass it are never queued for the client.
+        A client without a cursor for a log is first sent the snapshot of the log (see recent.py) as an SSE event named snapshot. Event
+        streams then skip the last line of the log, the snapshot already holds the recent events.
+        Every frame carries an SSE id that the browser sends back in the Last-Event-ID header when it reconnects.
+        With one log the id is the cursor of the line ("inode:offset"). With named frames the id holds the cursor of every log
+        ("MMDVM=inode:offset,YSFGateway=inode:offset") and each frame has an SSE event name that is the log it was read from.
+        With sessions, the state changes of the session tracker (see sessions.py) are sent on the same queue as frames named sessions, after
+        a snapshot of the open and recent sessions, and their cursor is part of the id.
         
         Parameters:
             request: A Request object that represents the request
-            interval: An integer that represents the interval between log reads
+            logs: A list of strings that represent the log file prefixes to follow
+            events: A boolean that represents whether to send the lines parsed into JSON events (see events.py) instead of the raw lines
+            named: A boolean that represents whether to send the log name as the SSE event name and the cursors of every log as the id
+            sessions: A boolean that represents whether to send the tx_start and tx_end state changes, with named frames
         
         Variables:
-            log_lines: A list of strings that represent the log lines
+            line_filter: A StreamFilter object built from the query parameters, or None to send every line
+            cursors: A dictionary that maps each log to the cursor of the last line sent to the client
+            queue: A SubscriberQueue object that receives the new log lines of every log from the tailers
+            snapshots: A string that represents the snapshot frames, sent first
+            backlog: A list of TailRecord objects that are sent before the new log lines
+            records: A list of TailRecord objects that are sent in one write
         
         Returns:
             StreamingResponse: A StreamingResponse object that represents the log lines in real-time using Server-Sent Events (SSE)
         
         Exceptions:
+            HTTPException: An exception that is raised when a log name is not a plain file prefix or the filter is invalid (400)
             asyncio.CancelledError: An exception that is raised when the connection is closed
         '''
+        for log in logs:
+            self.check_log_name(log)
+        params = request.query_params
+        try:
+            line_filter = shared_filter(term=params.get('filter'), regex=params.get('regex'), callsign=params.get('callsign'),
+                                        types=[type for value in params.getlist('type') for type in value.split(',')])
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f'Invalid regex: {e}')
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        last_event_id = request.headers.get('last-event-id', None) or request.query_params.get('last_event_id', None)
+        cursors = {}
+        if last_event_id and '=' in last_event_id:
+            for item in last_event_id.split(','):
+                log, _, cursor = item.partition('=')
+                cursors[log] = cursor
+        elif last_event_id:
+            cursors[logs[0]] = last_event_id
+        def frame(record):
+            data = record.event_json if events else record.line
+            if data is None:
+                return ''
+            cursors[record.log] = record.id
+            if named:
+                id = ','.join(f'{log}={cursor}' for log, cursor in cursors.items())
+                return f"event: {record.log}\nid: {id}\ndata: {data}\n\n"
+            return f"id: {record.id}\ndata: {data}\n\n"
+        stream = request.url.path.strip('/')
+        client = f'{request.client.host}:{request.client.port}' if request.client else None
         async def event_stream():
+            queue = SubscriberQueue(maxsize=self.hub.queue_size * len(logs), client=client, stream=stream)
+            snapshots = ''
+            backlog = []
             try:
+                for log in logs:
+                    _, records, snapshot = await self.hub.subscribe(log, cursors.get(log, None), queue, line_filter)
+                    if snapshot is not None:
+                        snapshots += f"event: snapshot\ndata: {snapshot}\n\n"
+                        if events:
+                            continue
+                    backlog += records
+                if sessions and self.sessions is not None:
+                    _, records, snapshot = self.sessions.subscribe(cursors.get('sessions', None), queue)
+                    if snapshot is not None:
+                        snapshots += f"event: snapshot\ndata: {snapshot}\n\n"
+                    backlog += records
+                if snapshots:
+                    yield snapshots
+                for start in range(0, len(backlog), self.batch_max):
+                    text = ''.join(frame(record) for record in backlog[start:start + self.batch_max])
+                    if text:
+                        yield text
                 while True:
-                    log_override = request.query_params.get('log_override', None)
-                    if log_override:
-                        log_lines = self.read_log(lines=1, log_override=log_override)
-                    else:
-                        log_lines = self.read_log(lines=1)
-                    for line in log_lines:
-                        yield f"data: {line}\n\n"
-                    await asyncio.sleep(interval)
+                    records = await queue.get_batch(self.batch_max, self.batch_window)
+                    text = ''.join(frame(record) for record in records)
+                    if text:
+                        self.writes_sent.inc()
+                        self.lines_sent.inc(len(records))
+                        yield text
             except asyncio.CancelledError:
                 pass
             finally:
-                print(f"Connection from {request.client.host} closed.")
+                for log in logs:
+                    self.hub.unsubscribe(log, queue)
+                if self.sessions is not None:
+                    self.sessions.unsubscribe(queue)
+                print(f"Connection from {request.client.host if request.client else 'unknown client'} closed.")
         return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+    async def watch_log(self, request: Request):
+        '''
+        watch_log is a method that returns new log lines as a response in real-time using Server-Sent Events (SSE).
+        
+        The client is subscribed to the shared tailer of the requested log and only receives lines as they are written.
+        Every line is sent with an SSE id that is the byte-offset cursor of the line. Browsers send the id of the last line they received
+        in the Last-Event-ID header when they reconnect, and the lines written in the meantime are replayed before new lines are streamed.
+        A new client (without Last-Event-ID) is sent the last line of the log first.
+        The poll interval and the per-client queue size are set with watch_interval and watch_queue_size in the config.json file.
+        Pass filter (a substring, like /read_log), regex, callsign or type (header, end, link or unlink) to only receive the matching lines.
+        
+        Parameters:
+            request: A Request object that represents the request
+        
+        Variables:
+            log_file: A string that represents the log file prefix to watch, self.log_file unless log_override is passed
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the log lines in real-time using Server-Sent Events (SSE)
+        '''
+        log_file = request.query_params.get('log_override', None) or self.log_file
+        return self.stream(request, [log_file])
+
+    async def watch_events(self, request: Request):
+        '''
+        watch_events is a method that returns the events parsed from new log lines as JSON in real-time using Server-Sent Events (SSE).
+        
+        Lines are parsed once on the server by the shared tailer (see events.py), lines that are not events are not sent.
+        Like watch_log, every event is sent with the cursor of its line as the SSE id so reconnecting clients resume where they left off,
+        and the same filter, regex, callsign and type parameters are accepted (e.g. /events?callsign=K3JLP&type=header).
+        
+        Parameters:
+            request: A Request object that represents the request
+        
+        Variables:
+            log_file: A string that represents the log file prefix to watch, self.log_file unless log_override is passed
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the events in real-time using Server-Sent Events (SSE)
+        '''
+        log_file = request.query_params.get('log_override', None) or self.log_file
+        return self.stream(request, [log_file], events=True)
+
+    async def watch(self, request: Request, log: list[str] = Query(None), events: bool = False, sessions: bool = False):
+        '''
+        watch is a method that streams several logs over a single Server-Sent Events (SSE) connection.
+        
+        Each frame is sent with the log it was read from as its SSE event name, so the browser can use addEventListener(log, ...) on one
+        EventSource instead of opening a connection per log. All the logs are backed by the same shared tailers as watch_log, and the
+        filter, regex, callsign and type parameters of watch_log apply to every log.
         
+        Parameters:
+            request: A Request object that represents the request
+            log: A list of strings that represent the log file prefixes to watch, pass log more than once for several logs (self.log_file by default)
+            events: A boolean that represents whether to send the lines parsed into JSON events instead of the raw lines
+            sessions: A boolean that represents whether to also send the tx_start and tx_end state changes of the transmissions (see sessions.py)
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the log lines in real-time using Server-Sent Events (SSE)
+        '''
+        logs = list(dict.fromkeys(log)) if log else [self.log_file]
+        if len(logs) > 8:
+            raise HTTPException(status_code=400, detail='Too many logs, at most 8 can be watched on one connection')
+        return self.stream(request, logs, events=events, named=True, sessions=sessions)
+
+    async def get_log(self, lines: int = None, filter: str = None, log_override: str = None, before: str = None, after: str = None):
+        '''
+        get_log is a coroutine that streams a page of log lines as NDJSON, see LogDog.read_page.
+        
+        Each line is sent as a JSON string on its own line as soon as it is read, and the last line is a JSON object with the cursors of
+        the older and newer pages ({"older": "...", "newer": "..."}), to pass as before or after to get the next page. A page holds at
+        most read_log_max_lines lines. The file is read in the executor, read_log_batch lines at a time, so a large export runs in
+        constant memory and the first lines arrive before the file has been read.
+        
+        Parameters:
+            lines: An integer that represents the number of lines of the page, the last lines of the log without a cursor
+            filter: A string that has to be in a line for it to be returned
+            log_override: A string that represents a log file prefix to read instead of self.log_file
+            before: A string that represents the cursor the page ends at (the older cursor of a previous page)
+            after: A string that represents the cursor the page starts at (the newer cursor of a previous page)
+        
+        Variables:
+            page: A generator of the lines of the page, followed by the cursors
+            first: A list of the first items of the page, read before the response starts so errors get a status code
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the lines as NDJSON
+        
+        Exceptions:
+            HTTPException: An exception that is raised when the log name, lines or the cursor is invalid (400), no log file is found (404)
+                or the file of the cursor is gone (410)
+        '''
+        if log_override is not None:
+            self.check_log_name(log_override)
+        if lines is not None and lines < 1:
+            raise HTTPException(status_code=400, detail='lines must be at least 1')
+        if before is not None and after is not None:
+            raise HTTPException(status_code=400, detail='Pass either before or after')
+        loop = asyncio.get_running_loop()
+        batch = max(1, int(getattr(self, 'read_log_batch', 256)))
+        page = self.read_page(lines, filter, log_override, before, after, limit=int(getattr(self, 'read_log_max_lines', 5000)))
+        read = lambda: list(itertools.islice(page, batch))
+        try:
+            first = await loop.run_in_executor(self.executor, read)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f'No log file found for {log_override or self.log_file}')
+        except CursorExpired as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        async def ndjson():
+            items = first
+            try:
+                while items:
+                    yield ''.join(json.dumps(item) + '\n' for item in items)
+                    items = await loop.run_in_executor(self.executor, read)
+            finally:
+                page.close()
+        return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+    async def websocket(self, websocket: WebSocket):
+        '''
+        websocket is a coroutine that serves a WebSocket client until it disconnects.
+        
+        The client subscribes and unsubscribes from logs by sending JSON messages, see api/sockets.py for the protocol.
+        Its queue holds at most ws_queue_size lines, and the overflow policy (drop_oldest, latest or disconnect) is ws_overflow_policy
+        from the config.json file unless the client passes the policy query parameter. Idle clients are pinged every ws_ping_interval seconds.
+        
+        Parameters:
+            websocket: A WebSocket object that represents the connection
+        
+        Variables:
+            client: A SocketClient object that serves the connection
+        
+        Returns:
+            None
+        '''
+        policy = websocket.query_params.get('policy', None) or getattr(self, 'ws_overflow_policy', 'drop_oldest')
+        try:
+            client = SocketClient(websocket, self.hub, queue_size=getattr(self, 'ws_queue_size', 100), policy=policy,
+                                  ping_interval=getattr(self, 'ws_ping_interval', 20))
+        except ValueError as e:
+            await websocket.close(code=1008, reason=str(e))
+            return
+        await websocket.accept()
+        await client.run()
+        print(f"WebSocket connection from {websocket.client.host if websocket.client else 'unknown client'} closed.")
+
+    def search(self, start: str = None, end: str = None, regex: str = None, term: list[str] = Query(None), log_override: str = None):
+        '''
+        search is a method that streams the log lines written during a time range across all the rotated files of a log.
+        
+        Each line is sent as a JSON string on its own line (NDJSON) as soon as it is found, see LogDog.search_log.
+        
+        Parameters:
+            start: A string that represents the earliest time (inclusive) in the format YYYY-MM-DD HH:MM:SS.mmm (UTC), a prefix is allowed
+            end: A string that represents the latest time (exclusive), a prefix is allowed
+            regex: A string that represents a regular expression that has to be found in the line
+            term: A list of strings that all have to be in the line, pass term more than once for several terms
+            log_override: A string that represents a log file prefix to search instead of self.log_file
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the matching lines as NDJSON
+        
+        Exceptions:
+            HTTPException: An exception that is raised when the log name or the regular expression is invalid (400)
+        '''
+        if log_override is not None:
+            self.check_log_name(log_override)
+        try:
+            lines = self.search_log(start=start, end=end, pattern=regex, terms=term, log_override=log_override)
+            first = next(lines, None)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f'Invalid regex: {e}')
+        def ndjson():
+            if first is None:
+                return
+            yield json.dumps(first) + '\n'
+            for line in lines:
+                yield json.dumps(line) + '\n'
+        return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+    def get_history(self, callsign: str = None, source: str = None, mode: str = None, type: str = None, since: str = None, until: str = None,
+                    limit: int = 50, cursor: str = None):
+        '''
+        get_history is a method that returns a page of the stored transmissions, newest first.
+        
+        Pass the next value of a response as cursor to get the following (older) page.
+        
+        Parameters:
+            callsign: A string that represents the callsign to match
+            source: A string that represents the source to match (RF or network)
+            mode: A string that represents the mode to match (e.g. YSF or DMR)
+            type: A string that represents the event type to match (header or end)
+            since: A string that represents the earliest time to return in the format YYYY-MM-DD HH:MM:SS.mmm (UTC), a prefix is allowed
+            until: A string that represents the latest time to return (exclusive), a prefix is allowed
+            limit: An integer that represents the maximum number of transmissions to return (at most 500)
+            cursor: A string that represents the next value of the previous page
+        
+        Returns:
+            dict: A dictionary with the transmissions under calls and the cursor of the next page under next
+        
+        Exceptions:
+            HTTPException: An exception that is raised when history is disabled (404) or the cursor is malformed (400)
+        '''
+        if self.history is None:
+            raise HTTPException(status_code=404, detail='History is disabled in config.json')
+        try:
+            return self.history.query(callsign=callsign, source=source, mode=mode, type=type, since=since, until=until,
+                                      limit=max(1, min(limit, 500)), before=cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+
+    def get_stats(self, top: int = 10, hours: int = 24):
+        '''
+        get_stats is a method that returns the activity statistics of the MMDVMHost log.
+        
+        Parameters:
+            top: An integer that represents the number of top callsigns to return for each period (at most 100)
+            hours: An integer that represents the number of hours to return the calls per hour for (at most 48)
+        
+        Returns:
+            dict: A dictionary with today, the last hour, the last 24 hours, the calls per hour and the calls per day (see ActivityStats.summary)
+        
+        Exceptions:
+            HTTPException: An exception that is raised when statistics are disabled (404)
+        '''
+        if self.stats is None:
+            raise HTTPException(status_code=404, detail='Statistics are disabled in config.json')
+        return dict(self.stats.summary(top=max(0, min(top, 100)), hours=max(1, min(hours, 48))), log=self.log_file)
+
+    def get_callbook(self, callsign: str):
+        '''
+        get_callbook is a method that returns the name and location of a callsign from the callbook.
+        
+        Parameters:
+            callsign: A string that represents the callsign
+        
+        Returns:
+            dict: A dictionary with the callsign and the name, city, state and country that are known
+        
+        Exceptions:
+            HTTPException: An exception that is raised when the callbook is disabled or the callsign is unknown (404)
+        '''
+        if self.callbook is None:
+            raise HTTPException(status_code=404, detail='The callbook is disabled in config.json')
+        record = self.callbook.lookup(callsign)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f'Unknown callsign: {callsign}')
+        return dict(record, callsign=callsign.upper())
+
+    async def aggregate(self, request: Request):
+        '''
+        aggregate is a method that streams the events of this instance and of its peers merged in time order using Server-Sent Events (SSE).
+        
+        Every client shares the single connection of the aggregator to each peer (see aggregator.py). A new client is first sent the last
+        merged events and the state of the peers as an SSE event named snapshot. Every event is sent with its cursor in the merged stream
+        as the SSE id, a client that reconnects with Last-Event-ID is sent the events it missed.
+        
+        Parameters:
+            request: A Request object that represents the request
+        
+        Variables:
+            queue: A SubscriberQueue object that receives the merged events
+        
+        Returns:
+            StreamingResponse: A StreamingResponse object that represents the merged events in real-time using Server-Sent Events (SSE)
+        
+        Exceptions:
+            HTTPException: An exception that is raised when no peers are set in config.json (404)
+        '''
+        if self.aggregator is None:
+            raise HTTPException(status_code=404, detail='No peers are set in config.json')
+        last_event_id = request.headers.get('last-event-id', None) or request.query_params.get('last_event_id', None)
+        client = f'{request.client.host}:{request.client.port}' if request.client else None
+        async def event_stream():
+            queue = SubscriberQueue(maxsize=self.hub.queue_size, client=client, stream='aggregate')
+            try:
+                queue, backlog, snapshot = self.aggregator.subscribe(last_event_id, queue)
+                if snapshot is not None:
+                    yield f"event: snapshot\ndata: {snapshot}\n\n"
+                for start in range(0, len(backlog), self.batch_max):
+                    yield ''.join(f"id: {record.id}\ndata: {record.json}\n\n" for record in backlog[start:start + self.batch_max])
+                while True:
+                    records = await queue.get_batch(self.batch_max, self.batch_window)
+                    text = ''.join(f"id: {record.id}\ndata: {record.json}\n\n" for record in records if record is not None)
+                    if text:
+                        self.writes_sent.inc()
+                        self.lines_sent.inc(len(records))
+                        yield text
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self.aggregator.unsubscribe(queue)
+        return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+    def get_peers(self):
+        '''
+        get_peers is a method that returns the state of the connection of the aggregator to each peer.
+        
+        Parameters:
+            None
+        
+        Returns:
+            dict: A dictionary with the node id of this instance and the peers (see PeerStream.status)
+        
+        Exceptions:
+            HTTPException: An exception that is raised when no peers are set in config.json (404)
+        '''
+        if self.aggregator is None:
+            raise HTTPException(status_code=404, detail='No peers are set in config.json')
+        return {'node': self.node_id, 'peers': self.aggregator.status()}
+
+    def get_sessions(self):
+        '''
+        get_sessions is a method that returns the transmissions in progress and the last ones, with their duration, BER and packet loss.
+        
+        Parameters:
+            None
+        
+        Returns:
+            dict: A dictionary with the open sessions under active and the last ended ones under recent (see SessionTracker.summary)
+        
+        Exceptions:
+            HTTPException: An exception that is raised when sessions are disabled (404)
+        '''
+        if self.sessions is None:
+            raise HTTPException(status_code=404, detail='Sessions are disabled in config.json')
+        return dict(self.sessions.summary(), log=self.log_file)
+
+    def stream_stats(self):
+        '''
+        stream_stats is a method that returns how the SSE writes are coalesced, to tune stream_batch_window and stream_batch_max.
+        
+        Parameters:
+            None
+        
+        Returns:
+            dict: A dictionary with the number of writes and lines sent since the API started, the average batch size and the settings
+        '''
+        writes = self.writes_sent.value
+        lines = self.lines_sent.value
+        return {'writes': writes, 'lines': lines, 'average_batch': round(lines / writes, 2) if writes else 0,
+                'batch_window': self.batch_window, 'batch_max': self.batch_max}
+
+    def metrics(self):
+        '''
+        metrics is a method that returns the metrics of the API in the Prometheus text format, for curl or a Prometheus scraper.
+        
+        Parameters:
+            None
+        
+        Returns:
+            PlainTextResponse: A PlainTextResponse object with the metrics of metrics.registry
+        '''
+        return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def collect_metrics(self):
+        '''
+        collect_metrics is a method that builds the metrics of the tailers and their clients when /metrics is read.
+        
+        The clients come and go, so their metrics are read from the queues subscribed to the tailers at that moment instead of being
+        kept up to date on every connection. A client that follows several logs shares one queue between their tailers and is counted once.
+        
+        Parameters:
+            None
+        
+        Variables:
+            clients: A Gauge of the clients subscribed to each log, by stream (the route or task of the client)
+            depth: A Gauge of the lines waiting in the queue of each client
+            dropped: A Gauge of the lines dropped from the queue of each client since it connected
+            filters: A Gauge of the distinct filters of each log
+            queues: A dictionary that maps the id of each queue to the queue, so shared queues are counted once
+        
+        Returns:
+            list: A list of Metric objects
+        '''
+        tailers = Gauge('logdog_tailers', 'Logs followed by a running tailer.')
+        clients = Gauge('logdog_clients', 'Clients subscribed to each log, by route or task.', ('log', 'stream'))
+        depth = Gauge('logdog_client_queue_depth', 'Lines waiting in the queue of each client.', ('client', 'stream'))
+        capacity = Gauge('logdog_client_queue_size', 'Maximum number of lines in the queue of each client.', ('client', 'stream'))
+        dropped = Gauge('logdog_client_dropped', 'Lines dropped from the queue of each client since it connected.', ('client', 'stream'))
+        filters = Gauge('logdog_filters', 'Distinct filters evaluated for each line of each log.', ('log',))
+        queues = {}
+        for log, tailer in list(self.hub.tailers.items()):
+            tailers.inc()
+            filters.labels(log).set(sum(1 for line_filter in list(tailer.groups) if line_filter is not None))
+            for queue in list(tailer.subscribers):
+                clients.labels(log, queue.stream or 'other').inc()
+                queues[id(queue)] = queue
+        for queue in queues.values():
+            labels = (queue.client or f'{id(queue):x}', queue.stream or 'other')
+            depth.labels(*labels).set(queue.qsize())
+            capacity.labels(*labels).set(queue.maxsize)
+            dropped.labels(*labels).set(queue.dropped)
+        metrics = [tailers, clients, filters, depth, capacity, dropped]
+        if self.aggregator is not None:
+            peers = Gauge('logdog_peer_connected', 'Whether the stream of each peer is open.', ('node',))
+            for stream in self.aggregator.streams:
+                peers.labels(stream.node).set(1 if stream.connected else 0)
+            aggregate = Gauge('logdog_aggregate_clients', 'Clients of the merged stream of the peers.')
+            aggregate.set(len(self.aggregator.subscribers))
+            metrics += [peers, aggregate]
+        return metrics
 
     def run(self):
         '''
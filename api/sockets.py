@@ -0,0 +1,294 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from starlette.websockets import WebSocket
+from tailer import SubscriberQueue
+from filters import shared_filter
+from metrics import STREAM_LINES, STREAM_WRITES
+
+'''
+SocketClient is a class that serves one WebSocket client of LogDogAPI.
+
+The SSE routes cannot tell whether a client keeps up: a stalled phone on bad Wi-Fi just makes the response buffer grow, and a client
+that disappears is only noticed when the write fails. A SocketClient reads from a bounded SubscriberQueue shared by all the logs it is
+subscribed to, and the overflow policy of the queue (drop_oldest, latest or disconnect) decides what happens when the client falls behind,
+so memory stays bounded however bad the clients are. The client is pinged when it is idle and closed when it stops answering.
+
+Clients subscribe and unsubscribe from logs, and change the filter or format of a log, without reconnecting by sending JSON messages:
+    {"action": "subscribe", "log": "MMDVM", "events": true, "filter": "K3JLP", "cursor": "123:456"}
+    {"action": "subscribe", "log": "MMDVM", "events": true, "callsign": "K3JLP", "type": ["header", "end"], "regex": "TG 91"}
+    {"action": "unsubscribe", "log": "MMDVM"}
+    {"action": "pong"}
+
+The server sends JSON messages:
+    {"log": "MMDVM", "id": "123:789", "line": "M: 2024-04-04 ..."} for raw lines
+    {"log": "MMDVM", "id": "123:789", "event": {...}} for events
+    {"type": "snapshot", "log": "MMDVM", "events": [...], ...} the recent events and state of a log (see recent.py), before its lines
+    {"type": "subscribed", "log": "MMDVM"}, {"type": "unsubscribed", "log": "MMDVM"}, {"type": "ping"} and {"type": "error", "detail": "..."}
+
+Attributes:
+    websocket: A WebSocket object that represents the connection
+    hub: A TailHub object that provides the tailers
+    queue: A SubscriberQueue object that receives the new log lines of every subscribed log
+    subscriptions: A dictionary that maps each subscribed log to its options (events and the StreamFilter applied by the tailer)
+    outbox: A deque object that holds the messages to the client (snapshots, replies to its messages) and the replayed lines of new
+        subscriptions in order, sent before the queue. Only the sender task writes to the WebSocket, so messages never interleave and the
+        snapshot of a log is always sent before its lines
+
+Methods:
+    run: A coroutine that serves the client until it disconnects
+    subscribe: A coroutine that subscribes the client to a log or changes the options of a subscription
+    unsubscribe: A method that unsubscribes the client from a log
+
+Exceptions:
+    WebSocketDisconnect: An exception that is raised when the client disconnects
+'''
+
+class SocketClient:
+    def __init__(self, websocket: WebSocket, hub, queue_size: int = 100, policy: str = 'drop_oldest', ping_interval: float = 20):
+        '''
+        SocketClient constructor.
+
+        Parameters:
+            websocket: A WebSocket object that represents the connection
+            hub: A TailHub object that provides the tailers
+            queue_size: An integer that represents the maximum number of lines queued for the client
+            policy: A string that represents the overflow policy of the queue (drop_oldest, latest or disconnect)
+            ping_interval: A float that represents the number of idle seconds before the client is pinged, it is closed after two unanswered intervals
+
+        Returns:
+            None
+
+        Exceptions:
+            ValueError: An exception that is raised when the policy is unknown
+        '''
+        self.websocket = websocket
+        self.hub = hub
+        client = f'{websocket.client.host}:{websocket.client.port}' if websocket.client else None
+        self.queue = SubscriberQueue(maxsize=queue_size, policy=policy, client=client, stream='ws')
+        self.writes_sent = STREAM_WRITES.labels('ws')
+        self.lines_sent = STREAM_LINES.labels('ws')
+        self.ping_interval = ping_interval
+        self.subscriptions = {}
+        self.outbox = deque()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.last_seen = time.monotonic()
+
+    async def subscribe(self, log: str, events: bool = False, filter: str = None, cursor: str = None, regex: str = None, callsign: str = None,
+                  types: list = None):
+        '''
+        subscribe is a coroutine that subscribes the client to a log, or changes the options of an existing subscription.
+
+        The lines to replay (the last line of the log, or the lines written after cursor) are sent before any new line of the log.
+        Without a cursor the snapshot of the log is sent first, then the subscribed reply, and an events subscription skips the last line the snapshot already holds.
+        The filter is applied by the tailer and shared with the other clients that use the same one (see filters.py).
+
+        Parameters:
+            log: A string that represents the log file prefix
+            events: A boolean that represents whether to send the lines parsed into JSON events instead of the raw lines
+            filter: A string that has to be in a line for it to be sent
+            cursor: A string that represents the cursor of the last line the client received, to replay the lines written since
+            regex: A string that represents a regular expression that has to be found in a line for it to be sent
+            callsign: A string that represents the callsign of the events to send
+            types: A list of strings that represent the event types to send (header, end, link or unlink)
+
+        Returns:
+            None
+
+        Exceptions:
+            ValueError: An exception that is raised when an event type is unknown
+            re.error: An exception that is raised when the regular expression is invalid
+        '''
+        line_filter = shared_filter(term=filter, regex=regex, callsign=callsign, types=types)
+        options = {'events': bool(events), 'filter': line_filter}
+        if log in self.subscriptions:
+            self.subscriptions[log] = options
+            self.hub.set_filter(log, self.queue, line_filter)
+            self.post(json.dumps({'type': 'subscribed', 'log': log}))
+            return
+        self.subscriptions[log] = options
+        try:
+            _, backlog, snapshot = await self.hub.subscribe(log, cursor, self.queue, line_filter)
+        except BaseException:
+            self.subscriptions.pop(log, None)
+            raise
+        if snapshot is not None:
+            self.post('{"type":"snapshot",' + snapshot[1:])
+            if events:
+                backlog = []
+        self.post(json.dumps({'type': 'subscribed', 'log': log}))
+        self.outbox.extend(backlog)
+        self.wake()
+
+    def post(self, text: str):
+        '''
+        post is a method that queues a message for the sender task, after the messages and replayed lines already queued.
+
+        Parameters:
+            text: A string that represents the JSON message
+
+        Returns:
+            None
+        '''
+        self.outbox.append(text)
+        self.wake()
+
+    def wake(self):
+        '''
+        wake is a method that wakes up the sender when the outbox holds messages, so it sends them before reading the queue again.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        if self.outbox:
+            self.drained.clear()
+            if self.queue.empty():
+                # The sender may be waiting on the empty queue
+                self.queue.put_nowait(None)
+
+    def unsubscribe(self, log: str):
+        '''
+        unsubscribe is a method that unsubscribes the client from a log, lines of the log that are still queued are not sent.
+
+        Parameters:
+            log: A string that represents the log file prefix
+
+        Returns:
+            None
+        '''
+        if self.subscriptions.pop(log, None) is not None:
+            self.hub.unsubscribe(log, self.queue)
+
+    def message(self, record):
+        '''
+        message is a method that formats a record for the client according to the options of its log.
+
+        Parameters:
+            record: A TailRecord object
+
+        Returns:
+            str: A string that represents the JSON message, or None if the record should not be sent
+        '''
+        options = self.subscriptions.get(record.log)
+        if options is None:
+            return None
+        if options['events']:
+            if record.event_json is None:
+                return None
+            return f'{{"log":{json.dumps(record.log)},"id":"{record.id}","event":{record.event_json}}}'
+        return json.dumps({'log': record.log, 'id': record.id, 'line': record.line}, separators=(',', ':'))
+
+    async def send(self):
+        '''
+        send is a coroutine that sends the outbox and the queued lines to the client and pings it when there is nothing to send.
+
+        It is the only task that writes to the WebSocket.
+
+        The client is closed when its queue overflowed with the disconnect policy or when it did not send anything for two ping intervals.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        while True:
+            if self.outbox:
+                record = self.outbox.popleft()
+                if isinstance(record, str):
+                    await self.websocket.send_text(record)
+                    if not self.outbox:
+                        self.drained.set()
+                    continue
+                if not self.outbox:
+                    self.drained.set()
+            else:
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout=self.ping_interval)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - self.last_seen > 2 * self.ping_interval:
+                        await self.websocket.close(code=1001, reason='Ping timeout')
+                        return
+                    await self.websocket.send_text('{"type":"ping"}')
+                    continue
+                if self.queue.overflowed:
+                    await self.websocket.close(code=1013, reason='Client too slow')
+                    return
+                if record is None:
+                    continue
+            text = self.message(record)
+            if text is not None:
+                await self.websocket.send_text(text)
+                self.writes_sent.inc()
+                self.lines_sent.inc()
+
+    async def receive(self):
+        '''
+        receive is a coroutine that handles the messages of the client until it disconnects.
+
+        The replies are posted to the sender, and the next message is only read once they were sent so a client that sends messages
+        faster than it reads the replies does not grow the outbox.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+
+        Exceptions:
+            WebSocketDisconnect: An exception that is raised when the client disconnects
+        '''
+        while True:
+            await self.drained.wait()
+            text = await self.websocket.receive_text()
+            self.last_seen = time.monotonic()
+            try:
+                message = json.loads(text)
+                action = message.get('action')
+                log = message.get('log')
+            except (ValueError, AttributeError):
+                self.post('{"type":"error","detail":"Messages must be JSON objects"}')
+                continue
+            if action in ('subscribe', 'unsubscribe') and (not isinstance(log, str) or not log or '/' in log or log.startswith('.')):
+                self.post(json.dumps({'type': 'error', 'detail': f'Invalid log name: {log}'}))
+            elif action == 'subscribe':
+                types = message.get('type')
+                try:
+                    await self.subscribe(log, message.get('events', False), message.get('filter'), message.get('cursor'), message.get('regex'),
+                                         message.get('callsign'), [types] if isinstance(types, str) else types)
+                except re.error as e:
+                    self.post(json.dumps({'type': 'error', 'detail': f'Invalid regex: {e}'}))
+                except (ValueError, TypeError, AttributeError) as e:
+                    self.post(json.dumps({'type': 'error', 'detail': str(e)}))
+            elif action == 'unsubscribe':
+                self.unsubscribe(log)
+                self.post(json.dumps({'type': 'unsubscribed', 'log': log}))
+            elif action not in ('pong', 'ping'):
+                self.post(json.dumps({'type': 'error', 'detail': f'Unknown action: {action}'}))
+
+    async def run(self):
+        '''
+        run is a coroutine that serves the client until it disconnects, is too slow or stops answering pings.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        sender = asyncio.create_task(self.send())
+        receiver = asyncio.create_task(self.receive())
+        try:
+            await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (sender, receiver):
+                task.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
+            for log in list(self.subscriptions):
+                self.unsubscribe(log)
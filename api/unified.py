@@ -0,0 +1,138 @@
+import os
+import time
+from fastapi import HTTPException, Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from api.api import LogDogAPI
+from web.assets import Assets
+
+'''
+CallerIDApp is a class that serves the web interface and the API from a single ASGI application.
+
+By default launcher.py starts two interpreters: CallerID (Flask, web/web.py) on web_port for the page and LogDogAPI (FastAPI, api/api.py)
+on api_port for the data. On a Pi Zero that is two copies of Python and of a web framework in memory, two LogDog objects, a CORS
+preflight for every cross-origin request of the page and two ports to open. CallerIDApp extends LogDogAPI with the index page and the
+static files of web/, so the page and every API route (/read_log, /watch_log, /events, /watch, /ws, /search, /history) are served by
+one uvicorn worker on web_port and the page reaches the API on its own origin.
+
+The index template is shared with CallerID, so the same url_for and asset functions are provided to the Jinja2 environment here, and
+the files built by python -m web.assets are served precompressed from /static/dist/ with immutable cache headers like in CallerID.
+
+Start it with ./launcher.py --single or python -m api.unified.
+
+Attributes:
+    templates: A Jinja2Templates object that renders the templates of web/templates
+    assets: An Assets object that maps the static files to their built copies
+    started: A float that represents the time it took to build the application in seconds
+
+Methods:
+    index: A method that renders the index.html template
+    url_for: A method that returns the URL of a static file, like Flask's url_for
+    built_asset: A method that serves a built static file
+    run: A method that runs the application on web_port
+
+Returns:
+    None
+'''
+
+web_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'web')
+
+
+class CallerIDApp(LogDogAPI):
+    def __init__(self):
+        '''
+        CallerIDApp constructor that adds the index route, the static files and the templates to the LogDogAPI application.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        start = time.monotonic()
+        super().__init__()
+        self.templates = Jinja2Templates(directory=os.path.join(web_directory, 'templates'))
+        self.assets = Assets()
+        self.templates.env.globals['url_for'] = self.url_for
+        self.templates.env.globals['asset'] = self.assets.url
+        self.app.add_api_route('/', self.index, include_in_schema=False)
+        # Registered before the /static mount so the built files are not served by StaticFiles
+        self.app.add_api_route('/static/dist/{filename:path}', self.built_asset, include_in_schema=False)
+        self.app.mount('/static', StaticFiles(directory=os.path.join(web_directory, 'static')), name='static')
+        self.started = time.monotonic() - start
+
+    def url_for(self, endpoint: str, filename: str = None):
+        '''
+        url_for is a method that returns the URL of a static file with the signature of Flask's url_for used by the templates.
+
+        Parameters:
+            endpoint: A string that represents the endpoint, only static is supported
+            filename: A string that represents the path of the file in web/static
+
+        Returns:
+            str: A string that represents the URL of the file
+
+        Exceptions:
+            ValueError: An exception that is raised when the endpoint is not static
+        '''
+        if endpoint != 'static':
+            raise ValueError(f'Unknown endpoint: {endpoint}')
+        return f'/static/{filename}'
+
+    async def built_asset(self, request: Request, filename: str):
+        '''
+        built_asset is a method that serves a static file built by python -m web.assets, precompressed and cached forever.
+
+        Parameters:
+            request: A Request object that represents the request
+            filename: A string that represents the path of the hashed file in web/static/dist
+
+        Returns:
+            Response: A FileResponse object with the brotli, gzip or plain copy of the file, or an empty 304 response if the browser already has it
+
+        Exceptions:
+            HTTPException: An exception that is raised when the file was not built (404)
+        '''
+        found = self.assets.find(filename, request.headers.get('accept-encoding', ''), request.headers.get('if-none-match'))
+        if found is None:
+            raise HTTPException(status_code=404, detail='Not Found')
+        status, path, headers, mimetype = found
+        if status == 304:
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=mimetype, headers=headers)
+
+    async def index(self, request: Request):
+        '''
+        index is a method that renders the index.html template.
+
+        The API base is the origin the page was loaded from, so the browser opens the streams on the same origin and port.
+        The table of the page keeps at most dashboard_max_rows rows (200 by default).
+
+        Parameters:
+            request: A Request object that represents the request
+
+        Returns:
+            TemplateResponse: A TemplateResponse object that represents the rendered page
+        '''
+        return self.templates.TemplateResponse(request, 'index.html', {'callsign': self.callsign, 'server_ip': self.server_ip,
+                                                                      'log_file': self.log_file, 'api_base': str(request.base_url).rstrip('/'),
+                                                                      'max_rows': int(getattr(self, 'dashboard_max_rows', 200))})
+
+    def run(self):
+        '''
+        run is a method that runs the application.
+
+        The application is served on web_port, the port browsers already use for the web interface, instead of api_port.
+        '''
+        import uvicorn
+        print(f'Application built in {self.started * 1000:.0f} ms')
+        uvicorn.run(self.app, host=self.host, port=self.web_port)
+
+if __name__ == '__main__':
+    '''
+    Main method that creates an instance of CallerIDApp and runs the application.
+    '''
+    p = CallerIDApp()
+    print(f'Starting CallerID on http://{p.host}:{p.web_port}')
+    p.run()
@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import datetime
+import tempfile
+import subprocess
+from collections import Counter
+from events import parse_line
+from bench.generator import LogGenerator, timestamp
+from bench.micro import environment
+
+'''
+aggregate is a module that checks the merged stream of /aggregate end to end on one machine (a loopback harness).
+
+The harness starts two peers and an aggregator, each LogDogAPI in its own process with a config.json that points at its own temporary
+log directory, the aggregator with the two peers in peers and without its local logs. LogGenerator writes the MMDVMHost and YSFGateway
+logs of both peers with the same seed, so every transmission is heard by both of them like two hotspots linked to the same talkgroup.
+A viewer follows /aggregate on the aggregator while the logs are written in two phases:
+    steady: Both peers are up for duration seconds
+    outage: The second peer is killed for outage seconds and started again while its logs are still written, and the viewer drops
+        its connection and reconnects with the SSE id of the last event it received
+
+The harness checks:
+    order: The events of the steady phase are received in the order of their timestamps
+    dedupe: Each network event of the steady phase is received once, heard by both nodes, RF events are received once per node
+    lossless: Every event written to the logs of each node reached the aggregator, the events written while the second peer was down
+        included. An event is received as the event of the node or as a copy merged into the nodes of another event. A copy that
+        arrives after the event it copies was released is not sent again (see aggregator.py), the copies that are missing from the
+        stream have to be counted in logdog_peer_duplicates_total instead
+    resume: The ids of the events the viewer received follow each other without a gap across its reconnection
+
+Results are printed (or written with --output) as JSON and the exit status is 1 when a check fails.
+
+Classes:
+    AggregateHarness: A class that runs the peers, the aggregator, the generators and the viewer and checks the merged stream
+
+Functions:
+    event_key: A function that returns the fields of an event that are the same on every node that heard it
+'''
+
+repository = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+NODES = ('peer1', 'peer2')
+
+
+def event_key(log: str, event: dict):
+    '''
+    event_key is a function that returns the fields of an event that are the same on every node that heard it.
+
+    The time is left out, each node logs the transmission at the time it heard it.
+
+    Parameters:
+        log: A string that represents the log the event was parsed from
+        event: A dictionary that represents the event (see LogEvent.to_dict)
+
+    Returns:
+        tuple: A tuple of the log, type, mode, slot, source, callsign and destination of the event
+    '''
+    return (log,) + tuple(event.get(field) for field in ('type', 'mode', 'slot', 'source', 'callsign', 'destination'))
+
+
+class AggregateHarness:
+    def __init__(self, rate: float = 20, duration: float = 10, outage: float = 3, port: int = 8092):
+        '''
+        AggregateHarness constructor.
+
+        Parameters:
+            rate: A float that represents the number of lines written per second to the logs of each peer
+            duration: A float that represents the number of seconds of each phase
+            outage: A float that represents the number of seconds the second peer is down for
+            port: An integer that represents the port of the aggregator, the peers listen on the next two ports
+
+        Variables:
+            received: A list of (sequence, event) tuples of the merged events received by the viewer, in the order they were received
+            cursor: A string that represents the SSE id of the last event received by the viewer
+            snapshot: An integer that represents the sequence of the last event in the snapshot of the first connection of the viewer
+
+        Returns:
+            None
+        '''
+        self.rate = rate
+        self.duration = duration
+        self.outage = outage
+        self.port = port
+        self.ports = {node: port + index + 1 for index, node in enumerate(NODES)}
+        self.received = []
+        self.cursor = None
+        self.snapshot = None
+
+    def start_server(self, directory: str, port: int, overrides: dict):
+        '''
+        start_server is a method that writes a config.json to a directory and starts LogDogAPI from it.
+
+        Parameters:
+            directory: A string that represents the working directory of the API, its logs are in the logs subdirectory
+            port: An integer that represents the port the API listens on
+            overrides: A dictionary of config.json values to set for the API (e.g. node_id or peers)
+
+        Returns:
+            subprocess.Popen: A Popen object that represents the API process
+        '''
+        with open(os.path.join(repository, 'config.json')) as f:
+            config = json.load(f)
+        config.update({'host': '127.0.0.1', 'api_port': port, 'debug': 'False', 'log_directory': os.path.join(directory, 'logs'),
+                       'history_enabled': 'False', 'stats_enabled': 'False', 'callbook_enabled': 'False', 'sessions_enabled': 'False'})
+        config.update(overrides)
+        with open(os.path.join(directory, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=4)
+        environment = dict(os.environ, PYTHONPATH=repository)
+        return subprocess.Popen([sys.executable, '-m', 'api.api'], cwd=directory, env=environment, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+
+    async def request(self, port: int, path: str):
+        '''
+        request is a coroutine that sends a GET request to an API and returns its body.
+
+        Parameters:
+            port: An integer that represents the port of the API
+            path: A string that represents the path of the request
+
+        Returns:
+            str: A string that represents the body, None if the API cannot be reached
+        '''
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            return None
+        writer.write(f'GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.partition(b'\r\n\r\n')[2].decode(errors='replace')
+
+    async def duplicates(self):
+        '''
+        duplicates is a coroutine that reads the number of copies of network transmissions each node sent from /metrics of the aggregator.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary that maps each node to the number of copies the aggregator dropped
+        '''
+        text = await self.request(self.port, '/metrics') or ''
+        counts = dict.fromkeys(NODES, 0)
+        for line in text.splitlines():
+            for node in NODES:
+                if line.startswith(f'logdog_peer_duplicates_total{{node="{node}"}} '):
+                    counts[node] = int(float(line.split()[1]))
+        return counts
+
+    async def wait_for_peers(self, timeout: float = 30):
+        '''
+        wait_for_peers is a coroutine that waits until the aggregator follows the stream of every peer.
+
+        Parameters:
+            timeout: A float that represents the number of seconds to wait
+
+        Returns:
+            None
+
+        Exceptions:
+            TimeoutError: An exception that is raised when a peer is not followed in time
+        '''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                status = json.loads(await self.request(self.port, '/peers') or 'null')
+            except ValueError:
+                status = None
+            if status and all(peer['connected'] for peer in status['peers']):
+                return
+            await asyncio.sleep(.2)
+        raise TimeoutError('The aggregator did not connect to every peer')
+
+    async def viewer(self, ready: asyncio.Event):
+        '''
+        viewer is a coroutine that follows /aggregate and records every merged event, resuming from the cursor when there is one.
+
+        Parameters:
+            ready: An asyncio.Event object that is set once the response started
+
+        Returns:
+            None
+        '''
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port, limit=1 << 20)
+        resume = f'Last-Event-ID: {self.cursor}\r\n' if self.cursor else ''
+        writer.write(f'GET /aggregate HTTP/1.0\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n{resume}\r\n'.encode())
+        await writer.drain()
+        fields = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.rstrip(b'\r\n').decode()
+                if line.startswith('HTTP/'):
+                    ready.set()
+                if line:
+                    name, _, value = line.partition(': ')
+                    fields[name] = value
+                    continue
+                if fields.get('event') == 'snapshot':
+                    cursor = json.loads(fields['data'])['id']
+                    self.snapshot = int(cursor.split(':')[1]) if cursor else 0
+                elif 'data' in fields and 'id' in fields:
+                    self.cursor = fields['id']
+                    self.received.append((int(fields['id'].split(':')[1]), json.loads(fields['data'])))
+                fields = {}
+        finally:
+            writer.close()
+
+    def expected(self, directory: str, start: str):
+        '''
+        expected is a method that parses the events written to the logs of a peer since a time.
+
+        Parameters:
+            directory: A string that represents the working directory of the peer
+            start: A string that represents the earliest time in the log format
+
+        Returns:
+            list: A list of (log, event) tuples, the event as a dictionary
+        '''
+        events = []
+        logs = os.path.join(directory, 'logs')
+        for name in sorted(os.listdir(logs)):
+            with open(os.path.join(logs, name)) as f:
+                for line in f:
+                    event = parse_line(line.rstrip('\n'))
+                    if event is not None and event.time >= start:
+                        events.append((name.split('-', 1)[0], event.to_dict()))
+        return events
+
+    def check(self, directories: dict, start: str, middle: str, copies: dict):
+        '''
+        check is a method that compares the merged events received by the viewer with the events written to the logs of the peers.
+
+        Parameters:
+            directories: A dictionary that maps each node to its working directory
+            start: A string that represents the time the steady phase started, in the log format
+            middle: A string that represents the time the outage phase started, in the log format
+            copies: A dictionary that maps each node to the number of copies the aggregator dropped since the steady phase started
+
+        Variables:
+            late: A dictionary that maps each node to the number of its copies that arrived after the event they copy was released
+
+        Returns:
+            dict: A dictionary with the result of each check, under passed whether they all passed
+        '''
+        received = [(sequence, event) for sequence, event in self.received if event.get('time', '') >= start]
+        steady = [event for _, event in received if event['time'] < middle]
+        inversions = sum(1 for previous, event in zip(steady, steady[1:]) if event['time'] < previous['time'])
+        written = {node: self.expected(directory, start) for node, directory in directories.items()}
+        network = [(log, event) for log, event in written[NODES[0]] if event.get('source') == 'network' and event['time'] < middle]
+        merged = sum(1 for event in steady if event.get('source') == 'network' and len(event['nodes']) == len(NODES))
+        unmerged = sum(1 for event in steady if event.get('source') == 'network' and len(event['nodes']) < len(NODES))
+        lost = {}
+        late = {}
+        for node, events in written.items():
+            heard = Counter(event_key(event['log'], event) for _, event in received if node in event['nodes'])
+            missing = Counter(event_key(log, event) for log, event in events) - heard
+            late[node] = copies[node] - sum(1 for _, event in received if node in event['nodes'][1:])
+            copied = sum(count for key, count in missing.items() if key[4] == 'network')
+            lost[node] = sum(missing.values()) - copied + max(0, copied - late[node])
+        sequences = [sequence for sequence, _ in self.received]
+        first = self.snapshot + 1 if self.snapshot is not None else (sequences[0] if sequences else 0)
+        gaps = len(set(range(first, sequences[-1] + 1)) - set(sequences)) if sequences else 0
+        duplicated = len(sequences) - len(set(sequences))
+        results = {
+            'order': {'events': len(steady), 'inversions': inversions, 'passed': inversions == 0},
+            'dedupe': {'network_written': len(network), 'merged': merged, 'unmerged': unmerged,
+                       'passed': unmerged == 0 and merged == len(network)},
+            'lossless': {'written': {node: len(events) for node, events in written.items()}, 'late_copies': late, 'lost': lost,
+                         'passed': not any(lost.values())},
+            'resume': {'received': len(sequences), 'gaps': gaps, 'duplicated': duplicated, 'passed': gaps == 0 and duplicated == 0},
+        }
+        results['passed'] = all(result['passed'] for result in results.values())
+        return results
+
+    async def write(self, generators: dict, duration: float):
+        '''
+        write is a coroutine that writes the logs of every peer at the same time, each generator in a thread.
+
+        Parameters:
+            generators: A dictionary that maps each node to its LogGenerator object
+            duration: A float that represents the number of seconds to write for
+
+        Returns:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, generator.run, self.rate, duration) for generator in generators.values()))
+
+    async def measure(self, directories: dict, processes: dict):
+        '''
+        measure is a coroutine that runs the two phases and checks the merged stream.
+
+        Parameters:
+            directories: A dictionary that maps each node and the aggregator to its working directory
+            processes: A dictionary that maps each node and the aggregator to its API process, the second peer is restarted
+
+        Returns:
+            dict: A dictionary with the results of the checks
+        '''
+        await self.wait_for_peers()
+        ready = asyncio.Event()
+        viewer = asyncio.create_task(self.viewer(ready))
+        await asyncio.wait_for(ready.wait(), timeout=10)
+        generators = {node: LogGenerator(os.path.join(directories[node], 'logs'), seed=1) for node in NODES}
+        baseline = await self.duplicates()
+        start = timestamp(datetime.datetime.now(datetime.timezone.utc))
+        await self.write(generators, self.duration)
+        # Let the last events of the steady phase be released before the outage
+        await asyncio.sleep(1)
+        middle = timestamp(datetime.datetime.now(datetime.timezone.utc))
+        outage = asyncio.create_task(self.write(generators, self.duration))
+        await asyncio.sleep(self.duration / 4)
+        # Killed like a crash or a power cut, a graceful shutdown would wait for the stream of the aggregator to close
+        processes[NODES[1]].kill()
+        processes[NODES[1]].wait(timeout=10)
+        viewer.cancel()
+        await asyncio.gather(viewer, return_exceptions=True)
+        await asyncio.sleep(self.outage)
+        processes[NODES[1]] = self.start_server(directories[NODES[1]], self.ports[NODES[1]], {'node_id': NODES[1]})
+        ready = asyncio.Event()
+        viewer = asyncio.create_task(self.viewer(ready))
+        await asyncio.wait_for(ready.wait(), timeout=10)
+        await outage
+        await self.wait_for_peers()
+        # Give the events replayed by the second peer time to be released
+        await asyncio.sleep(2)
+        viewer.cancel()
+        await asyncio.gather(viewer, return_exceptions=True)
+        copies = {node: count - baseline[node] for node, count in (await self.duplicates()).items()}
+        return self.check({node: directories[node] for node in NODES}, start, middle, copies)
+
+    def run(self):
+        '''
+        run is a method that runs the harness in temporary directories and stops the APIs afterwards.
+
+        Returns:
+            dict: A dictionary with the environment, the settings and the results
+        '''
+        directories = {node: tempfile.mkdtemp(prefix=f'logdog-{node}-') for node in NODES + ('aggregator',)}
+        processes = {}
+        try:
+            for node in NODES:
+                os.makedirs(os.path.join(directories[node], 'logs'))
+                # The tailers need a file to follow before the aggregator connects
+                LogGenerator(os.path.join(directories[node], 'logs'), seed=0).run(rate=100, duration=.05)
+                processes[node] = self.start_server(directories[node], self.ports[node], {'node_id': node})
+            os.makedirs(os.path.join(directories['aggregator'], 'logs'))
+            peers = {node: f'http://127.0.0.1:{self.ports[node]}' for node in NODES}
+            processes['aggregator'] = self.start_server(directories['aggregator'], self.port,
+                                                        {'node_id': 'aggregator', 'peers': peers, 'aggregate_local': False})
+            results = asyncio.run(self.measure(directories, processes))
+        finally:
+            for process in processes.values():
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            for directory in directories.values():
+                shutil.rmtree(directory, ignore_errors=True)
+        settings = {'rate': self.rate, 'duration': self.duration, 'outage': self.outage}
+        return {'benchmark': 'aggregate', 'environment': environment(), 'settings': settings, **results}
+
+
+if __name__ == '__main__':
+    '''
+    This block of code runs the loopback harness, e.g. python -m bench.aggregate --rate 40 --duration 20 --outage 5
+    '''
+    arg_parser = argparse.ArgumentParser(description='Check the merged stream of two peers and an aggregator on one machine')
+    arg_parser.add_argument('--rate', type=float, default=20, help='Lines written per second to the logs of each peer')
+    arg_parser.add_argument('--duration', type=float, default=10, help='Seconds of each phase')
+    arg_parser.add_argument('--outage', type=float, default=3, help='Seconds the second peer is down for')
+    arg_parser.add_argument('--port', type=int, default=8092, help='Port of the aggregator, the peers use the next two ports')
+    arg_parser.add_argument('--output', default=None, help='File to write the JSON results to instead of stdout')
+    args = arg_parser.parse_args()
+    results = AggregateHarness(args.rate, args.duration, args.outage, args.port).run()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+    sys.exit(0 if results['passed'] else 1)
@@ -0,0 +1,270 @@
+import os
+import time
+import random
+import argparse
+import datetime
+
+'''
+generator is a module that writes realistic MMDVMHost and YSFGateway log lines for the benchmarks.
+
+The lines follow the formats parsed by events.py: transmissions on YSF and both DMR slots from RF and the network (header, end with
+duration, packet loss and BER, lost transmissions and watchdog expiry) mixed with the debug and info lines MMDVMHost writes between
+them, and reflector links and unlinks in the YSFGateway log. Pi-Star writes one file per day per log (MMDVM-2024-04-04.log), rotation
+is simulated by moving to the next date after a number of seconds.
+
+LogGenerator can fill a file up to a size in one go (for the tail and search microbenchmarks) or write to the live logs at a rate
+(for the load harness). With sequence set, every line ends with " #<n>" so the readers can find lost and duplicated lines.
+
+Classes:
+    LogGenerator: A class that generates log lines and writes them to files
+
+Functions:
+    timestamp: A function that formats a time in the log format
+'''
+
+CALLSIGNS = ('K3JLP', 'W1AW', 'N0CALL', 'KD2ABC', 'VE3XYZ', 'G4ABC', 'DL1ABC', 'JA1ABC', 'VK2ABC', 'KC1DEF', 'WA6XYZ', 'N2GHI')
+REFLECTORS = ('AMERICA-LINK', 'US-KCWIDE', 'FCS00290', 'YSF-MIDWEST', 'US NJ-LINK')
+
+
+def timestamp(moment: datetime.datetime):
+    '''
+    timestamp is a function that formats a time in the log format YYYY-MM-DD HH:MM:SS.mmm.
+
+    Parameters:
+        moment: A datetime object that represents the time
+
+    Returns:
+        str: A string that represents the time in the log format
+    '''
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class LogGenerator:
+    def __init__(self, directory: str, log_file: str = 'MMDVM', gateway_log_file: str = 'YSFGateway', seed: int = None,
+                 sequence: bool = False):
+        '''
+        LogGenerator constructor.
+
+        Parameters:
+            directory: A string that represents the directory the logs are written to
+            log_file: A string that represents the MMDVMHost log prefix
+            gateway_log_file: A string that represents the YSFGateway log prefix
+            seed: An integer that seeds the random generator so runs can be repeated
+            sequence: A boolean that represents whether every line ends with a sequence number
+
+        Variables:
+            count: An integer that represents the number of lines generated so far, used as the sequence number
+            transmission: A tuple (mode, source, callsign, destination) of the transmission in progress, None between transmissions
+
+        Returns:
+            None
+        '''
+        self.directory = directory
+        self.log_file = log_file
+        self.gateway_log_file = gateway_log_file
+        self.random = random.Random(seed)
+        self.sequence = sequence
+        self.count = 0
+        self.transmission = None
+
+    def mmdvm_line(self, moment: datetime.datetime):
+        '''
+        mmdvm_line is a method that returns the next MMDVMHost line, a header, the end of the transmission in progress or a debug line.
+
+        Parameters:
+            moment: A datetime object that represents the time of the line
+
+        Returns:
+            str: A string that represents the log line without its newline
+        '''
+        t = timestamp(moment)
+        roll = self.random.random()
+        if self.transmission is None and roll < .2:
+            mode = self.random.choice(('YSF', 'DMR Slot 1', 'DMR Slot 2'))
+            source = self.random.choice(('RF', 'network'))
+            callsign = self.random.choice(CALLSIGNS)
+            destination = 'ALL' if mode == 'YSF' else f'TG {self.random.choice((91, 3100, 31665, 9))}'
+            self.transmission = (mode, source, callsign, destination)
+            kind = 'header' if mode == 'YSF' else 'voice header'
+            return f'M: {t} {mode}, received {source} {kind} from {callsign} to {destination}'
+        if self.transmission is not None and roll < .25:
+            mode, source, callsign, destination = self.transmission
+            self.transmission = None
+            duration = round(self.random.uniform(.5, 30), 1)
+            ber = round(self.random.uniform(0, 3), 1)
+            if roll < .21:
+                return f'M: {t} {mode}, {source} watchdog has expired, {duration} seconds, {self.random.randint(0, 20)}% packet loss, BER: {ber}%'
+            if roll < .22:
+                return f'M: {t} {mode}, {source} transmission lost from {callsign} to {destination}, {duration} seconds, BER: {ber}%'
+            kind = 'end of transmission' if mode == 'YSF' else 'end of voice transmission'
+            if source == 'network':
+                return f'M: {t} {mode}, received {source} {kind} from {callsign} to {destination}, {duration} seconds, {self.random.randint(0, 5)}% packet loss, BER: {ber}%'
+            return f'M: {t} {mode}, received {source} {kind} from {callsign} to {destination}, {duration} seconds, BER: {ber}%'
+        if roll < .6:
+            return f'D: {t} DMR Slot {self.random.randint(1, 2)}, Embedded Talker Alias Header'
+        if roll < .8:
+            return f'D: {t} YSF, V/D Mode 2, FN {self.random.randint(0, 7)}, FT {self.random.randint(0, 7)}, BER: {self.random.randint(0, 9)}%'
+        return f'I: {t} MMDVM protocol version: 1, description: MMDVM_HS_Hat-v1.4.17 20190529 14.7456MHz ADF7021 FW by CA6JAU GitID #cc451c4'
+
+    def gateway_line(self, moment: datetime.datetime):
+        '''
+        gateway_line is a method that returns a YSFGateway line, a link, an unlink or a debug line.
+
+        Parameters:
+            moment: A datetime object that represents the time of the line
+
+        Returns:
+            str: A string that represents the log line without its newline
+        '''
+        t = timestamp(moment)
+        roll = self.random.random()
+        if roll < .3:
+            return f'M: {t} Linked to {self.random.choice(REFLECTORS)}'
+        if roll < .4:
+            return f'M: {t} Automatic (re-)connection to {self.random.randint(10000, 99999)} - "{self.random.choice(REFLECTORS)}"'
+        if roll < .5:
+            return f'M: {t} Disconnect by remote command'
+        return f'D: {t} Sending poll to reflector'
+
+    def tag(self, line: str):
+        '''
+        tag is a method that counts a line and appends its sequence number when sequence is set.
+
+        Parameters:
+            line: A string that represents the log line
+
+        Returns:
+            str: A string that represents the line with a newline
+        '''
+        self.count += 1
+        return f'{line} #{self.count}\n' if self.sequence else f'{line}\n'
+
+    def path(self, log_file: str, day: datetime.date):
+        '''
+        path is a method that returns the path of the file of a log for a day, like Pi-Star names them.
+
+        Parameters:
+            log_file: A string that represents the log prefix
+            day: A date object that represents the day of the file
+
+        Returns:
+            str: A string that represents the path of the file
+        '''
+        return os.path.join(self.directory, f'{log_file}-{day.isoformat()}.log')
+
+    def write_file(self, path: str, size: int, start: datetime.datetime = None, step: float = 1.0):
+        '''
+        write_file is a method that writes MMDVMHost lines to a file until it is size bytes long.
+
+        Parameters:
+            path: A string that represents the path of the file
+            size: An integer that represents the size of the file in bytes
+            start: A datetime object that represents the time of the first line, midnight of the current day (UTC) by default
+            step: A float that represents the number of seconds between two lines
+
+        Returns:
+            tuple: A tuple (lines, end) with the number of lines written and the time of the last line
+        '''
+        if start is None:
+            start = datetime.datetime.combine(datetime.datetime.now(datetime.timezone.utc).date(), datetime.time())
+        moment = start
+        written = 0
+        lines = 0
+        chunk = []
+        with open(path, 'w') as f:
+            while written < size:
+                line = self.tag(self.mmdvm_line(moment))
+                chunk.append(line)
+                written += len(line)
+                lines += 1
+                moment += datetime.timedelta(seconds=step * self.random.uniform(.5, 1.5))
+                if len(chunk) >= 1000:
+                    f.write(''.join(chunk))
+                    chunk = []
+            f.write(''.join(chunk))
+        return lines, moment
+
+    def run(self, rate: float, duration: float, rotate_every: float = None, batch: int = 1, gateway_ratio: float = .05, on_write=None):
+        '''
+        run is a method that writes lines to the live logs at a rate, rotating them to the next day every rotate_every seconds.
+
+        Lines are written in batches of batch lines (MMDVMHost writes several lines at once during busy traffic) and each batch is flushed
+        so readers see it immediately. The lines carry the real time, the file names the simulated day.
+
+        Parameters:
+            rate: A float that represents the number of lines written per second
+            duration: A float that represents the number of seconds to write for
+            rotate_every: A float that represents the number of seconds between rotations, None to never rotate
+            batch: An integer that represents the number of lines written at once
+            gateway_ratio: A float that represents the share of the lines written to the YSFGateway log
+            on_write: An optional callable called with (log_file, sequence, monotonic time) for every line once its batch is flushed
+
+        Variables:
+            day: A date object that represents the simulated day of the files being written
+            handles: A dictionary that maps each log prefix to its open file
+
+        Returns:
+            dict: A dictionary with the number of lines written, the rotations and the elapsed time
+        '''
+        day = datetime.datetime.now(datetime.timezone.utc).date()
+        handles = {log_file: open(self.path(log_file, day), 'a') for log_file in (self.log_file, self.gateway_log_file)}
+        start = time.monotonic()
+        next_rotation = start + rotate_every if rotate_every else None
+        lines = 0
+        rotations = 0
+        try:
+            while True:
+                now = time.monotonic()
+                if now - start >= duration:
+                    break
+                if next_rotation is not None and now >= next_rotation:
+                    day += datetime.timedelta(days=1)
+                    for log_file, handle in handles.items():
+                        handle.close()
+                        handles[log_file] = open(self.path(log_file, day), 'a')
+                    rotations += 1
+                    next_rotation += rotate_every
+                written = []
+                moment = datetime.datetime.now(datetime.timezone.utc)
+                for _ in range(batch):
+                    log_file = self.gateway_log_file if self.random.random() < gateway_ratio else self.log_file
+                    line = self.gateway_line(moment) if log_file == self.gateway_log_file else self.mmdvm_line(moment)
+                    handles[log_file].write(self.tag(line))
+                    written.append((log_file, self.count))
+                for handle in handles.values():
+                    handle.flush()
+                flushed = time.monotonic()
+                if on_write is not None:
+                    for log_file, sequence in written:
+                        on_write(log_file, sequence, flushed)
+                lines += batch
+                # Keep the average rate even when a write was slow
+                delay = start + lines / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return {'lines': lines, 'rotations': rotations, 'elapsed': round(time.monotonic() - start, 3)}
+
+
+if __name__ == '__main__':
+    '''
+    This block of code writes live logs for manual testing, e.g. python -m bench.generator /tmp/logs --rate 50 --rotate-every 60
+    '''
+    arg_parser = argparse.ArgumentParser(description='Write synthetic MMDVMHost and YSFGateway logs')
+    arg_parser.add_argument('directory', help='Directory to write the logs to')
+    arg_parser.add_argument('--rate', type=float, default=10, help='Lines written per second')
+    arg_parser.add_argument('--duration', type=float, default=60, help='Seconds to write for')
+    arg_parser.add_argument('--rotate-every', type=float, default=None, help='Seconds between rotations to the next day')
+    arg_parser.add_argument('--batch', type=int, default=1, help='Lines written at once')
+    arg_parser.add_argument('--size', type=int, default=None, help='Write a single MMDVM file of this many bytes instead and exit')
+    arg_parser.add_argument('--seed', type=int, default=None, help='Seed of the random generator')
+    args = arg_parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    generator = LogGenerator(args.directory, seed=args.seed)
+    if args.size is not None:
+        path = generator.path(generator.log_file, datetime.datetime.now(datetime.timezone.utc).date())
+        print(generator.write_file(path, args.size)[0], 'lines written to', path)
+    else:
+        print(generator.run(args.rate, args.duration, rotate_every=args.rotate_every, batch=args.batch))
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from bench.generator import LogGenerator
+from bench.micro import environment
+
+'''
+load is a module that measures the API under N concurrent SSE clients while the logs are being written.
+
+The harness starts LogDogAPI in its own process, with a config.json that points at a temporary log directory, and opens clients
+local SSE connections to a streaming route (/watch_log by default). Once every client has received its first frame, LogGenerator
+writes numbered lines to the MMDVMHost and YSFGateway logs at rate lines per second, rotating them every rotate_every seconds.
+The harness records:
+    server: The CPU used by the API process (percent of one core) and its peak resident memory while the lines are written
+    delivery: The latency from the flush of a line to its receipt by each client (median, p95, p99 and maximum in milliseconds)
+    lines: The lines written, and for each client the lines lost (written but never received) and duplicated (received twice)
+    loop_lag: The lag of the event loop of the API read from /metrics (samples, mean and the bucket of the p99 in milliseconds)
+
+The clients speak HTTP/1.0 over raw sockets so hundreds of them fit in one process, and CPU and memory are read from /proc, so the
+harness runs on Linux only (like Pi-Star). Results are printed (or written with --output) as JSON.
+
+Classes:
+    LoadHarness: A class that runs the API, the clients and the generator and collects the results
+
+Functions:
+    percentile: A function that returns a percentile of a sorted list
+'''
+
+repository = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def percentile(values: list, fraction: float):
+    '''
+    percentile is a function that returns a percentile of a sorted list using the nearest rank.
+
+    Parameters:
+        values: A sorted list of numbers
+        fraction: A float between 0 and 1 that represents the percentile
+
+    Returns:
+        float: The percentile, or None if the list is empty
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class LoadHarness:
+    def __init__(self, clients: int = 10, rate: float = 20, duration: float = 10, rotate_every: float = None, batch: int = 1,
+                 route: str = '/watch_log', port: int = 8091, overrides: dict = None):
+        '''
+        LoadHarness constructor.
+
+        Parameters:
+            clients: An integer that represents the number of SSE clients
+            rate: A float that represents the number of lines written per second
+            duration: A float that represents the number of seconds lines are written for
+            rotate_every: A float that represents the number of seconds between log rotations, None to never rotate
+            batch: An integer that represents the number of lines written at once
+            route: A string that represents the streaming route the clients open (e.g. /watch_log or /watch?log=MMDVM&log=YSFGateway)
+            port: An integer that represents the port the API listens on
+            overrides: A dictionary of config.json values to set for the API (e.g. watch_interval)
+
+        Variables:
+            written: A dictionary that maps the sequence number of each line to the monotonic time its batch was flushed
+            received: A list of dictionaries, one per client, that map a sequence number to the times it was received
+
+        Returns:
+            None
+        '''
+        self.clients = clients
+        self.rate = rate
+        self.duration = duration
+        self.rotate_every = rotate_every
+        self.batch = batch
+        self.route = route
+        self.port = port
+        self.overrides = overrides or {}
+        self.written = {}
+        self.received = [{} for _ in range(clients)]
+        self.connected = 0
+
+    def start_server(self, directory: str):
+        '''
+        start_server is a method that writes a config.json to a directory and starts LogDogAPI from it.
+
+        Parameters:
+            directory: A string that represents the working directory of the API, the logs are written to its logs subdirectory
+
+        Returns:
+            subprocess.Popen: A Popen object that represents the API process
+        '''
+        with open(os.path.join(repository, 'config.json')) as f:
+            config = json.load(f)
+        config.update({'host': '127.0.0.1', 'api_port': self.port, 'debug': 'False', 'log_directory': os.path.join(directory, 'logs'),
+                       'history_enabled': 'False'})
+        config.update(self.overrides)
+        with open(os.path.join(directory, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=4)
+        environment = dict(os.environ, PYTHONPATH=repository)
+        return subprocess.Popen([sys.executable, '-m', 'api.api'], cwd=directory, env=environment, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+
+    async def wait_for_server(self, timeout: float = 30):
+        '''
+        wait_for_server is a coroutine that waits until the API accepts connections.
+
+        Parameters:
+            timeout: A float that represents the number of seconds to wait
+
+        Returns:
+            None
+
+        Exceptions:
+            TimeoutError: An exception that is raised when the API does not start in time
+        '''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(.1)
+        raise TimeoutError(f'The API did not start on port {self.port}')
+
+    async def client(self, index: int, ready: asyncio.Event):
+        '''
+        client is a coroutine that opens one SSE connection and records the receipt time of every numbered line.
+
+        Parameters:
+            index: An integer that represents the client number
+            ready: An asyncio.Event object that is set once every client received its first frame
+
+        Returns:
+            None
+        '''
+        received = self.received[index]
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port, limit=1 << 20)
+        writer.write(f'GET {self.route} HTTP/1.0\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n'.encode())
+        await writer.drain()
+        first = True
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b'data: '):
+                    continue
+                now = time.monotonic()
+                if first:
+                    first = False
+                    self.connected += 1
+                    if self.connected == self.clients:
+                        ready.set()
+                marker = line.rfind(b' #')
+                if marker != -1:
+                    try:
+                        sequence = int(line[marker + 2:].split(b'"')[0])
+                    except ValueError:
+                        continue
+                    received.setdefault(sequence, []).append(now)
+        finally:
+            writer.close()
+
+    def sample(self, pid: int):
+        '''
+        sample is a method that reads the CPU time and resident memory of a process from /proc.
+
+        Parameters:
+            pid: An integer that represents the process ID
+
+        Returns:
+            tuple: A tuple (cpu, rss) with the user and system CPU time in seconds and the resident memory in kilobytes
+        '''
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        return cpu, rss
+
+    async def loop_lag(self):
+        '''
+        loop_lag is a coroutine that reads the event loop lag histogram from /metrics and summarizes it.
+
+        The p99 is the upper bound of the bucket the 99th percentile falls in, the histogram does not keep the exact values.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary with the number of samples, the mean and the p99 in milliseconds, or None if /metrics has no lag histogram
+        '''
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(b'GET /metrics HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n')
+        await writer.drain()
+        text = (await reader.read()).decode(errors='replace')
+        writer.close()
+        buckets = []
+        total = count = 0
+        for line in text.splitlines():
+            if line.startswith('logdog_event_loop_lag_seconds_bucket{le="'):
+                bound, value = line[len('logdog_event_loop_lag_seconds_bucket{le="'):].split('"} ')
+                buckets.append((float(bound), float(value)))
+            elif line.startswith('logdog_event_loop_lag_seconds_sum '):
+                total = float(line.split()[1])
+            elif line.startswith('logdog_event_loop_lag_seconds_count '):
+                count = float(line.split()[1])
+        if not count:
+            return None
+        p99 = next((bound for bound, value in buckets if value >= .99 * count), None)
+        return {'samples': int(count), 'mean_ms': round(total / count * 1000, 3), 'p99_ms': p99 * 1000 if p99 is not None else None}
+
+    async def measure(self, directory: str, process: subprocess.Popen):
+        '''
+        measure is a coroutine that connects the clients, writes the lines and collects the results.
+
+        Parameters:
+            directory: A string that represents the working directory of the API
+            process: A Popen object that represents the API process
+
+        Returns:
+            dict: A dictionary with the results
+        '''
+        await self.wait_for_server()
+        ready = asyncio.Event()
+        tasks = [asyncio.create_task(self.client(index, ready)) for index in range(self.clients)]
+        await asyncio.wait_for(ready.wait(), timeout=60)
+        generator = LogGenerator(os.path.join(directory, 'logs'), seed=1, sequence=True)
+        def on_write(log_file, sequence, flushed):
+            if self.route.startswith('/watch_log') and log_file != generator.log_file:
+                return
+            self.written[sequence] = flushed
+        cpu_start, rss_peak = self.sample(process.pid)
+        wall_start = time.monotonic()
+        writer = asyncio.get_running_loop().run_in_executor(None, lambda: generator.run(self.rate, self.duration, rotate_every=self.rotate_every,
+                                                                                      batch=self.batch, on_write=on_write))
+        while not writer.done():
+            await asyncio.sleep(.25)
+            rss_peak = max(rss_peak, self.sample(process.pid)[1])
+        generated = await writer
+        # Give the last lines time to arrive
+        await asyncio.sleep(1)
+        cpu_end, rss = self.sample(process.pid)
+        loop_lag = await self.loop_lag()
+        wall = time.monotonic() - wall_start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        latencies = []
+        lost = []
+        duplicated = []
+        for received in self.received:
+            lost.append(sum(1 for sequence in self.written if sequence not in received))
+            duplicated.append(sum(len(times) - 1 for times in received.values() if len(times) > 1))
+            latencies += [(times[0] - self.written[sequence]) * 1000 for sequence, times in received.items() if sequence in self.written]
+        latencies = sorted(round(latency, 3) for latency in latencies)
+        return {
+            'server': {'cpu_percent': round((cpu_end - cpu_start) / wall * 100, 2), 'rss_peak_kb': max(rss_peak, rss)},
+            'delivery': {'samples': len(latencies), 'median_ms': round(statistics.median(latencies), 3) if latencies else None,
+                         'p95_ms': percentile(latencies, .95), 'p99_ms': percentile(latencies, .99),
+                         'max_ms': latencies[-1] if latencies else None},
+            'lines': {'generated': generated['lines'], 'rotations': generated['rotations'], 'expected_per_client': len(self.written),
+                      'lost_total': sum(lost), 'lost_max_per_client': max(lost), 'duplicated_total': sum(duplicated)},
+            'loop_lag': loop_lag,
+        }
+
+    def run(self):
+        '''
+        run is a method that runs the benchmark in a temporary directory and stops the API afterwards.
+
+        Returns:
+            dict: A dictionary with the environment, the settings and the results
+        '''
+        directory = tempfile.mkdtemp(prefix='logdog-load-')
+        os.makedirs(os.path.join(directory, 'logs'))
+        # The tailer needs a file to follow before the clients connect
+        LogGenerator(os.path.join(directory, 'logs'), seed=0).run(rate=100, duration=.05)
+        process = self.start_server(directory)
+        try:
+            results = asyncio.run(self.measure(directory, process))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            shutil.rmtree(directory, ignore_errors=True)
+        settings = {'clients': self.clients, 'rate': self.rate, 'duration': self.duration, 'rotate_every': self.rotate_every,
+                    'batch': self.batch, 'route': self.route, 'overrides': self.overrides}
+        return {'benchmark': 'load', 'environment': environment(), 'settings': settings, **results}
+
+
+if __name__ == '__main__':
+    '''
+    This block of code runs the load benchmark, e.g. python -m bench.load --clients 50 --rate 40 --duration 30 --rotate-every 10
+    '''
+    arg_parser = argparse.ArgumentParser(description='Measure LogDogAPI under concurrent SSE clients')
+    arg_parser.add_argument('--clients', type=int, default=10, help='Number of SSE clients')
+    arg_parser.add_argument('--rate', type=float, default=20, help='Lines written per second')
+    arg_parser.add_argument('--duration', type=float, default=10, help='Seconds to write for')
+    arg_parser.add_argument('--rotate-every', type=float, default=None, help='Seconds between log rotations')
+    arg_parser.add_argument('--batch', type=int, default=1, help='Lines written at once')
+    arg_parser.add_argument('--route', default='/watch_log', help='Streaming route the clients open')
+    arg_parser.add_argument('--port', type=int, default=8091, help='Port of the API')
+    arg_parser.add_argument('--set', nargs='*', default=[], metavar='KEY=VALUE', help='config.json values for the API (JSON values)')
+    arg_parser.add_argument('--output', default=None, help='File to write the JSON results to instead of stdout')
+    args = arg_parser.parse_args()
+    overrides = {}
+    for item in args.set:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    results = LoadHarness(args.clients, args.rate, args.duration, args.rotate_every, args.batch, args.route, args.port, overrides).run()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
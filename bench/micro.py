@@ -0,0 +1,148 @@
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import statistics
+import subprocess
+from logdog import tail
+from search import search_file
+from sources import read_lines
+from bench.generator import LogGenerator, timestamp
+
+'''
+micro is a module that measures the latency of tail and search against the size of the log file.
+
+For each size a MMDVMHost log is generated (one line per second on average, so 64 MB holds about a week of lines in a single file), then each operation is run repeat times and the median, minimum and maximum are reported in milliseconds:
+    tail_N: logdog.tail of the last N lines, what /read_log?lines=N does
+    search_hour: search.search_file of one hour in the middle of the file, what /search does
+    search_last_minute: search.search_file of the last minute of the file
+    scan: reading and decoding every line, what /read_log without lines does and the cost tail and search avoid
+With --compressed the same operations are also run on a gzip copy of the file.
+
+Results are printed (or written with --output) as JSON with the environment, so runs can be compared.
+
+Functions:
+    measure: A function that times a callable
+    environment: A function that describes the machine and the commit the benchmark ran on
+    run: A function that runs the microbenchmarks for a list of sizes
+'''
+
+
+def measure(function, repeat: int):
+    '''
+    measure is a function that calls a function repeat times and returns its timings.
+
+    Parameters:
+        function: A callable without parameters, its result is consumed if it is a generator
+        repeat: An integer that represents the number of calls
+
+    Returns:
+        dict: A dictionary with the median, minimum and maximum duration in milliseconds and the number of items returned
+    '''
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        items = sum(1 for _ in result) if not isinstance(result, list) else len(result)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(statistics.median(timings), 4), 'min_ms': round(min(timings), 4), 'max_ms': round(max(timings), 4),
+            'items': items}
+
+
+def environment():
+    '''
+    environment is a function that describes the machine and the commit the benchmark ran on.
+
+    Returns:
+        dict: A dictionary with the time, Python version, platform, CPU count and git commit
+    '''
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.realpath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'machine': platform.machine(), 'cpus': os.cpu_count(), 'commit': commit}
+
+
+def run(sizes: list, repeat: int = 20, compressed: bool = False, directory: str = None, seed: int = 1):
+    '''
+    run is a function that generates a log of each size and measures tail, search and a full scan on it.
+
+    Parameters:
+        sizes: A list of integers that represent the file sizes in bytes
+        repeat: An integer that represents the number of runs of each operation
+        compressed: A boolean that represents whether to also measure a gzip copy of each file
+        directory: A string that represents the directory the files are generated in, a temporary directory by default
+        seed: An integer that seeds the generator so every run measures the same files
+
+    Returns:
+        dict: A dictionary with the environment and the results of each size
+    '''
+    temporary = directory is None
+    directory = directory or tempfile.mkdtemp(prefix='logdog-bench-')
+    results = {'benchmark': 'micro', 'environment': environment(), 'repeat': repeat, 'sizes': []}
+    try:
+        for size in sizes:
+            generator = LogGenerator(directory, seed=seed)
+            path = os.path.join(directory, f'MMDVM-{size}.log')
+            start = datetime.datetime(2024, 4, 1)
+            lines, end = generator.write_file(path, size, start=start)
+            middle = start + (end - start) / 2
+            hour = (timestamp(middle), timestamp(middle + datetime.timedelta(hours=1)))
+            last_minute = (timestamp(end - datetime.timedelta(minutes=1)), None)
+            files = {'plain': path}
+            if compressed:
+                with open(path, 'rb') as source, gzip.open(f'{path}.gz', 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                files['gzip'] = f'{path}.gz'
+            result = {'size': size, 'lines': lines}
+            for kind, file in files.items():
+                operations = {
+                    'tail_1': lambda: tail(file, 1),
+                    'tail_50': lambda: tail(file, 50),
+                    'tail_500': lambda: tail(file, 500),
+                    'search_hour': lambda: search_file(file, *hour),
+                    'search_last_minute': lambda: search_file(file, *last_minute),
+                    'scan': lambda: read_lines(file),
+                }
+                result[kind] = {}
+                for name, function in operations.items():
+                    # Full reads (a scan, or anything on a compressed file) are repeated less so the suite stays quick
+                    count = max(1, repeat // 10) if name == 'scan' or kind != 'plain' else repeat
+                    result[kind][name] = measure(function, count)
+                print(f'{size} bytes ({kind}): ' + ', '.join(f'{name} {value["median_ms"]} ms' for name, value in result[kind].items()),
+                      file=sys.stderr)
+            results['sizes'].append(result)
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    '''
+    This block of code runs the microbenchmarks, e.g. python -m bench.micro --sizes 1M 16M 64M --output micro.json
+    '''
+    def parse_size(value: str):
+        units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+        return int(float(value[:-1]) * units[value[-1].upper()]) if value[-1].upper() in units else int(value)
+    arg_parser = argparse.ArgumentParser(description='Measure tail and search latency against log file size')
+    arg_parser.add_argument('--sizes', nargs='+', type=parse_size, default=[1 << 20, 16 << 20, 64 << 20], help='File sizes (e.g. 1M 16M)')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='Runs of each operation')
+    arg_parser.add_argument('--compressed', action='store_true', help='Also measure a gzip copy of each file')
+    arg_parser.add_argument('--output', default=None, help='File to write the JSON results to instead of stdout')
+    args = arg_parser.parse_args()
+    results = run(args.sizes, repeat=args.repeat, compressed=args.compressed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
@@ -0,0 +1,330 @@
+import contextlib
+import csv
+import mmap
+import os
+import struct
+import subprocess
+import sys
+from array import array
+from functools import lru_cache
+
+'''
+callbook is a module that looks up the name and location of a callsign in a local copy of the RadioID user database.
+
+Hotspots already download the RadioID user export (RADIO_ID,CALLSIGN,FIRST_NAME,LAST_NAME,CITY,STATE,COUNTRY) to route DMR calls.
+Loading its ~250,000 rows into a dictionary would cost tens of megabytes of RAM on a Pi, so the CSV is converted once into a compact
+index file that is memory-mapped: the pages the lookups touch are read from the page cache and can be dropped by the kernel at any
+time, so the index adds next to nothing to the resident memory of the API. A lookup is a binary search over the sorted offsets of the
+records (about 18 comparisons), and an LRU cache in front of it answers the callsigns heard again in microseconds. Nothing is ever
+fetched from the network at query time.
+
+Index file layout (native byte order, the index is built on the machine that reads it):
+    header: MAGIC, the number of records, the size and the modification time of the CSV it was built from
+    offsets: One uint32 per record, the offset of the record from the start of the records, in callsign order
+    records: One line per callsign, CALLSIGN\tNAME\tCITY\tSTATE\tCOUNTRY\n (UTF-8)
+
+The index is rebuilt in a separate process (python -m callbook CSV INDEX), so the memory needed to sort the rows is returned to the
+system when it exits, and written to a temporary file that replaces the previous index, so a reader never sees a partial index.
+The DMRIds.dat format (ID, callsign and name separated by tabs or spaces, without a header) is accepted too.
+
+Classes:
+    CallbookIndex: A memory-mapped index file
+    Callbook: The lookups, with the LRU cache, and the refresh of the index when the CSV changes
+
+Functions:
+    build: A function that converts a user database export into an index file
+'''
+
+MAGIC = b'CBK1'
+HEADER = struct.Struct('=4sIQd')
+FIELDS = ('name', 'city', 'state', 'country')
+
+
+def build(source: str, index: str):
+    '''
+    build is a function that converts a user database export into a sorted index file, replacing the previous index atomically.
+
+    When a callsign has several radio IDs, the first row is kept.
+
+    Parameters:
+        source: A string that represents the path of the CSV (or DMRIds.dat) file
+        index: A string that represents the path of the index file to write
+
+    Variables:
+        records: A dictionary that maps each callsign to its record line
+
+    Returns:
+        int: The number of callsigns in the index
+
+    Exceptions:
+        OSError: An exception that is raised when the source cannot be read or the index cannot be written
+    '''
+    stat = os.stat(source)
+    records = {}
+    with open(source, newline='', encoding='utf-8', errors='replace') as f:
+        first = f.readline()
+        f.seek(0)
+        if ',' in first and '\t' not in first:
+            reader = csv.reader(f)
+            columns = ['RADIO_ID', 'CALLSIGN', 'FIRST_NAME', 'LAST_NAME', 'CITY', 'STATE', 'COUNTRY']
+            if 'CALLSIGN' in first.upper():
+                columns = [column.strip().upper() for column in next(reader)]
+            positions = [columns.index(column) if column in columns else None
+                         for column in ('CALLSIGN', 'FIRST_NAME', 'LAST_NAME', 'CITY', 'STATE', 'COUNTRY')]
+            rows = ([row[position].strip() if position is not None and position < len(row) else '' for position in positions] for row in reader)
+        else:
+            # DMRIds.dat: ID, callsign and name
+            rows = ((parts[1], parts[2].strip() if len(parts) > 2 else '', '', '', '', '')
+                    for parts in (line.split(None, 2) for line in f) if len(parts) > 1)
+        for callsign, first_name, last_name, city, state, country in rows:
+            callsign = callsign.upper()
+            if not callsign or callsign in records:
+                continue
+            fields = (callsign, f'{first_name} {last_name}'.strip(), city, state, country)
+            records[callsign] = '\t'.join(field.replace('\t', ' ').replace('\n', ' ') for field in fields).encode('utf-8') + b'\n'
+    # Strings sort in the same order as their UTF-8 bytes, which find compares
+    keys = sorted(records)
+    offsets = array('I')
+    position = 0
+    for callsign in keys:
+        offsets.append(position)
+        position += len(records[callsign])
+    temporary = f'{index}.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(keys), stat.st_size, stat.st_mtime))
+            f.write(offsets.tobytes())
+            for callsign in keys:
+                f.write(records[callsign])
+        os.replace(temporary, index)
+    except BaseException:
+        # A partial index (e.g. the disk is full) is removed so it does not hold on to the space, the previous index is kept
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+    return len(keys)
+
+
+class CallbookIndex:
+    def __init__(self, path: str):
+        '''
+        CallbookIndex constructor that maps an index file into memory.
+
+        The mapping is closed when the object is garbage collected, so a lookup running in another thread while the index is replaced
+        keeps reading the old mapping safely.
+
+        Parameters:
+            path: A string that represents the path of the index file
+
+        Variables:
+            map: A mmap object of the index file
+            offsets: A memoryview of the offsets of the records, as uint32
+            base: An integer that represents the position of the records in the file
+            count: An integer that represents the number of records
+            source_size: An integer that represents the size of the CSV the index was built from
+            source_mtime: A float that represents the modification time of the CSV the index was built from
+
+        Returns:
+            None
+
+        Exceptions:
+            OSError: An exception that is raised when the file cannot be read
+            ValueError: An exception that is raised when the file is not an index
+        '''
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.source_size, self.source_mtime = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a callbook index')
+        self.offsets = memoryview(self.map)[HEADER.size:HEADER.size + 4 * self.count].cast('I')
+        self.base = HEADER.size + 4 * self.count
+
+    def find(self, callsign: bytes):
+        '''
+        find is a method that returns the record of a callsign with a binary search.
+
+        Parameters:
+            callsign: A bytes object that represents the callsign, upper case
+
+        Returns:
+            tuple: A tuple of the name, city, state and country strings, or None if the callsign is not in the index
+        '''
+        data = self.map
+        offsets = self.offsets
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.base + offsets[middle]
+            if data[start:data.find(b'\t', start)] < callsign:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        start = self.base + offsets[low]
+        record = data[start:data.find(b'\n', start)].split(b'\t')
+        if record[0] != callsign:
+            return None
+        return tuple(field.decode('utf-8', errors='replace') for field in record[1:5])
+
+
+class Callbook:
+    def __init__(self, source: str, index: str, cache_size: int = 1024):
+        '''
+        Callbook constructor, the index is opened (and built if needed) by refresh.
+
+        Parameters:
+            source: A string that represents the path of the user database export
+            index: A string that represents the path of the index file built from it
+            cache_size: An integer that represents the number of lookups kept in the LRU cache
+
+        Variables:
+            current: A CallbookIndex object, None until an index is loaded
+            cached: The lookup function wrapped in an LRU cache, replaced with the index
+
+        Returns:
+            None
+        '''
+        # The index is built by a process that runs in the directory of this module
+        self.source = os.path.abspath(source)
+        self.index = os.path.abspath(index)
+        self.cache_size = cache_size
+        self.current = None
+        self.cached = lru_cache(maxsize=cache_size)(self.find)
+
+    def find(self, callsign: str):
+        '''
+        find is a method that looks a callsign up in the current index, without the cache.
+
+        Parameters:
+            callsign: A string that represents the callsign
+
+        Returns:
+            tuple: A tuple of the name, city, state and country strings, or None if the callsign is unknown
+        '''
+        current = self.current
+        if current is None:
+            return None
+        return current.find(callsign.upper().encode('utf-8', errors='replace'))
+
+    def lookup(self, callsign: str):
+        '''
+        lookup is a method that returns the name and location of a callsign as a dictionary.
+
+        Parameters:
+            callsign: A string that represents the callsign, a suffix after a dash (e.g. K3JLP-7) is ignored
+
+        Returns:
+            dict: A dictionary with the name, city, state and country that are known, or None if the callsign is unknown
+        '''
+        if not callsign:
+            return None
+        record = self.cached(callsign.split('-', 1)[0])
+        if record is None:
+            return None
+        return {field: value for field, value in zip(FIELDS, record) if value}
+
+    def enrich(self, event):
+        '''
+        enrich is a method that sets the name and location of the callsign of an event.
+
+        Parameters:
+            event: A LogEvent object
+
+        Returns:
+            None
+        '''
+        if not event.callsign:
+            return
+        record = self.cached(event.callsign.split('-', 1)[0])
+        if record is not None:
+            event.name, event.city, event.state, event.country = (value or None for value in record)
+
+    def stale(self):
+        '''
+        stale is a method that returns whether the index has to be (re)built because the export changed since it was built.
+
+        Parameters:
+            None
+
+        Returns:
+            bool: True if the export exists and the current index was not built from it
+        '''
+        try:
+            stat = os.stat(self.source)
+        except OSError:
+            return False
+        current = self.current
+        return current is None or (current.source_size, current.source_mtime) != (stat.st_size, stat.st_mtime)
+
+    def refresh(self):
+        '''
+        refresh is a method that loads the index, rebuilding it in a separate process first when the export changed.
+
+        It runs in a thread. The new index replaces the current one in a single assignment and the cache is replaced with it, so a lookup
+        sees either the old or the new index, never a mix of both. When the build fails (e.g. the disk is full) the current index is kept
+        and its temporary file is removed.
+
+        Parameters:
+            None
+
+        Returns:
+            bool: True if a new index was loaded
+
+        Exceptions:
+            OSError: An exception that is raised when the index cannot be read
+            subprocess.CalledProcessError: An exception that is raised when the index cannot be built
+        '''
+        self.open()
+        if not self.stale():
+            return False
+        try:
+            subprocess.run([sys.executable, '-m', 'callbook', self.source, self.index], check=True,
+                           cwd=os.path.dirname(os.path.realpath(__file__)))
+        except subprocess.CalledProcessError:
+            # The build removes its temporary file when it fails, not when it is killed
+            with contextlib.suppress(OSError):
+                os.remove(f'{self.index}.tmp')
+            raise
+        self.swap(CallbookIndex(self.index))
+        return True
+
+    def open(self):
+        '''
+        open is a method that loads the index built by a previous run, if there is one and no index is loaded yet.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        if self.current is not None or not os.path.exists(self.index):
+            return
+        try:
+            self.swap(CallbookIndex(self.index))
+        except (OSError, ValueError) as e:
+            print(f'Ignoring the callbook index {self.index}: {e}')
+
+    def swap(self, index: CallbookIndex):
+        '''
+        swap is a method that makes an index the current one and empties the cache.
+
+        Parameters:
+            index: The new CallbookIndex object
+
+        Returns:
+            None
+        '''
+        self.current = index
+        self.cached = lru_cache(maxsize=self.cache_size)(self.find)
+
+
+if __name__ == '__main__':
+    import time
+    if len(sys.argv) != 3:
+        print('Usage: python -m callbook CSV INDEX')
+        sys.exit(2)
+    start = time.monotonic()
+    count = build(sys.argv[1], sys.argv[2])
+    print(f'Indexed {count} callsigns from {sys.argv[1]} in {time.monotonic() - start:.2f} seconds')
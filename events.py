@@ -0,0 +1,212 @@
+import re
+import json
+
+'''
+events is a module that turns MMDVMHost and YSFGateway log lines into typed events.
+
+The dashboard used to run several regular expressions on every line in every browser to find the callsign, the source and the end
+of a transmission, and string-split the YSFGateway lines for the linked reflector. The patterns below are compiled once and each line
+is parsed once on the server, the result is sent to the browsers as compact JSON.
+
+Event types:
+    header: A transmission started (voice header, YSF header/data, P25/NXDN voice transmission, late entry)
+    end: A transmission ended (end of transmission, transmission lost or network watchdog expired), with duration, loss and BER when logged
+    link: The gateway linked to a reflector or room
+    unlink: The gateway unlinked from its reflector or room
+
+Classes:
+    LogEvent: A parsed event
+
+Functions:
+    parse_line: A function that parses a log line and returns a LogEvent or None
+
+Attributes:
+    callbook: A Callbook object (see callbook.py) that sets the name and location of the callsign of each transmission, None to skip it
+
+Examples of parsed lines:
+    M: 2024-04-04 12:34:56.789 YSF, received RF header from K3JLP to ALL
+    M: 2024-04-04 12:35:01.345 DMR Slot 2, received network end of voice transmission from K3JLP to TG 91, 4.6 seconds, 0% packet loss, BER: 0.0%
+    M: 2024-04-04 12:36:00.000 Linked to AMERICA-LINK
+'''
+
+TIMESTAMP = r'(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3})'
+MODE = r'(?P<mode>D-Star|DMR Slot (?P<slot>\d)|DMR|YSF|P25|NXDN|M17|FM)'
+
+# MMDVMHost: "<mode>, received <RF|network> <kind> from <callsign> to <destination>[ at <gateway>][, <statistics>]"
+transmission_regex = re.compile(
+    r'^\w: ' + TIMESTAMP + ' ' + MODE +
+    r', received (?P<source>RF|network) (?P<kind>[a-z ]+?) from (?P<callsign>[^\s/,]+)[^,]*? to (?P<destination>.+?)(?: at \S+)?\s*(?:, (?P<stats>.*))?$')
+# MMDVMHost: "<mode>, <RF|network> voice transmission lost from <callsign> to <destination>, <statistics>"
+lost_regex = re.compile(
+    r'^\w: ' + TIMESTAMP + ' ' + MODE +
+    r', (?P<source>RF|network) (?:voice )?transmission lost from (?P<callsign>[^\s/,]+)[^,]*? to (?P<destination>.+?)\s*(?:, (?P<stats>.*))?$')
+# MMDVMHost: "<mode>, network watchdog has expired, <statistics>"
+watchdog_regex = re.compile(r'^\w: ' + TIMESTAMP + ' ' + MODE + r', (?P<source>RF|network) watchdog has expired(?:, (?P<stats>.*))?$')
+# YSFGateway
+link_regex = re.compile(r'^\w: ' + TIMESTAMP + r' (?:Linked to (?P<reflector>.+?)|Automatic \(re-\)connection to \d+ - "(?P<room>.+?)")\s*$')
+unlink_regex = re.compile(r'^\w: ' + TIMESTAMP + r' (?:Disconnect by remote command|Disconnect via DTMF has been requested|Unlinked from .*|Link has failed.*)\s*$')
+duration_regex = re.compile(r'(\d+(?:\.\d+)?) seconds')
+loss_regex = re.compile(r'(\d+(?:\.\d+)?)% packet loss')
+ber_regex = re.compile(r'BER: (\d+(?:\.\d+)?)%')
+
+HEADER_KINDS = {'header', 'voice header', 'late entry voice header', 'late entry', 'data', 'voice transmission'}
+END_KINDS = {'end of transmission', 'end of voice transmission'}
+# Set by the API when the callbook is enabled
+callbook = None
+
+
+class LogEvent:
+    __slots__ = ('type', 'time', 'mode', 'slot', 'source', 'callsign', 'destination', 'duration', 'loss', 'ber', 'reflector', 'name', 'city',
+                 'state', 'country')
+
+    def __init__(self, type: str, time: str, mode: str = None, slot: int = None, source: str = None, callsign: str = None,
+                 destination: str = None, duration: float = None, loss: float = None, ber: float = None, reflector: str = None,
+                 name: str = None, city: str = None, state: str = None, country: str = None):
+        '''
+        LogEvent constructor.
+
+        Parameters:
+            type: A string that represents the event type (header, end, link or unlink)
+            time: A string that represents the timestamp of the log line in the format YYYY-MM-DD HH:MM:SS.mmm (UTC)
+            mode: A string that represents the digital mode (D-Star, DMR, YSF, P25, NXDN, M17 or FM)
+            slot: An integer that represents the DMR time slot
+            source: A string that represents where the transmission was received from (RF or network)
+            callsign: A string that represents the callsign of the station
+            destination: A string that represents the destination of the transmission (e.g. ALL or TG 91)
+            duration: A float that represents the length of the transmission in seconds
+            loss: A float that represents the packet loss of a network transmission in percent
+            ber: A float that represents the bit error rate of the transmission in percent
+            reflector: A string that represents the reflector or room the gateway linked to
+            name: A string that represents the name of the operator of the callsign, from the callbook
+            city: A string that represents the city of the operator, from the callbook
+            state: A string that represents the state or region of the operator, from the callbook
+            country: A string that represents the country of the operator, from the callbook
+
+        Returns:
+            None
+        '''
+        self.type = type
+        self.time = time
+        self.mode = mode
+        self.slot = slot
+        self.source = source
+        self.callsign = callsign
+        self.destination = destination
+        self.duration = duration
+        self.loss = loss
+        self.ber = ber
+        self.reflector = reflector
+        self.name = name
+        self.city = city
+        self.state = state
+        self.country = country
+
+    def to_dict(self):
+        '''
+        to_dict is a method that returns the event as a dictionary without the fields that are not set.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary that represents the event
+        '''
+        return {key: getattr(self, key) for key in self.__slots__ if getattr(self, key) is not None}
+
+    def to_json(self):
+        '''
+        to_json is a method that returns the event as compact JSON.
+
+        Parameters:
+            None
+
+        Returns:
+            str: A string that represents the event as JSON
+        '''
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+
+def parse_stats(event: LogEvent, stats: str):
+    '''
+    parse_stats is a function that sets the duration, packet loss and BER of an event from the statistics logged at the end of a transmission.
+
+    Parameters:
+        event: A LogEvent object to update
+        stats: A string that represents the statistics, e.g. "4.6 seconds, 0% packet loss, BER: 0.0%"
+
+    Returns:
+        None
+    '''
+    if not stats:
+        return
+    match = duration_regex.search(stats)
+    if match:
+        event.duration = float(match.group(1))
+    match = loss_regex.search(stats)
+    if match:
+        event.loss = float(match.group(1))
+    match = ber_regex.search(stats)
+    if match:
+        event.ber = float(match.group(1))
+
+
+def transmission_event(type: str, match: re.Match):
+    '''
+    transmission_event is a function that builds a header or end event from a match of one of the MMDVMHost patterns.
+
+    Parameters:
+        type: A string that represents the event type (header or end)
+        match: A re.Match object of transmission_regex, lost_regex or watchdog_regex
+
+    Returns:
+        LogEvent: A LogEvent object that represents the transmission
+    '''
+    groups = match.groupdict()
+    slot = groups['slot']
+    event = LogEvent(type, groups['time'], mode='DMR' if slot else groups['mode'], slot=int(slot) if slot else None,
+                     source=groups['source'], callsign=groups.get('callsign'),
+                     destination=groups['destination'].strip() if groups.get('destination') else None)
+    parse_stats(event, groups.get('stats'))
+    if callbook is not None:
+        callbook.enrich(event)
+    return event
+
+
+def parse_line(line: str):
+    '''
+    parse_line is a function that parses a MMDVMHost or YSFGateway log line.
+
+    Cheap substring checks pick the pattern to try, so lines that cannot be events are rejected without running a regular expression.
+
+    Parameters:
+        line: A string that represents the log line
+
+    Returns:
+        LogEvent: A LogEvent object, or None if the line is not an event
+    '''
+    if ', received ' in line:
+        match = transmission_regex.match(line)
+        if match is None:
+            return None
+        kind = match.group('kind')
+        if kind in END_KINDS:
+            return transmission_event('end', match)
+        if kind in HEADER_KINDS:
+            return transmission_event('header', match)
+        return None
+    if 'transmission lost' in line:
+        match = lost_regex.match(line)
+        return transmission_event('end', match) if match else None
+    if 'watchdog has expired' in line:
+        match = watchdog_regex.match(line)
+        return transmission_event('end', match) if match else None
+    if 'Linked to' in line or 'connection to' in line:
+        match = link_regex.match(line)
+        if match:
+            return LogEvent('link', match.group('time'), reflector=match.group('reflector') or match.group('room'))
+        return None
+    if 'isconnect' in line or 'Unlinked' in line or 'Link has failed' in line:
+        match = unlink_regex.match(line)
+        if match:
+            return LogEvent('unlink', match.group('time'))
+    return None
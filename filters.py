@@ -0,0 +1,125 @@
+import weakref
+from search import compile_filter
+
+'''
+filters is a module that builds the filters of the streaming routes and shares them between the clients that use the same one.
+
+/read_log always accepted a filter but the streams did not, so every browser received every line and threw most of them away in
+JavaScript. A StreamFilter is applied by the tailer before a line is queued, so a client that follows one callsign or one reflector only
+receives (and only costs the radio link) the lines it shows.
+
+A filter can combine:
+    term: A string that has to be in the line (like the filter of /read_log)
+    regex: A regular expression that has to be found in the line
+    callsign: A callsign that has to be the callsign of the event parsed from the line (case-insensitive)
+    types: Event types (header, end, link or unlink), the event parsed from the line has to be one of them
+
+Filters are shared: shared_filter returns the same StreamFilter object for the same criteria, so a regular expression is compiled once
+however many clients use it, and LogTailer groups its subscribers by filter and evaluates each distinct filter once per line. The cost
+of a line grows with the number of distinct filters, not with the number of clients. A filter is forgotten when no client uses it anymore.
+
+Classes:
+    StreamFilter: A compiled filter that matches TailRecord objects
+
+Functions:
+    shared_filter: A function that returns the shared StreamFilter for a set of criteria, or None if there is nothing to filter on
+
+Exceptions:
+    ValueError: An exception that is raised when an event type is unknown
+    re.error: An exception that is raised when the regular expression is invalid
+'''
+
+EVENT_TYPES = ('header', 'end', 'link', 'unlink')
+# Every StreamFilter in use, by its criteria
+filters = weakref.WeakValueDictionary()
+
+
+class StreamFilter:
+    __slots__ = ('key', 'matcher', 'callsign', 'types', '__weakref__')
+
+    def __init__(self, term: str = None, regex: str = None, callsign: str = None, types: tuple = ()):
+        '''
+        StreamFilter constructor, use shared_filter to get a filter that is shared with the other clients.
+
+        Parameters:
+            term: A string that has to be in the line
+            regex: A string that represents a regular expression that has to be found in the line
+            callsign: A string that represents the callsign of the events to keep
+            types: A tuple of strings that represent the event types to keep
+
+        Variables:
+            key: A tuple that represents the criteria of the filter
+            matcher: A callable that matches the text of a line, see search.compile_filter, or None if only events are filtered
+
+        Returns:
+            None
+
+        Exceptions:
+            ValueError: An exception that is raised when an event type is unknown
+            re.error: An exception that is raised when the regular expression is invalid
+        '''
+        unknown = [type for type in types if type not in EVENT_TYPES]
+        if unknown:
+            raise ValueError(f'Unknown event type: {", ".join(unknown)}, expected one of {", ".join(EVENT_TYPES)}')
+        self.key = (term, regex, callsign.upper() if callsign else None, tuple(sorted(types)))
+        self.matcher = compile_filter(regex, [term] if term else None)
+        self.callsign = self.key[2]
+        self.types = frozenset(types)
+
+    def matches(self, record):
+        '''
+        matches is a method that returns whether a line passes the filter.
+
+        The text of the line is matched first, the line is only parsed into an event when the filter needs the event (the parsed event
+        is kept by the record and shared with the other filters and clients).
+
+        Parameters:
+            record: A TailRecord object
+
+        Returns:
+            bool: True if the line passes the filter
+        '''
+        if self.matcher is not None and not self.matcher(record.line):
+            return False
+        if self.callsign is None and not self.types:
+            return True
+        event = record.event
+        if event is None:
+            return False
+        if self.types and event.type not in self.types:
+            return False
+        return self.callsign is None or (event.callsign or '').upper() == self.callsign
+
+    def __repr__(self):
+        return f'StreamFilter{self.key}'
+
+
+def shared_filter(term: str = None, regex: str = None, callsign: str = None, types: list = None):
+    '''
+    shared_filter is a function that returns the StreamFilter of a set of criteria, the same object for every client that asks for it.
+
+    Parameters:
+        term: A string that has to be in the line
+        regex: A string that represents a regular expression that has to be found in the line
+        callsign: A string that represents the callsign of the events to keep
+        types: A list of strings that represent the event types to keep
+
+    Returns:
+        StreamFilter: The shared StreamFilter object, or None if no criteria are set
+
+    Exceptions:
+        ValueError: An exception that is raised when an event type is unknown
+        re.error: An exception that is raised when the regular expression is invalid
+    '''
+    term = term or None
+    regex = regex or None
+    callsign = callsign.strip() if callsign and callsign.strip() else None
+    types = tuple(sorted(set(type for type in types or [] if type)))
+    if term is None and regex is None and callsign is None and not types:
+        return None
+    key = (term, regex, callsign.upper() if callsign else None, types)
+    line_filter = filters.get(key)
+    if line_filter is None:
+        line_filter = StreamFilter(term, regex, callsign, types)
+        filters[key] = line_filter
+    return line_filter
@@ -0,0 +1,267 @@
+import sqlite3
+import threading
+import time
+
+'''
+CallHistory is a class that stores the transmissions heard by the hotspot in a local SQLite database.
+
+Until now the only history was the log table of the web page, which is lost on refresh, and the raw log files. The API process feeds
+every header and end event parsed from the MMDVMHost log into CallHistory, which writes them in batched transactions to a database in
+WAL mode so readers are never blocked by the writer. The cursor of the last line ingested is stored in the same transaction as the
+events, so after a restart the ingest resumes from the log exactly where it stopped.
+
+Queries use the (time, id) and (callsign, time, id) indexes and keyset pagination, so a page of a month of traffic is read in milliseconds
+instead of grepping every rotated log.
+
+The database is kept across reboots, so its size is bounded: each flush deletes the events older than days and the oldest events beyond
+max_rows in the same transaction.
+
+Attributes:
+    path: A string that represents the path of the database file
+    batch_size: An integer that represents the number of events buffered before they are written
+    max_rows: An integer that represents the maximum number of events kept, 0 for no limit
+    days: A float that represents the number of days events are kept, 0 for no limit
+
+Methods:
+    add: A method that buffers an event to be written
+    flush: A method that writes the buffered events in one transaction
+    backfill: A method that writes the events of a stream of log lines in batches
+    cursor: A method that returns the cursor of the last line ingested for a log
+    query: A method that returns a page of events matching the filters
+
+Exceptions:
+    sqlite3.Error: An exception that is raised when the database cannot be read or written
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    type TEXT NOT NULL,
+    mode TEXT,
+    slot INTEGER,
+    source TEXT,
+    callsign TEXT,
+    destination TEXT,
+    duration REAL,
+    loss REAL,
+    ber REAL
+);
+CREATE INDEX IF NOT EXISTS calls_time ON calls (time, id);
+CREATE INDEX IF NOT EXISTS calls_callsign ON calls (callsign, time, id);
+CREATE TABLE IF NOT EXISTS cursors (
+    log TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+'''
+
+COLUMNS = ('time', 'type', 'mode', 'slot', 'source', 'callsign', 'destination', 'duration', 'loss', 'ber')
+
+
+class CallHistory:
+    def __init__(self, path: str, batch_size: int = 100, max_rows: int = 100000, days: float = 365):
+        '''
+        CallHistory constructor that opens the database and creates the tables and indexes if they do not exist.
+
+        Parameters:
+            path: A string that represents the path of the database file
+            batch_size: An integer that represents the number of events buffered before they should be written
+            max_rows: An integer that represents the maximum number of events kept, 0 for no limit
+            days: A float that represents the number of days events are kept, 0 for no limit
+
+        Variables:
+            pending: A list of tuples that represent the buffered events
+            cursors: A dictionary that maps a log to the cursor of the last line ingested but not written yet
+
+        Returns:
+            None
+        '''
+        self.path = path
+        self.batch_size = batch_size
+        self.max_rows = int(max_rows)
+        self.days = float(days)
+        self.pending = []
+        self.cursors = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def add(self, event, log: str, cursor: str):
+        '''
+        add is a method that buffers a header or end event to be written with the next flush.
+
+        Parameters:
+            event: A LogEvent object, or None to only move the cursor of the log forward
+            log: A string that represents the log prefix the event was read from
+            cursor: A string that represents the cursor of the line the event was parsed from
+
+        Returns:
+            bool: True if batch_size events are buffered and flush should be called
+        '''
+        with self.lock:
+            if event is not None and event.type in ('header', 'end'):
+                self.pending.append(tuple(getattr(event, column) for column in COLUMNS))
+            self.cursors[log] = cursor
+            return len(self.pending) >= self.batch_size
+
+    def flush(self):
+        '''
+        flush is a method that writes the buffered events and cursors to the database in a single transaction.
+
+        The events beyond the retention (see prune) are deleted in the same transaction. When the transaction fails (e.g. the database
+        is locked or the disk is full) the events and cursors stay buffered for the next flush.
+
+        Parameters:
+            None
+
+        Returns:
+            int: An integer that represents the number of events written
+
+        Exceptions:
+            sqlite3.Error: An exception that is raised when the transaction fails
+        '''
+        with self.lock:
+            if not self.pending and not self.cursors:
+                return 0
+            pending, self.pending = self.pending, []
+            cursors, self.cursors = self.cursors, {}
+            try:
+                with self.connection:
+                    self.connection.executemany(f'INSERT INTO calls ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})',
+                                                pending)
+                    self.connection.executemany('INSERT OR REPLACE INTO cursors (log, cursor) VALUES (?, ?)', cursors.items())
+                    self.prune()
+            except sqlite3.Error:
+                self.pending = pending + self.pending
+                self.cursors = dict(cursors, **self.cursors)
+                raise
+            return len(pending)
+
+    def backfill(self, records, log: str):
+        '''
+        backfill is a method that writes the events of a stream of log lines, a batch at a time.
+
+        It runs in a thread when nothing was ingested from the log yet, so the history starts with the transmissions already in the
+        current log file and not only the ones written after the first start.
+
+        Parameters:
+            records: An iterable of TailRecord objects, oldest first
+            log: A string that represents the log prefix the lines were read from
+
+        Returns:
+            int: An integer that represents the number of events written
+
+        Exceptions:
+            sqlite3.Error: An exception that is raised when a transaction fails
+        '''
+        written = 0
+        for record in records:
+            if self.add(record.event, log, record.id):
+                written += self.flush()
+        return written + self.flush()
+
+    def prune(self):
+        '''
+        prune is a method that deletes the events older than days and the oldest events beyond max_rows.
+
+        It is called by flush inside its transaction. Times are compared as strings in the log format (UTC) using the (time, id) index and
+        the oldest events are found by id, so a prune that deletes nothing costs two index lookups.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        if self.days > 0:
+            oldest = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - self.days * 86400))
+            self.connection.execute('DELETE FROM calls WHERE time < ?', (oldest,))
+        if self.max_rows > 0:
+            self.connection.execute('DELETE FROM calls WHERE id <= (SELECT id FROM calls ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                                    (self.max_rows,))
+
+    def cursor(self, log: str):
+        '''
+        cursor is a method that returns the cursor of the last line ingested for a log.
+
+        Parameters:
+            log: A string that represents the log prefix
+
+        Returns:
+            str: A string that represents the cursor, or None if nothing was ingested from the log yet
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT cursor FROM cursors WHERE log = ?', (log,)).fetchone()
+        return row[0] if row else None
+
+    def query(self, callsign: str = None, source: str = None, mode: str = None, type: str = None, since: str = None, until: str = None,
+              limit: int = 50, before: str = None):
+        '''
+        query is a method that returns a page of events, newest first, using keyset pagination.
+
+        Times are compared as strings in the log format YYYY-MM-DD HH:MM:SS.mmm (UTC), so a prefix such as 2024-04-04 or 2024-04-04 12 can be used.
+        A separate connection is opened for each query so reads run concurrently with the writer thanks to WAL mode.
+
+        Parameters:
+            callsign: A string that represents the callsign to match
+            source: A string that represents the source to match (RF or network)
+            mode: A string that represents the mode to match (e.g. YSF or DMR)
+            type: A string that represents the event type to match (header or end)
+            since: A string that represents the earliest time to return (inclusive)
+            until: A string that represents the latest time to return (exclusive)
+            limit: An integer that represents the maximum number of events to return
+            before: A string that represents the cursor returned as next by the previous page
+
+        Variables:
+            clauses: A list of strings that represent the WHERE clauses
+            parameters: A list of values bound to the WHERE clauses
+
+        Returns:
+            dict: A dictionary with the events under calls and the cursor of the next page under next (None on the last page)
+
+        Exceptions:
+            ValueError: An exception that is raised when the before cursor is malformed
+        '''
+        clauses = []
+        parameters = []
+        for column, value in (('callsign', callsign), ('source', source), ('mode', mode), ('type', type)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                parameters.append(value)
+        if since is not None:
+            clauses.append('time >= ?')
+            parameters.append(since)
+        if until is not None:
+            clauses.append('time < ?')
+            parameters.append(until)
+        if before is not None:
+            before_time, before_id = before.rsplit('|', 1)
+            clauses.append('(time < ? OR (time = ? AND id < ?))')
+            parameters += [before_time, before_time, int(before_id)]
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            rows = connection.execute(f'SELECT id, {", ".join(COLUMNS)} FROM calls {where} ORDER BY time DESC, id DESC LIMIT ?',
+                                      parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+        calls = [{key: value for key, value in zip(COLUMNS, row[1:]) if value is not None} for row in rows]
+        next = f'{rows[-1][1]}|{rows[-1][0]}' if len(rows) == limit else None
+        return {'calls': calls, 'next': next}
+
+    def close(self):
+        '''
+        close is a method that writes the buffered events and closes the database.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
@@ -7,7 +7,7 @@ import json
 Installer is a class that installs the Pi-Star CallerID application.
 
 The installer class is used to install the Pi-Star CallerID application. It creates a virtual environment, installs the requirements,
-copies the files to the install directory, and sets up the systemd service.
+copies the files to the install directory, builds the static files of the web interface (see web/assets.py), and sets up the systemd service.
 
 Variables:
     script_dir: A string that represents the directory of the script
@@ -36,6 +36,7 @@ class Installer:
             exit(1)
         self.script_dir = os.path.dirname(os.path.realpath(__file__)) # Get the directory of the script, not the (CWD)
         self.tmpfs_dir = '/var/lib/callerid'
+        self.cache_dir = '/var/cache/callerid' # Persistent, for the files that do not fit in the tmpfs (the callbook index and history)
         config_path = os.path.join(self.script_dir, '..', 'config.json')
         self.config = json.load(open(config_path)) if os.path.isfile(config_path) else None
         if self.config:
@@ -132,11 +133,16 @@ class Installer:
         try:
             subprocess.run(['cp', '-r', '..', install_dir], check=True)
             print('Copied files to install directory.')
+            # Vendor, hash and precompress the static files once so the web server never compresses them per request
+            subprocess.run([f'{install_dir}/.venv/bin/python3', '-m', 'web.assets'], cwd=install_dir, check=True)
+            print('Built the static files.')
             os.makedirs(self.tmpfs_dir, exist_ok=True)
             with open ('/etc/fstab', 'a') as f:
                 f.write(f'tmpfs {self.tmpfs_dir} tmpfs nodev,noatime,nosuid,mode=0755,size=10m 0 0\n')
             subprocess.run(['mount', '-a'], check=True)
             print('Created temporary directory for log files.')
+            os.makedirs(self.cache_dir, exist_ok=True)
+            print(f'Created {self.cache_dir} for the callbook index and the call history.')
             subprocess.run(['cp', f'{self.script_dir}/callerid.service', '/etc/systemd/system/callerid.service'], check=True)
             print('Copied service file to /etc/systemd/system.')
             subprocess.run(['systemctl', 'daemon-reload'], check=True)
@@ -6,79 +6,88 @@
     if the file has the correct permissions.
     Author: Jonathan L. Pressler
     Date: 2024/04/07
-    Version: 1.1
+    Version: 1.3
 '''
 
 import subprocess
 import argparse
+import signal
+import time
+import sys
 import os
+from supervisor import Service, Supervisor, is_running, load_config, read_pids, read_state
 
 if __name__ == '__main__':
     '''
     This block of code is used to run the Pi-Star CallerID application.
     
-    This script is used to manage the lifecycle of the Pi-Star CallerID application. It can start, stop, update, and eventually check the status of the application.
+    This script is used to manage the lifecycle of the Pi-Star CallerID application. It can start, stop, restart, update, and check the status of the application.
     
-    The following command is used to start the API and Web applications:
-    nohup python api.py > api.log 2>&1 &
-    nohup python -m web.web > web.log 2>&1 &
+    The processes are run by a supervisor (see supervisor.py) that starts them as its children, so their PIDs are known, checks that they
+    answer HTTP requests and starts them again, with a backoff, when they exit or stop answering. The following processes are supervised:
+    python -m api.api (logs to api.log) and python -m web.web (logs to web.log)
     
-    The following command is used to kill the processes:
-    kill -9 <PID>
+    Or, with the -s or --single option, the web interface and the API are served by a single process on the web port:
+    python -m api.unified (logs to app.log)
     
-    The following command is used to update the application:
-    git pull
+    Started without options, the supervisor is started in the background (logging to supervisor.log) and the script returns once the
+    processes are running. With -f or --foreground the supervisor runs in the foreground, which is how the systemd service runs it.
     
-    The following command is used to check for updates:
-    git fetch
+    The supervisor checks for updates in the background (git fetch, at most every update_check_interval seconds), the start does not wait for it.
     
-    The following command is used to check for changes:
-    git diff HEAD origin/main
+    The following command is used to update the application:
+    git pull
     
     This script supports the following command line arguments:
-    -k, --kill: Kill the running processes
+    -k, --kill: Stop the supervisor and the processes
+    -r, --restart: Restart the processes
     -u, --update: Update the application
+    -s, --single: Start the web interface and the API in a single process (uses less memory and only the web port)
+    -f, --foreground: Run the supervisor in the foreground
+    --status: Show the processes, whether they answer, their restarts and whether an update is available
     
     If the script is run without any arguments, it will start the processes.
     
     Example:
-    ./launcher.py -k -- Kill the running processes
+    ./launcher.py -k -- Stop the running processes
+    ./launcher.py -r -- Restart the running processes
     ./launcher.py -u -- Update the application
-    ./launcher.py -- Start the processes (The script will check for updates every time it is run)
+    ./launcher.py -s -- Start a single process that serves the web interface and the API
+    ./launcher.py --status -- Show the status of the processes
+    ./launcher.py -- Start the processes
     
     Exceptions:
         FileNotFoundError: An exception that is raised when the PIDs file is not found
         PermissionError: An exception that is raised when there is a permission error
         subprocess.CalledProcessError: An exception that is raised when there is an error running the commands
         Exception: An exception that is raised when an unknown error occurs
-        
-    TODO:
-        - Add support for checking the status of the processes
-        - Add support for restarting the processes
     '''
     current_dir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(current_dir)
     is_service = False
-    pid_path = 'pids.txt'
+    state_dir = '.'
     if current_dir == '/usr/local/lib/callerid':
         # If the script is run from the /usr/local/lib/callerid directory, the log files will be written to /var/lib/callerid
         # This is because when running from Pi-Star, the /usr/local/lib/callerid directory is read-only.
         # We also set the is_service variable to True for further code to be aware that the script is running as a service.
         is_service = True
-        pid_path = '/var/lib/callerid/pids.txt'
-        api_command = 'nohup .venv/bin/python3 -m api.api > /var/lib/callerid/api.log 2>&1 &'
-        web_command = 'nohup .venv/bin/python3 -m web.web > /var/lib/callerid/web.log 2>&1 &'
-    else:
-        api_command = 'nohup .venv/bin/python3 -m api.api > api.log 2>&1 &'
-        web_command = 'nohup .venv/bin/python3 -m web.web > web.log 2>&1 &'
+        state_dir = '/var/lib/callerid'
+    pid_path = os.path.join(state_dir, 'pids.txt')
+    state_path = os.path.join(state_dir, 'supervisor.json')
+    python = os.path.join(current_dir, '.venv', 'bin', 'python3')
+    if not os.path.exists(python):
+        python = sys.executable
     arg_parser = argparse.ArgumentParser(description='Launch the Pi-Star CallerID application')
-    arg_parser.add_argument('-k', '--kill', action='store_true', help='Kill the running processes')
+    arg_parser.add_argument('-k', '--kill', action='store_true', help='Stop the supervisor and the running processes')
+    arg_parser.add_argument('-r', '--restart', action='store_true', help='Restart the running processes')
     arg_parser.add_argument('-u', '--update', action='store_true', help='Update the application')
+    arg_parser.add_argument('-s', '--single', action='store_true', help='Serve the web interface and the API from a single process')
+    arg_parser.add_argument('-f', '--foreground', action='store_true', help='Run the supervisor in the foreground')
+    arg_parser.add_argument('--status', action='store_true', help='Show the status of the processes')
     args = arg_parser.parse_args()
     if args.kill:
         try:
-            with open(pid_path, 'r') as f:
-                api_pid = f.readline().strip().split()[-1]
-                web_pid = f.readline().strip().split()[-1]
+            processes = read_pids(pid_path)
         except FileNotFoundError:
             print('No PIDs found. Are you sure the processes are running?')
             exit(1)
@@ -87,24 +96,72 @@ if __name__ == '__main__':
             print('An unknown error occurred. Please check the error message and try again.')
             exit(1)
         try:
-            subprocess.run(['kill', '-9', api_pid]) # Force kill the process (if the API is being accessed, it will not close until the connection is closed or the process is killed forcefully)
-            subprocess.run(['kill', web_pid])
-            print(f'Killed the processes with PIDs: {api_pid} and {web_pid}')
-            os.remove(pid_path)
+            supervisor_pid = dict(processes).get('Supervisor')
+            # The supervisor stops its children itself, processes started by an older version of the launcher are stopped one by one
+            targets = [supervisor_pid] if supervisor_pid is not None else [pid for name, pid in processes]
+            for pid in targets:
+                if is_running(pid):
+                    os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + 30
+            while any(is_running(pid) for pid in targets) and time.monotonic() < deadline:
+                time.sleep(.2)
+            for pid in targets:
+                if is_running(pid):
+                    print(f'PID {pid} did not exit, killing it.')
+                    os.kill(pid, signal.SIGKILL)
+            print(f'Killed the processes with PIDs: {" and ".join(str(pid) for name, pid in processes)}')
+            if os.path.exists(pid_path):
+                os.remove(pid_path)
             exit(0)
         except PermissionError as e:
             print(f'Error: {e}')
             print('Did you start the processes with sudo or as root?/n Or is the filesystem in Read-Only mode?')
             print('Please check the permissions and try again.')
             exit(1)
-        except subprocess.CalledProcessError as e:
-            print(f'Error: {e}')
-            print('There was an error running the commands. Please check the commands and try again.')
-            exit(1)
         except Exception as e:
             print(f'Error: {e}')
             print('An unknown error occurred. Please check the error message and try again.')
             exit(1)
+    elif args.restart:
+        try:
+            supervisor_pid = dict(read_pids(pid_path)).get('Supervisor')
+        except (FileNotFoundError, ValueError):
+            supervisor_pid = None
+        if supervisor_pid is None or not is_running(supervisor_pid):
+            print('The supervisor is not running. Start the application without options.')
+            exit(1)
+        try:
+            os.kill(supervisor_pid, signal.SIGHUP)
+        except PermissionError as e:
+            print(f'Error: {e}')
+            print('Did you start the processes with sudo or as root?')
+            exit(1)
+        print(f'Asked the supervisor (PID {supervisor_pid}) to restart the processes.')
+        exit(0)
+    elif args.status:
+        try:
+            processes = read_pids(pid_path)
+        except FileNotFoundError:
+            print('The application is not running.')
+            exit(3)
+        state = read_state(state_path)
+        services = state.get('services', {})
+        running = True
+        for name, pid in processes:
+            alive = is_running(pid)
+            running = running and alive
+            line = f'{name} process with PID {pid} is {"running" if alive else "not running"}.'
+            if name in services and alive:
+                service = services[name]
+                health = {True: 'answering', False: 'not answering', None: 'starting'}[service['healthy']]
+                line += f' {service["module"]} on port {service["port"]} is {health}, restarted {service["restarts"]} times.'
+            print(line)
+        update = state.get('update', {})
+        if update.get('available'):
+            print('Update available. Please run the script with the -u or --update option to update the application.')
+        elif update.get('error'):
+            print(f'The last update check failed: {update["error"]}')
+        exit(0 if running else 1)
     elif args.update:
         try:
             result = subprocess.check_output(['git', 'pull'], text=True)
@@ -114,7 +171,7 @@ if __name__ == '__main__':
             elif 'stash' in result:
                 print('Changes were made to the repository. Please stash or commit the changes and try again.')
                 exit(1)
-            print('Updated the application.\nIf changes other than to web related files were made, please restart the application.')
+            print('Updated the application.\nIf changes other than to web related files were made, please restart the application with the -r or --restart option.')
             exit(0)
         except subprocess.CalledProcessError as e:
             print(f'Error: {e}')
@@ -127,47 +184,49 @@ if __name__ == '__main__':
     
     try:
         if os.path.exists(pid_path):
-            with open(pid_path, 'r') as f:
-                print('PIDs file found. Checking if the processes are running...')
-                api_pid = f.readline().strip().split()[-1]
-                web_pid = f.readline().strip().split()[-1]
-            if subprocess.run(['ps', '-p', api_pid], stdout=subprocess.PIPE).returncode == 0:
-                print(f'API process with PID {api_pid} is running.')
-            else:
-                print(f'API process with PID {api_pid} is not running.')
-                api_pid = None
-            if subprocess.run(['ps', '-p', web_pid], stdout=subprocess.PIPE).returncode == 0:
-                print(f'Web process with PID {web_pid} is running.')
-            else:
-                print(f'Web process with PID {web_pid} is not running.')
-                web_pid = None
-            if api_pid is not None and web_pid is not None:
-                print('Both processes are running. If you want to kill the processes, run the script with the -k or --kill option.')
-                exit(1)
-            elif api_pid is not None:
-                print('API process is running. If you want to kill the process, run the script with the -k or --kill option.')
-                exit(1)
-            elif web_pid is not None:
-                print('Web process is running. If you want to kill the process, run the script with the -k or --kill option.')
+            print('PIDs file found. Checking if the processes are running...')
+            processes = read_pids(pid_path)
+            running = False
+            for name, pid in processes:
+                if is_running(pid):
+                    print(f'{name} process with PID {pid} is running.')
+                    running = True
+                else:
+                    print(f'{name} process with PID {pid} is not running.')
+            if running:
+                print('Processes are still running. If you want to kill the processes, run the script with the -k or --kill option.')
                 exit(1)
             else:
                 print('No processes are running. Starting the processes...')
-        try:
-            subprocess.check_output(['git', 'fetch'], text=True)
-            update_available = subprocess.check_output(['git', 'diff', 'HEAD', 'origin/main'], text=True)
-            if update_available:
-                print('Update available. Please run the script with the -u or --update option to update the application.')
-        except subprocess.CalledProcessError as e:
-            print(f'Error checking for updates: {e}')
-        subprocess.run(api_command, shell=True)
-        subprocess.run(web_command, shell=True)
-        api_pid = subprocess.check_output(['pgrep', '-f', 'api.api'], text=True).strip().split()[-1]
-        web_pid = subprocess.check_output(['pgrep', '-f', 'web.web'], text=True).strip().split()[-1]
-        with open(pid_path, 'w') as f:
-            f.write(f'API PID: {api_pid}\n')
-            f.write(f'Web PID: {web_pid}\n')
-        print(f'API PID: {api_pid}')
-        print(f'Web PID: {web_pid}')
+                os.remove(pid_path)
+        if args.foreground:
+            config = load_config()
+            if args.single:
+                services = [Service('App', 'api.unified', config.get('web_port', 8000), '/stream_stats', os.path.join(state_dir, 'app.log'), current_dir, python)]
+            else:
+                services = [Service('API', 'api.api', config.get('api_port', 8001), '/stream_stats', os.path.join(state_dir, 'api.log'), current_dir, python),
+                            Service('Web', 'web.web', config.get('web_port', 8000), '/', os.path.join(state_dir, 'web.log'), current_dir, python)]
+            repository = current_dir if os.path.isdir(os.path.join(current_dir, '.git')) else None
+            Supervisor(services, pid_path, state_path, config, repository).run()
+        else:
+            command = [python, os.path.join(current_dir, 'launcher.py'), '--foreground'] + (['--single'] if args.single else [])
+            with open(os.path.join(state_dir, 'supervisor.log'), 'ab') as log:
+                supervisor = subprocess.Popen(command, cwd=current_dir, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                              start_new_session=True)
+            # Wait for the supervisor to start the processes and write their PIDs
+            deadline = time.monotonic() + 10
+            processes = []
+            while len(processes) < (2 if args.single else 3) and supervisor.poll() is None and time.monotonic() < deadline:
+                time.sleep(.1)
+                try:
+                    processes = read_pids(pid_path)
+                except (FileNotFoundError, ValueError):
+                    processes = []
+            if supervisor.poll() is not None:
+                print(f'The supervisor exited with code {supervisor.returncode}, see {os.path.join(state_dir, "supervisor.log")}.')
+                exit(1)
+            for name, pid in processes:
+                print(f'{name} PID: {pid}')
     except PermissionError as e:
         print(f'Error: {e}')
         print('Most likely the filesystem is in Read-Only mode. Please check the filesystem and try again.')
@@ -1,7 +1,25 @@
 import json
 import os
 import glob
-from collections import deque
+import mmap
+import threading
+import ctypes
+from search import compile_filter, file_date, search_file
+from sources import is_compressed, read_lines, tail_stream
+
+try:
+    # inotify is only available on Linux, LogFiles falls back to checking the directory mtime elsewhere
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+except (OSError, AttributeError):
+    _inotify_init1 = None
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
 
 '''
 Parrot is a class that reads a log file and returns the log lines based on the number of lines and a filter string.
@@ -15,20 +33,276 @@ Parameters:
 
 Methods:
     read_log: A method that reads the log file and returns the log lines based on the number of lines and a filter string
+    read_page: A method that returns a page of log lines before or after a cursor, with the cursors of the previous and next pages
+    search_log: A method that returns the log lines written during a time range across all the dated log files
+
+Classes:
+    LogFiles: A class that caches the log files of each log prefix until the log directory changes
+    CursorExpired: An exception that is raised when the file of a page cursor is no longer in the log
+
+Functions:
+    tail: A function that returns the last lines of a file by reading it backwards from the end
+    lines_before: A function that returns the lines of a file that end before an offset, read backwards
+    lines_after: A function that yields the lines of a file that start at an offset
 
 Variables:
     config: A dictionary that stores the configuration values from the config.json file
     log_directory: A string that represents the directory where the log files are stored
     log_file: A string that represents the log file name
     debug: A boolean value that represents whether debug mode is enabled
+    is_service: A boolean value that represents whether the application is running as a service from /usr/local/lib/callerid
+    data_directory: A string that represents the writable directory for databases and other state (/var/lib/callerid when running as a service)
+    cache_directory: A string that represents the persistent directory for the larger files that are kept across reboots (/var/cache/callerid
+        when running as a service, /var/lib/callerid is a 10 MB tmpfs)
 
 Returns:
     None
 
 Exceptions:
     FileNotFoundError: An exception that is raised when the log files are not found
+    CursorExpired: An exception that is raised when the file of a page cursor was deleted or compressed
 '''
 
+def lines_before(path: str, end: int, count: int, filter: str = None):
+    '''
+    lines_before is a function that returns the last complete lines of a file that end before a byte offset, read backwards.
+
+    Parameters:
+        path: A string that represents the path of a plain file
+        end: An integer that represents the byte offset the lines end at (a line boundary), or None for the end of the file
+        count: An integer that represents the number of lines to return
+        filter: A string that has to be in a line for it to be returned (and counted)
+
+    Variables:
+        position: An integer that represents the end of the next line to read, excluding its newline
+
+    Returns:
+        tuple: A tuple (lines, end) where lines is a list of tuples (start, line) with the offset of each line, oldest first, and end is
+            the offset the lines end at (the end of the last complete line when end was None)
+    '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if count <= 0 or end == 0:
+            return [], end
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[end - 1:end] != b'\n':
+                # Skip a line that is still being written
+                end = view.rfind(b'\n', 0, end) + 1
+            lines = []
+            position = end - 1
+            while len(lines) < count and position >= 0:
+                start = view.rfind(b'\n', 0, position) + 1
+                line = view[start:position].decode('utf-8', errors='replace').strip()
+                if filter is None or filter in line:
+                    lines.append((start, line))
+                position = start - 1
+            lines.reverse()
+            return lines, end
+
+
+def lines_after(path: str, start: int, count: int, filter: str = None):
+    '''
+    lines_after is a function that yields the complete lines of a file that start at a byte offset, as the file is read.
+
+    Parameters:
+        path: A string that represents the path of a plain file
+        start: An integer that represents the byte offset of the first line (a line boundary)
+        count: An integer that represents the maximum number of lines to yield
+        filter: A string that has to be in a line for it to be yielded (and counted)
+
+    Returns:
+        generator: A generator of tuples (end, line) where end is the offset just past the newline of the line, oldest first, followed by
+            (end, None) with the end of the last complete line when the end of the file is reached before count lines
+    '''
+    if count <= 0:
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            position += len(raw)
+            line = raw.decode('utf-8', errors='replace').strip()
+            if filter is None or filter in line:
+                yield position, line
+                count -= 1
+                if count == 0:
+                    return
+        yield position, None
+
+
+def tail(path: str, lines: int, block_size: int = 8192):
+    '''
+    tail is a function that returns the last lines of a file without reading the whole file.
+
+    The file is memory-mapped and searched backwards from the end for newline characters until enough lines are found,
+    so the cost depends on the number of lines requested and not on the size of the file. Only the selected lines are decoded.
+    If the file cannot be memory-mapped (e.g. it is not a regular file), it is read backwards in blocks of block_size bytes instead.
+    Compressed files cannot be read backwards, they are decompressed as a stream that only keeps the last lines (see sources.py).
+
+    Parameters:
+        path: A string that represents the path of the file
+        lines: An integer that represents the number of lines to return
+        block_size: An integer that represents the number of bytes read per step when the file cannot be memory-mapped
+
+    Variables:
+        size: An integer that represents the size of the file when it was opened
+        end: An integer that represents the offset where the last line ends, ignoring the trailing newline
+
+    Returns:
+        list: A list of strings that represent the last lines of the file, oldest first
+    '''
+    if is_compressed(path):
+        return tail_stream(path, lines)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if lines <= 0 or size == 0:
+            return []
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            view = None
+        if view is not None:
+            with view:
+                end = size - 1 if view[size - 1:size] == b'\n' else size
+                offsets = []
+                while len(offsets) < lines and end >= 0:
+                    start = view.rfind(b'\n', 0, end) + 1
+                    offsets.append((start, end))
+                    end = start - 1
+                return [view[start:end].decode('utf-8', errors='replace') for start, end in reversed(offsets)]
+        # Fallback: read fixed-size blocks backwards until enough newlines have been seen
+        position = size
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        return [line.decode('utf-8', errors='replace') for line in data.split(b'\n')[-lines:]]
+
+
+class CursorExpired(LookupError):
+    '''
+    CursorExpired is an exception that is raised by LogDog.read_page when the file of a cursor was deleted or compressed since the cursor
+    was returned, the routes answer it with 410 Gone. It is a LookupError so callers that caught LookupError still catch it.
+    '''
+
+
+class LogFiles:
+    def __init__(self, directory: str):
+        '''
+        LogFiles constructor.
+
+        LogFiles caches the files that match each log prefix (e.g. MMDVM or YSFGateway) so the log directory is not scanned with glob
+        and every file is not stat'ed on each read. Pi-Star keeps one dated file per day for each log, so the list only changes when
+        a file is created, removed or renamed. Those changes are detected with inotify where it is available, otherwise with a single
+        stat of the directory to compare its mtime, and the whole cache is dropped when one happens.
+        Compressed rotated files (see sources.py) are cached with the plain ones, but they are never the newest file of a log.
+
+        Parameters:
+            directory: A string that represents the directory where the log files are stored
+
+        Variables:
+            cache: A dictionary that maps a log prefix to its files, oldest first
+            inotify_fd: An integer that represents the inotify file descriptor, or None when the mtime check is used
+            mtime: An integer that represents the mtime of the directory in nanoseconds when the cache was filled
+
+        Returns:
+            None
+        '''
+        self.directory = directory
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.inotify_fd = None
+        self.mtime = None
+        if _inotify_init1 is not None:
+            fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                if _inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO) >= 0:
+                    self.inotify_fd = fd
+                else:
+                    os.close(fd)
+
+    def changed(self):
+        '''
+        changed is a method that returns whether files were added, removed or renamed in the log directory since the last call.
+
+        Parameters:
+            None
+
+        Returns:
+            bool: True if the directory changed, otherwise False
+        '''
+        if self.inotify_fd is not None:
+            changed = False
+            try:
+                # Drain every pending event, their content does not matter
+                while os.read(self.inotify_fd, 4096):
+                    changed = True
+            except BlockingIOError:
+                pass
+            return changed
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        changed = mtime != self.mtime
+        self.mtime = mtime
+        return changed
+
+    def files(self, log_file: str, compressed: bool = True):
+        '''
+        files is a method that returns the files that start with a log prefix, oldest first.
+
+        Parameters:
+            log_file: A string that represents the log file prefix
+            compressed: A boolean that represents whether to include the compressed files, which are never written to
+
+        Returns:
+            list: A list of strings that represent the paths of the log files sorted by ctime
+        '''
+        with self.lock:
+            if self.changed():
+                self.cache.clear()
+            files = self.cache.get(log_file)
+            if files is None:
+                files = []
+                for path in glob.glob(f'{self.directory}/{log_file}*'):
+                    try:
+                        files.append((os.path.getctime(path), path))
+                    except FileNotFoundError:
+                        continue
+                files = [path for ctime, path in sorted(files)]
+                self.cache[log_file] = files
+            if not compressed:
+                return [path for path in files if not is_compressed(path)]
+            return files
+
+    def newest(self, log_file: str):
+        '''
+        newest is a method that returns the newest plain file that starts with a log prefix, which is the file being written to.
+
+        Parameters:
+            log_file: A string that represents the log file prefix
+
+        Returns:
+            str: A string that represents the path of the newest log file
+
+        Exceptions:
+            FileNotFoundError: An exception that is raised when the log files are not found
+        '''
+        files = self.files(log_file, compressed=False)
+        if not files:
+            raise FileNotFoundError(f'No files found that contain "{log_file}" in their name')
+        return files[-1]
+
+
 class LogDog:
     def __init__(self):
         '''
@@ -39,6 +313,9 @@ class LogDog:
         
         Variables:
             config: A dictionary that stores the configuration values from the config.json file
+            is_service: A boolean value that represents whether the application is running as a service from /usr/local/lib/callerid
+            data_directory: A string that represents the writable directory for databases and other state
+            cache_directory: A string that represents the persistent directory for the larger files, like the callbook index and the history
         
         Returns:
             None
@@ -56,22 +333,32 @@ class LogDog:
                 setattr(self, key, False)
         if self.debug == True:
             print(f'{key}: {self.config[key]}')
+        self.log_files = LogFiles(self.log_directory)
+        # When running from Pi-Star, /usr/local/lib/callerid is read-only so state is written to /var/lib/callerid like in launcher.py
+        self.is_service = os.path.dirname(os.path.realpath(__file__)) == '/usr/local/lib/callerid'
+        self.data_directory = '/var/lib/callerid' if self.is_service else '.'
+        self.cache_directory = getattr(self, 'cache_directory', None) or ('/var/cache/callerid' if self.is_service else '.')
         
         
     def read_log(self, lines: int = None, filter: str = None, log_override: str = None):
         '''
         read_log is a method that reads the log file and returns the log lines based on the number of lines and a filter string.
         
-        Uses deque to store the last lines read from the log file and returns the log lines based on the number of lines and a filter string.
+        When lines is set, the last lines are found with tail, which reads the file backwards from the end so the time taken depends on
+        the number of lines and not on the size of the log. When lines is None, the whole file is streamed from the beginning.
+        
+        The log to read is a local variable, self.log_file is never changed, so concurrent requests with and without log_override
+        (from the threads of the API or of Flask) cannot read each other's log.
         
         Parameters:
             lines: An integer that represents the number of lines to read from the log file
             filter: A string that represents the filter to apply to the log lines
+            log_override: A string that represents a log file prefix to read instead of self.log_file
         
         Variables:
-            files: A list of strings that represent the log files in the log directory
-            newest_file: A string that represents the newest log file
-            last_lines: A deque object that stores the last lines read from the log file
+            log_file: A string that represents the log file prefix to read, log_override or self.log_file
+            newest_file: A string that represents the newest log file, from the self.log_files cache
+            last_lines: An iterable of strings that represent the lines read from the log file
         
         Returns:
             generator: A generator that yields the log lines
@@ -79,20 +366,16 @@ class LogDog:
         Exceptions:
             FileNotFoundError: An exception that is raised when the log files are not found
         '''
-        if log_override is not None:
-            self.log_file = log_override
-        # Find all files that contain self.log_file in their name
-        files = glob.glob(f'{self.log_directory}/{self.log_file}*')
-
-        # If no files were found, raise an exception
-        if not files:
-            raise FileNotFoundError(f'No files found that contain "{self.log_file}" in their name')
+        log_file = log_override or self.log_file
+        # Find the newest file that contains log_file in its name, raises FileNotFoundError if there is none
+        newest_file = self.log_files.newest(log_file)
 
-        # Find the newest file
-        newest_file = max(files, key=os.path.getctime)
-
-        with open(newest_file, 'r') as f:
-            last_lines = deque(f, maxlen=lines)
+        if lines is None:
+            for line in read_lines(newest_file):
+                if filter is None or filter in line:
+                    yield line
+        else:
+            last_lines = tail(newest_file, lines)
             for line in last_lines:
                 if filter is not None:
                     if filter in line:
@@ -101,9 +384,123 @@ class LogDog:
                         continue
                 else:
                     yield line.strip()
+
+    def read_page(self, lines: int = None, filter: str = None, log_override: str = None, before: str = None, after: str = None,
+                  limit: int = 5000):
+        '''
+        read_page is a method that returns a page of log lines as a stream, with the cursors of the older and newer pages.
+
+        A cursor is an opaque string (the inode of a file and a byte offset in it), so a page is found by seeking and not by counting
+        lines from the start of the log, and pages keep their place while the log is written. Paging past the start or the end of a
+        file continues in the previous or next file of the log.
+            Without a cursor: the last lines of the newest file, or its first lines when lines is None
+            before: the lines that end at the cursor, read backwards
+            after: the lines that start at the cursor, read forwards as they are yielded, so the memory used does not depend on the page
+        
+        Parameters:
+            lines: An integer that represents the number of lines of the page (at least 1), capped by limit
+            filter: A string that has to be in a line for it to be returned
+            log_override: A string that represents a log file prefix to read instead of self.log_file
+            before: A string that represents the cursor the page ends at (the older cursor of a previous page)
+            after: A string that represents the cursor the page starts at (the newer cursor of a previous page)
+            limit: An integer that represents the maximum number of lines of a page
+
+        Variables:
+            files: A list of strings that represent the plain files of the log, oldest first
+            inodes: A list of the inodes of the files
+
+        Returns:
+            generator: A generator that yields each line as a string, then a dictionary with the older and newer cursors (None when there
+                is no older page)
+
+        Exceptions:
+            FileNotFoundError: An exception that is raised when the log files are not found
+            CursorExpired: An exception that is raised when the file of the cursor was deleted or compressed
+            ValueError: An exception that is raised when the cursor is malformed or lines is less than 1
+        '''
+        log_file = log_override or self.log_file
+        if lines is not None and lines < 1:
+            raise ValueError('lines must be at least 1')
+        count = max(1, min(lines, limit) if lines is not None else limit)
+        files = self.log_files.files(log_file, compressed=False)
+        if not files:
+            raise FileNotFoundError(f'No files found that contain "{log_file}" in their name')
+        inodes = [os.stat(path).st_ino for path in files]
+        cursor = before or after
+        if cursor is not None:
+            inode, _, offset = cursor.partition(':')
+            inode, offset = int(inode), int(offset)
+            if inode not in inodes:
+                raise CursorExpired(f'The file of cursor {cursor} is no longer in the log')
+            index = inodes.index(inode)
+        else:
+            index, offset = len(files) - 1, None
+        path = files[index]
+        if after is not None or (before is None and lines is None):
+            start = offset or 0
+            end = start
+            complete = False
+            for end, line in lines_after(path, start, count, filter):
+                if line is None:
+                    complete = True
+                else:
+                    yield line
+            if complete and index + 1 < len(files) and end == os.path.getsize(path):
+                newer = f'{inodes[index + 1]}:0'
+            else:
+                newer = f'{inodes[index]}:{end}'
+            older = f'{inodes[index]}:{start}' if start > 0 else None
+        else:
+            page, end = lines_before(path, offset, count, filter)
+            for start, line in page:
+                yield line
+            # A short page means the start of the file was reached
+            start = page[0][0] if page and len(page) == count else 0
+            newer = f'{inodes[index]}:{end}'
+            older = f'{inodes[index]}:{start}' if start > 0 else None
+        if older is None and index > 0:
+            older = f'{inodes[index - 1]}:{os.path.getsize(files[index - 1])}'
+        yield {'older': older, 'newer': newer}
+
+    def search_log(self, start: str = None, end: str = None, pattern: str = None, terms: list = None, log_override: str = None):
+        '''
+        search_log is a method that returns the log lines written during a time range across all the dated files of the log.
+        
+        Files whose date suffix is outside the range are skipped without being opened, and the start of the range is found in each file
+        with a binary search on the line timestamps (see search.py), so only the lines in the range are read.
+        Compressed rotated files are searched too, by decompressing them as a stream, and files that cannot be read are skipped.
+        
+        Parameters:
+            start: A string that represents the earliest time (inclusive) in the format YYYY-MM-DD HH:MM:SS.mmm, a prefix is allowed
+            end: A string that represents the latest time (exclusive) in the same format, a prefix is allowed
+            pattern: A string that represents a regular expression that has to be found in the line
+            terms: A list of strings that all have to be in the line
+            log_override: A string that represents a log file prefix to search instead of self.log_file
         
-        if log_override is not None:
-            self.log_file = self.config['log_file']
+        Variables:
+            matcher: A callable that returns whether a line matches pattern and terms, None to return every line
+            files: A list of strings that represent the log files sorted by the date in their name
+        
+        Returns:
+            generator: A generator that yields the log lines, oldest first
+        
+        Exceptions:
+            re.error: An exception that is raised when the pattern is not a valid regular expression
+        '''
+        log_file = log_override or self.log_file
+        matcher = compile_filter(pattern, terms)
+        files = sorted(self.log_files.files(log_file), key=lambda path: (file_date(path) or '', path))
+        for path in files:
+            date = file_date(path)
+            if date is not None:
+                if start is not None and date < start[:10]:
+                    continue
+                if end is not None and date > end[:10]:
+                    continue
+            try:
+                yield from search_file(path, start, end, matcher)
+            except OSError as e:
+                print(f'Skipping {path}: {e}')
 
         
 if __name__ == '__main__':
@@ -0,0 +1,484 @@
+import time
+from bisect import bisect_left
+
+'''
+metrics is a module that counts what the API does on its hot paths and renders the counts in the Prometheus text format.
+
+When the dashboard lags it can be the disk, the poll loop or a slow client. The tailers, the parser and the streaming routes update the
+metrics below as they work, and /metrics returns them so they can be read with curl or scraped by Prometheus. prometheus_client is not
+used so nothing has to be installed on the hotspot, and the metrics are cheap enough to leave on all the time on a Pi: an update is an
+integer addition (a bisect for histograms) on an object that is looked up once, when a tailer or a client is created, and values that
+only matter when someone looks at them (clients, queue depths) are read at scrape time by collectors instead of being kept up to date.
+
+Classes:
+    Metric: The base class of the metrics, a metric with labels holds one child per set of label values
+    Counter: A value that only goes up, with optional labels
+    Gauge: A value that goes up and down, with optional labels
+    Histogram: A distribution of observed values in fixed buckets, with optional labels
+    Rate: The number of events per second over a sliding window, with optional labels
+    Registry: A collection of metrics and collectors rendered together
+
+Functions:
+    format_labels: A function that formats a label set
+    escape: A function that escapes a label value
+    format_value: A function that formats a sample value
+
+Attributes:
+    registry: The Registry object the metrics below and the collectors of the API are registered in
+    POLL_SECONDS: A Histogram of the time a tailer spends polling its log file (reading the new bytes and splitting them into lines)
+    FANOUT_SECONDS: A Histogram of the time a tailer spends offering the new lines of a poll to its subscribers
+    BYTES_READ: A Counter of the bytes read from the log files
+    LINES_READ: A Counter of the lines read from the log files
+    ROTATIONS: A Counter of the rotations (and truncations) of the log files followed by the tailers
+    PARSE_SECONDS: A Counter of the time spent parsing lines into events
+    LINES_PARSED: A Counter of the lines parsed into events
+    EVENTS: A Counter of the events parsed, by type
+    EVENT_RATE: A Rate of the events parsed per second over the last minute
+    DROPPED: A Counter of the lines dropped because a client queue was full
+    STREAM_WRITES: A Counter of the writes (SSE responses and WebSocket messages) sent to streaming clients
+    STREAM_LINES: A Counter of the lines sent in those writes
+    LOOP_LAG: A Histogram of how late the event loop of the API wakes up a task that sleeps, the time it was blocked
+    PEER_EVENTS: A Counter of the events of each node merged by the aggregator
+    PEER_DUPLICATES: A Counter of the copies of network transmissions dropped by the aggregator, by the node that sent the copy
+    PEER_RECONNECTS: A Counter of the times the stream of a peer was closed or could not be opened
+    SESSIONS: A Counter of the transmission sessions ended, by the reason they ended (end, replaced or timeout)
+'''
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ''):
+    '''
+    format_labels is a function that formats label names and values as a Prometheus label set.
+
+    Parameters:
+        names: A tuple of strings that represent the label names
+        values: A tuple of the label values
+        extra: A string that represents an extra label already formatted (e.g. le="0.1")
+
+    Returns:
+        str: A string that represents the label set with its braces, or an empty string if there are no labels
+    '''
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    '''
+    escape is a function that escapes a label value for the Prometheus text format.
+
+    Parameters:
+        value: The label value, converted to a string
+
+    Returns:
+        str: A string that represents the escaped value
+    '''
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float):
+    '''
+    format_value is a function that formats a sample value, integers without a decimal point.
+
+    Parameters:
+        value: A number
+
+    Returns:
+        str: A string that represents the value
+    '''
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        '''
+        Metric constructor, the base class of Counter, Gauge, Histogram and Rate.
+
+        Parameters:
+            name: A string that represents the metric name (e.g. logdog_lines_read_total)
+            help: A string that describes the metric
+            labels: A tuple of strings that represent the label names, every child has one value per label
+
+        Variables:
+            children: A dictionary that maps a tuple of label values to the child that holds its value
+
+        Returns:
+            None
+        '''
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+
+    def labels(self, *values):
+        '''
+        labels is a method that returns the child of a set of label values, created on first use.
+
+        Callers on a hot path keep the child and update it directly so the lookup is done once.
+
+        Parameters:
+            values: The label values (strings), in the order of the label names
+
+        Returns:
+            The child object (a Counter, Gauge, Histogram or Rate without labels)
+
+        Exceptions:
+            ValueError: An exception that is raised when the number of values does not match the label names
+        '''
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} expects the labels {", ".join(self.label_names)}')
+            child = self.children[values] = self.child()
+        return child
+
+    def child(self):
+        '''
+        child is a method that returns a new child without labels, of the same type and settings as the metric.
+        '''
+        return type(self)(self.name, self.help)
+
+    def series(self):
+        '''
+        series is a method that yields the label values and the child of every series of the metric.
+
+        A metric without labels is its own only series.
+        '''
+        if self.label_names:
+            yield from self.children.items()
+        else:
+            yield (), self
+
+    def samples(self, values: tuple, child):
+        '''
+        samples is a method that returns the sample lines of one series.
+
+        Parameters:
+            values: A tuple of the label values of the series
+            child: The child that holds the value of the series
+
+        Returns:
+            list: A list of strings that represent the sample lines
+        '''
+        return [f'{self.name}{format_labels(self.label_names, values)} {format_value(child.value)}']
+
+    def render(self):
+        '''
+        render is a method that returns the metric in the Prometheus text format.
+
+        Returns:
+            list: A list of strings that represent the HELP and TYPE lines followed by the sample lines
+        '''
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for values, child in list(self.series()):
+            lines += self.samples(values, child)
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        '''
+        Counter constructor, see Metric.
+        '''
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        '''
+        inc is a method that adds an amount to the counter.
+
+        Parameters:
+            amount: A non-negative number to add
+
+        Returns:
+            None
+        '''
+        self.value += amount
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float):
+        '''
+        set is a method that sets the gauge to a value.
+
+        Parameters:
+            value: A number
+
+        Returns:
+            None
+        '''
+        self.value = value
+
+    def dec(self, amount: float = 1):
+        '''
+        dec is a method that subtracts an amount from the gauge.
+
+        Parameters:
+            amount: A number to subtract
+
+        Returns:
+            None
+        '''
+        self.value -= amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    # Seconds, from a fast poll of an idle log to a slow SD card
+    BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        '''
+        Histogram constructor.
+
+        Parameters:
+            name: A string that represents the metric name (e.g. logdog_poll_duration_seconds)
+            help: A string that describes the metric
+            labels: A tuple of strings that represent the label names
+            buckets: A tuple of floats that represent the upper bounds of the buckets, in increasing order (+Inf is added)
+
+        Variables:
+            counts: A list of integers that represent the number of values in each bucket (not cumulative, the last one is +Inf)
+            sum: A float that represents the sum of the observed values
+            count: An integer that represents the number of observed values
+
+        Returns:
+            None
+        '''
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def child(self):
+        '''
+        child is a method that returns a new histogram without labels with the same buckets.
+        '''
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        '''
+        observe is a method that adds a value to the histogram.
+
+        Parameters:
+            value: A number (e.g. a duration in seconds)
+
+        Returns:
+            None
+        '''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, values: tuple, child):
+        '''
+        samples is a method that returns the cumulative bucket, sum and count lines of one series.
+
+        Parameters:
+            values: A tuple of the label values of the series
+            child: The Histogram object that holds the series
+
+        Returns:
+            list: A list of strings that represent the sample lines
+        '''
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            total += count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f'{self.name}_bucket{format_labels(self.label_names, values, le)} {total}')
+        lines.append(f'{self.name}_sum{format_labels(self.label_names, values)} {format_value(child.sum)}')
+        lines.append(f'{self.name}_count{format_labels(self.label_names, values)} {child.count}')
+        return lines
+
+
+class Rate(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), window: int = 60):
+        '''
+        Rate constructor.
+
+        Rate counts events in one slot per second of a ring of window slots, the rate is the sum of the slots divided by the window.
+        Prometheus can compute rates from counters, a Rate is for reading /metrics by hand or from the dashboard.
+
+        Parameters:
+            name: A string that represents the metric name (e.g. logdog_events_per_second)
+            help: A string that describes the metric
+            labels: A tuple of strings that represent the label names
+            window: An integer that represents the number of seconds the rate is averaged over
+
+        Variables:
+            slots: A list of integers that represent the events counted during each second of the window
+            second: An integer that represents the second (since the epoch of time.monotonic) of the last event
+
+        Returns:
+            None
+        '''
+        super().__init__(name, help, labels)
+        self.window = window
+        self.slots = [0] * window
+        self.second = int(time.monotonic())
+
+    def child(self):
+        '''
+        child is a method that returns a new rate without labels with the same window.
+        '''
+        return Rate(self.name, self.help, window=self.window)
+
+    def advance(self, second: int):
+        '''
+        advance is a method that clears the slots of the seconds without events between the last event and second.
+
+        Parameters:
+            second: An integer that represents the current second
+
+        Returns:
+            None
+        '''
+        for elapsed in range(self.second + 1, min(second, self.second + self.window) + 1):
+            self.slots[elapsed % self.window] = 0
+        self.second = max(self.second, second)
+
+    def mark(self, count: int = 1):
+        '''
+        mark is a method that counts events in the current second.
+
+        Parameters:
+            count: An integer that represents the number of events
+
+        Returns:
+            None
+        '''
+        second = int(time.monotonic())
+        if second != self.second:
+            self.advance(second)
+        self.slots[second % self.window] += count
+
+    @property
+    def value(self):
+        '''
+        value is a property that returns the number of events per second over the window.
+        '''
+        self.advance(int(time.monotonic()))
+        return round(sum(self.slots) / self.window, 3)
+
+
+class Registry:
+    def __init__(self):
+        '''
+        Registry constructor.
+
+        Variables:
+            metrics: A dictionary that maps each metric name to its Metric object, in the order they were registered
+            collectors: A list of callables that return a list of Metric objects built at scrape time
+
+        Returns:
+            None
+        '''
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric: Metric):
+        '''
+        register is a method that adds a metric to the registry and returns it.
+
+        Parameters:
+            metric: A Metric object
+
+        Returns:
+            Metric: The registered metric, the one already registered under the same name if there is one
+
+        Exceptions:
+            ValueError: An exception that is raised when a different type of metric is registered under the same name
+        '''
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f'{metric.name} is already registered as a {existing.type}')
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()):
+        '''
+        counter is a method that registers a Counter, see Counter.
+        '''
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()):
+        '''
+        gauge is a method that registers a Gauge, see Gauge.
+        '''
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = Histogram.BUCKETS):
+        '''
+        histogram is a method that registers a Histogram, see Histogram.
+        '''
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def rate(self, name: str, help: str, labels: tuple = (), window: int = 60):
+        '''
+        rate is a method that registers a Rate, see Rate.
+        '''
+        return self.register(Rate(name, help, labels, window))
+
+    def add_collector(self, collector):
+        '''
+        add_collector is a method that adds a callable that builds metrics when the registry is rendered.
+
+        Parameters:
+            collector: A callable without parameters that returns a list of Metric objects
+
+        Returns:
+            None
+        '''
+        self.collectors.append(collector)
+
+    def render(self):
+        '''
+        render is a method that returns every metric of the registry and of its collectors in the Prometheus text format.
+
+        Returns:
+            str: A string that represents the metrics, ending with a newline
+        '''
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines += metric.render()
+        for collector in self.collectors:
+            for metric in collector():
+                lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+POLL_SECONDS = registry.histogram('logdog_poll_duration_seconds', 'Time spent reading the new lines of a log file in one poll.', ('log',))
+FANOUT_SECONDS = registry.histogram('logdog_fanout_duration_seconds', 'Time spent offering the new lines of one poll to the subscribers.', ('log',))
+BYTES_READ = registry.counter('logdog_bytes_read_total', 'Bytes read from the log files by the tailers.', ('log',))
+LINES_READ = registry.counter('logdog_lines_read_total', 'Lines read from the log files by the tailers.', ('log',))
+ROTATIONS = registry.counter('logdog_rotations_total', 'Log files rotated or truncated while they were followed.', ('log',))
+PARSE_SECONDS = registry.counter('logdog_parse_seconds_total', 'Time spent parsing lines into events.', ('log',))
+LINES_PARSED = registry.counter('logdog_lines_parsed_total', 'Lines parsed into events.', ('log',))
+EVENTS = registry.counter('logdog_events_total', 'Events parsed from the lines, by type.', ('log', 'type'))
+EVENT_RATE = registry.rate('logdog_events_per_second', 'Events parsed per second over the last minute.', ('log',))
+DROPPED = registry.counter('logdog_dropped_total', 'Lines dropped because a client queue was full.', ('policy',))
+STREAM_WRITES = registry.counter('logdog_stream_writes_total', 'Writes sent to streaming clients, several lines are coalesced into one write.', ('transport',))
+STREAM_LINES = registry.counter('logdog_stream_lines_total', 'Lines sent to streaming clients.', ('transport',))
+LOOP_LAG = registry.histogram('logdog_event_loop_lag_seconds', 'Delay of the event loop in waking up a sleeping task.',
+                              buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+PEER_EVENTS = registry.counter('logdog_peer_events_total', 'Events of each node merged by the aggregator.', ('node',))
+PEER_DUPLICATES = registry.counter('logdog_peer_duplicates_total', 'Copies of network transmissions heard by several nodes and dropped.', ('node',))
+PEER_RECONNECTS = registry.counter('logdog_peer_reconnects_total', 'Streams of peers closed or that could not be opened.', ('node',))
+SESSIONS = registry.counter('logdog_sessions_total', 'Transmission sessions ended, by the reason they ended.', ('log', 'reason'))
@@ -0,0 +1,150 @@
+import json
+from collections import OrderedDict, deque
+
+'''
+recent is a module that keeps the recent events of a log and the current state of the station in memory.
+
+A new dashboard used to show an empty table and no reflector until the next transmission or link, unless it re-read the log file.
+RecentEvents keeps the last events of a log in a ring buffer of fixed size, along with the state they lead to: the stations last
+heard, the transmissions in progress and the linked reflector. It is updated by the tailer of the log as each line is published,
+and its snapshot is sent to a new client as its first frame, so the time to a populated display depends on neither the size of
+the log nor its history, and the memory used is fixed.
+
+The snapshot is a JSON object:
+    {"log": "MMDVM", "id": "123:456", "events": [...], "last_heard": [...], "transmissions": [...], "reflector": "AMERICA-LINK"}
+    id: The cursor of the last line the snapshot includes, null if the log has no line yet
+    events: The last events of the log, oldest first (see events.py for the format of an event)
+    last_heard: The last event of each station last heard, most recent first
+    transmissions: The header events of the transmissions in progress, one per mode and DMR slot
+    reflector: The reflector or room the gateway is linked to, null when it is not linked
+
+Classes:
+    RecentEvents: A class that keeps the recent events and the state of a log
+'''
+
+
+class RecentEvents:
+    def __init__(self, log: str, size: int = 100, last_heard_size: int = 20):
+        '''
+        RecentEvents constructor.
+
+        Parameters:
+            log: A string that represents the log file prefix
+            size: An integer that represents the number of events kept
+            last_heard_size: An integer that represents the number of stations kept in last_heard
+
+        Variables:
+            events: A deque object of the TailRecord objects of the last events, oldest first
+            last_heard: An OrderedDict object that maps the callsign of each station last heard to its last TailRecord, oldest first
+            transmissions: A dictionary that maps the mode and DMR slot of each transmission in progress to the TailRecord of its header
+            reflector: A string that represents the linked reflector or room, None when the gateway is not linked
+            seeded: A boolean that represents whether the events written before the tailer started were read from the log file
+            cursor: A string that represents the cursor of the last line added
+            cached: A string that represents the last snapshot, None once an event is added
+
+        Returns:
+            None
+        '''
+        self.log = log
+        self.size = size
+        self.last_heard_size = last_heard_size
+        self.events = deque(maxlen=size)
+        self.last_heard = OrderedDict()
+        self.transmissions = {}
+        self.reflector = None
+        self.seeded = False
+        self.cursor = None
+        self.cached = None
+
+    def add(self, record):
+        '''
+        add is a method that adds a published line to the ring buffer and updates the state, lines that are not events are skipped.
+
+        Parameters:
+            record: A TailRecord object
+
+        Returns:
+            None
+        '''
+        self.cursor = record.id
+        event = record.event
+        if event is None:
+            return
+        self.cached = None
+        self.events.append(record)
+        if event.type == 'link':
+            self.reflector = event.reflector
+        elif event.type == 'unlink':
+            self.reflector = None
+        else:
+            key = (event.mode, event.slot)
+            if event.type == 'header':
+                self.transmissions[key] = record
+            else:
+                self.transmissions.pop(key, None)
+            if event.callsign:
+                self.last_heard.pop(event.callsign, None)
+                self.last_heard[event.callsign] = record
+                if len(self.last_heard) > self.last_heard_size:
+                    self.last_heard.popitem(last=False)
+
+    def seed(self, records: list):
+        '''
+        seed is a method that adds the lines written before the tailer started, read from the end of the log file.
+
+        Parameters:
+            records: A list of TailRecord objects, oldest first
+
+        Returns:
+            None
+        '''
+        for record in records:
+            self.add(record)
+        self.seeded = True
+
+    def clear(self):
+        '''
+        clear is a method that forgets the events and the state, when the tailer stops and the log is no longer followed.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        self.events.clear()
+        self.last_heard.clear()
+        self.transmissions.clear()
+        self.reflector = None
+        self.seeded = False
+        self.cursor = None
+        self.cached = None
+
+    def snapshot(self, line_filter=None):
+        '''
+        snapshot is a method that returns the recent events and the state of the log as JSON.
+
+        The snapshot without a filter is built once and shared by every client until the next event. With a filter, the events and the
+        stations last heard are the ones that pass it, the transmissions in progress and the reflector are always sent.
+
+        Parameters:
+            line_filter: An optional StreamFilter object (see filters.py)
+
+        Returns:
+            str: A string that represents the snapshot as a JSON object
+        '''
+        if line_filter is None and self.cached is not None:
+            return self.cached
+        events = self.events
+        last_heard = reversed(self.last_heard.values())
+        if line_filter is not None:
+            events = [record for record in events if line_filter.matches(record)]
+            last_heard = [record for record in last_heard if line_filter.matches(record)]
+        text = (f'{{"log":{json.dumps(self.log)},"id":{json.dumps(self.cursor)},'
+                f'"events":[{",".join(record.event_json for record in events)}],'
+                f'"last_heard":[{",".join(record.event_json for record in last_heard)}],'
+                f'"transmissions":[{",".join(record.event_json for record in self.transmissions.values())}],'
+                f'"reflector":{json.dumps(self.reflector)}}}')
+        if line_filter is None:
+            self.cached = text
+        return text
@@ -0,0 +1,195 @@
+import os
+import re
+from sources import is_compressed, map_file, open_source
+
+'''
+search is a module that finds the log lines written during a time range across all the dated files of a log.
+
+Pi-Star writes one file per day per log (e.g. MMDVM-2024-04-04.log) and every line starts with a level and a timestamp in the format
+"M: YYYY-MM-DD HH:MM:SS.mmm". Files whose date is outside the range are skipped from their name alone. Inside a file, the first line of the
+range is found with a binary search on the timestamps of the memory-mapped file, and lines are only read and decoded from there until the
+end of the range, so finding an hour of activity from last week touches a few pages of one file instead of every line of every file.
+
+Compressed rotated files (see sources.py) cannot be searched by offset, they are decompressed as a stream and read until the end of the
+range instead, but they are still skipped entirely when their date is outside the range.
+
+Times are compared as strings in the log format, so prefixes such as "2024-04-04" or "2024-04-04 12:30" can be used as bounds.
+
+Functions:
+    file_date: A function that returns the date in the name of a log file
+    line_time: A function that returns the timestamp at the start of a log line
+    find_offset: A function that returns the offset of the first line at or after a time in a memory-mapped file
+    search_file: A function that yields the lines of a file written during a time range
+    search_stream: A function that yields the lines of a compressed file written during a time range
+    compile_filter: A function that builds a line matcher from a regular expression or a list of terms
+'''
+
+date_regex = re.compile(r'(\d{4}-\d{2}-\d{2})')
+time_regex = re.compile(rb'\w: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3})')
+
+
+def file_date(path: str):
+    '''
+    file_date is a function that returns the date in the name of a log file.
+
+    Parameters:
+        path: A string that represents the path of the log file
+
+    Returns:
+        str: A string that represents the date in the format YYYY-MM-DD, or None if the name does not contain a date
+    '''
+    match = date_regex.search(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def line_time(view, start: int):
+    '''
+    line_time is a function that returns the timestamp at the start of the line that begins at an offset.
+
+    Parameters:
+        view: A mmap object (or bytes) that represents the file
+        start: An integer that represents the offset of the start of the line
+
+    Returns:
+        bytes: The timestamp as bytes in the format YYYY-MM-DD HH:MM:SS.mmm, or None if the line does not start with one
+    '''
+    match = time_regex.match(view, start, start + 28)
+    return match.group(1) if match else None
+
+
+def find_offset(view, time: bytes, low: int = 0, high: int = None):
+    '''
+    find_offset is a function that returns the offset of the first line whose timestamp is at or after a time.
+
+    Lines without a timestamp belong to the timestamped line before them, so they are skipped over during the search and never
+    returned as the first line.
+
+    Parameters:
+        view: A mmap object (or bytes) that represents the file
+        time: Bytes that represent the time (or a prefix of it) in the format YYYY-MM-DD HH:MM:SS.mmm
+        low: An integer that represents the offset of a line start where the search begins
+        high: An integer that represents the offset where the search ends, the size of the file by default
+
+    Returns:
+        int: An integer that represents the offset of the start of the line, the size of the file if every line is before the time
+    '''
+    if high is None:
+        high = len(view)
+    while low < high:
+        middle = (low + high) // 2
+        start = view.rfind(b'\n', low, middle) + 1 or low
+        line = start
+        stamp = None
+        while line < high:
+            stamp = line_time(view, line)
+            if stamp is not None:
+                break
+            line = view.find(b'\n', line, high) + 1 or high
+        if stamp is None:
+            high = start
+        elif stamp >= time:
+            high = line
+        else:
+            low = view.find(b'\n', line, high) + 1 or high
+    # Skip the lines without a timestamp left at the start, they belong to a line before the time
+    end = len(view)
+    while low < end and line_time(view, low) is None:
+        low = view.find(b'\n', low) + 1 or end
+    return low
+
+
+def search_file(path: str, start: str = None, end: str = None, matcher=None):
+    '''
+    search_file is a function that yields the lines of a log file written between two times.
+
+    Plain files are memory-mapped and the start of the range is found with find_offset, compressed files are read with search_stream.
+
+    Parameters:
+        path: A string that represents the path of the log file
+        start: A string that represents the earliest time (inclusive), or None to start at the beginning of the file
+        end: A string that represents the latest time (exclusive), or None to read to the end of the file
+        matcher: An optional callable that takes a line and returns whether it should be yielded
+
+    Returns:
+        generator: A generator that yields the matching lines as strings
+    '''
+    if is_compressed(path):
+        yield from search_stream(path, start, end, matcher)
+        return
+    with map_file(path) as view:
+        if view is None:
+            return
+        size = len(view)
+        position = find_offset(view, start.encode()) if start is not None else 0
+        end = end.encode() if end is not None else None
+        while position < size:
+            next_position = view.find(b'\n', position) + 1 or size
+            if end is not None:
+                stamp = line_time(view, position)
+                if stamp is not None and stamp >= end:
+                    return
+            line = view[position:next_position].decode('utf-8', errors='replace').strip()
+            if matcher is None or matcher(line):
+                yield line
+            position = next_position
+
+
+def search_stream(path: str, start: str = None, end: str = None, matcher=None):
+    '''
+    search_stream is a function that yields the lines of a compressed log file written between two times.
+
+    The file is decompressed as a stream: lines before the start of the range are skipped (with the lines without a timestamp that
+    follow them) and reading stops at the first line at or after the end of the range.
+
+    Parameters:
+        path: A string that represents the path of the compressed log file
+        start: A string that represents the earliest time (inclusive), or None to start at the beginning of the file
+        end: A string that represents the latest time (exclusive), or None to read to the end of the file
+        matcher: An optional callable that takes a line and returns whether it should be yielded
+
+    Returns:
+        generator: A generator that yields the matching lines as strings
+
+    Exceptions:
+        OSError: An exception that is raised when the file cannot be decompressed
+    '''
+    start = start.encode() if start is not None else None
+    end = end.encode() if end is not None else None
+    started = start is None
+    with open_source(path) as f:
+        for raw in f:
+            stamp = line_time(raw, 0)
+            if not started:
+                if stamp is None or stamp < start:
+                    continue
+                started = True
+            if end is not None and stamp is not None and stamp >= end:
+                return
+            line = raw.decode('utf-8', errors='replace').strip()
+            if matcher is None or matcher(line):
+                yield line
+
+
+def compile_filter(pattern: str = None, terms: list = None):
+    '''
+    compile_filter is a function that builds a line matcher from a regular expression and/or a list of terms.
+
+    Parameters:
+        pattern: A string that represents a regular expression that has to be found in the line
+        terms: A list of strings that all have to be in the line
+
+    Returns:
+        callable: A callable that takes a line and returns whether it matches, or None if there is nothing to match
+
+    Exceptions:
+        re.error: An exception that is raised when the pattern is not a valid regular expression
+    '''
+    regex = re.compile(pattern) if pattern else None
+    terms = [term for term in terms or [] if term]
+    if regex is None and not terms:
+        return None
+    def matcher(line: str):
+        if regex is not None and regex.search(line) is None:
+            return False
+        return all(term in line for term in terms)
+    return matcher
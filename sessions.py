@@ -0,0 +1,309 @@
+import json
+import time
+from collections import deque
+from stats import event_seconds
+from metrics import SESSIONS
+
+'''
+sessions is a module that pairs the header and the end of each transmission into a session on the server.
+
+The dashboard used to guess whether the hotspot was on the air from the type of the last event it received, with a ten minute timeout in
+case the end was never logged, and nothing knew how long a call lasted. SessionTracker follows the header and end events of the
+MMDVMHost log and keeps one open session per mode and DMR slot, like the transmissions in progress of recent.py. A session is closed by:
+    end: The end of the transmission (end of transmission, transmission lost or network watchdog expired)
+    replaced: A header of another station on the same mode and slot, the end of the previous transmission was not logged
+    timeout: No end after session_timeout seconds (300 by default, longer than the 180 second timeout of MMDVMHost), measured against the
+        timestamp of the header so a session seeded from the log when the API starts is closed at once if it is that old
+
+Its duration is the one MMDVMHost logged with the end, or the time between the header and the end otherwise, and the BER and packet loss
+are the ones logged with the end. A timed out session has no end, duration, BER or loss.
+
+Each time a session starts or ends a state change is published to the subscribers, clients of /watch?sessions=true receive it as an SSE
+event named sessions:
+    {"type": "tx_start", "session": {"id": 12, "mode": "DMR", "slot": 2, "source": "network", "callsign": "K3JLP", "start": "...", ...}}
+    {"type": "tx_end", "session": {"id": 12, ..., "end": "...", "duration": 4.6, "ber": 0.0, "loss": 0.0, "reason": "end"}}
+A new client is sent the open sessions and the last ended ones as a snapshot first ({"log": "sessions", "active": [...], "recent": [...]}),
+and a client that reconnects with the cursor of the last state change it received is sent the ones it missed, or a snapshot when
+they are no longer all kept.
+
+Classes:
+    Session: A transmission, from its header to its end
+    SessionRecord: A state change as it is queued for the clients
+    SessionTracker: The open and recent sessions of a log and their subscribers
+'''
+
+
+class Session:
+    __slots__ = ('id', 'mode', 'slot', 'source', 'callsign', 'destination', 'name', 'start', 'started', 'end', 'duration', 'ber', 'loss',
+                 'reason')
+
+    def __init__(self, id: int, event):
+        '''
+        Session constructor.
+
+        Parameters:
+            id: An integer that identifies the session
+            event: The LogEvent object of the header (or of the end when the header was not seen)
+
+        Variables:
+            started: A float that represents the timestamp of the header in seconds, None if it is unknown
+            end: A string that represents the timestamp of the end, None while the session is open or when it timed out
+            reason: A string that represents why the session ended (end, replaced or timeout), None while it is open
+
+        Returns:
+            None
+        '''
+        self.id = id
+        self.mode = event.mode
+        self.slot = event.slot
+        self.source = event.source
+        self.callsign = event.callsign
+        self.destination = event.destination
+        self.name = event.name
+        self.start = event.time
+        self.started = event_seconds(event.time)
+        self.end = None
+        self.duration = None
+        self.ber = None
+        self.loss = None
+        self.reason = None
+
+    def to_dict(self):
+        '''
+        to_dict is a method that returns the session as a dictionary without the fields that are not set.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary that represents the session
+        '''
+        return {key: getattr(self, key) for key in self.__slots__ if key != 'started' and getattr(self, key) is not None}
+
+
+class SessionRecord:
+    __slots__ = ('log', 'id', 'sequence', 'line')
+
+    def __init__(self, type: str, session: Session, epoch: int, sequence: int):
+        '''
+        SessionRecord constructor.
+
+        A SessionRecord is queued for the clients along with the TailRecord objects of the logs, log is the SSE event name of the state
+        changes and line is their JSON, sent by the raw and event streams alike.
+
+        Parameters:
+            type: A string that represents the state change (tx_start or tx_end)
+            session: The Session object that started or ended
+            epoch: An integer that identifies the run of the tracker in the cursors
+            sequence: An integer that represents the position of the state change
+
+        Returns:
+            None
+        '''
+        self.log = 'sessions'
+        self.id = f'{epoch}:{sequence}'
+        self.sequence = sequence
+        self.line = json.dumps({'type': type, 'session': session.to_dict()}, separators=(',', ':'))
+
+    @property
+    def event_json(self):
+        '''
+        event_json is a property that returns the state change as JSON, like TailRecord.event_json.
+        '''
+        return self.line
+
+
+class SessionTracker:
+    def __init__(self, log: str, timeout: float = 300, size: int = 50):
+        '''
+        SessionTracker constructor.
+
+        Parameters:
+            log: A string that represents the log file prefix the events are read from
+            timeout: A float that represents the number of seconds after its header a session without an end is closed
+            size: An integer that represents the number of ended sessions and of state changes kept for new and reconnecting clients
+
+        Variables:
+            active: A dictionary that maps the mode and DMR slot of each open session to its Session
+            recent: A deque object of the last ended Session objects, oldest first
+            records: A deque object of the last SessionRecord objects published, replayed to reconnecting clients
+            subscribers: A set of the SubscriberQueue objects of the clients
+            epoch: An integer that identifies this run in the cursors, a cursor of a previous run gets a snapshot
+            sequence: An integer that represents the number of state changes published
+            count: An integer that represents the number of sessions started, the id of the last one
+
+        Returns:
+            None
+        '''
+        self.log = log
+        self.timeout = timeout
+        self.active = {}
+        self.recent = deque(maxlen=size)
+        self.records = deque(maxlen=size * 2)
+        self.subscribers = set()
+        self.epoch = int(time.time())
+        self.sequence = 0
+        self.count = 0
+
+    def add(self, event, publish: bool = True):
+        '''
+        add is a method that opens or closes the session of the mode and slot of a header or end event.
+
+        A header of the station of the open session (e.g. a late entry header) continues it, a header of another station closes it as replaced.
+        An end without an open session (the header was written before the API started reading the log) is published as a session without
+        a start, with the duration logged with the end.
+
+        Parameters:
+            event: A LogEvent object, events that are not a header or an end are skipped
+            publish: A boolean that represents whether the state changes are published, False while the tracker is seeded from past events
+
+        Returns:
+            None
+        '''
+        key = (event.mode, event.slot)
+        session = self.active.get(key)
+        if event.type == 'header':
+            if session is not None:
+                if session.callsign == event.callsign and session.destination == event.destination:
+                    return
+                self.finish(session, 'replaced', event.time, publish)
+            self.count += 1
+            session = self.active[key] = Session(self.count, event)
+            if publish:
+                self.publish('tx_start', session)
+        elif event.type == 'end':
+            if session is None:
+                if not event.callsign:
+                    # A watchdog after the end of the transmission was already logged
+                    return
+                self.count += 1
+                session = Session(self.count, event)
+                session.start = None
+                session.started = None
+            session.ber = event.ber
+            session.loss = event.loss
+            session.duration = event.duration
+            self.finish(session, 'end', event.time, publish)
+
+    def finish(self, session: Session, reason: str, end: str = None, publish: bool = True):
+        '''
+        finish is a method that closes a session and publishes its end.
+
+        Parameters:
+            session: The Session object to close
+            reason: A string that represents why the session ended (end, replaced or timeout)
+            end: A string that represents the timestamp of the end, None if it is unknown
+            publish: A boolean that represents whether the end is published
+
+        Returns:
+            None
+        '''
+        if self.active.get((session.mode, session.slot)) is session:
+            del self.active[(session.mode, session.slot)]
+        session.end = end
+        session.reason = reason
+        if session.duration is None and end is not None and session.started is not None:
+            seconds = event_seconds(end)
+            if seconds is not None:
+                session.duration = round(max(0, seconds - session.started), 1)
+        self.recent.append(session)
+        SESSIONS.labels(self.log, reason).inc()
+        if publish:
+            self.publish('tx_end', session)
+
+    def expire(self, now: float = None):
+        '''
+        expire is a method that closes the sessions whose header is older than timeout seconds.
+
+        Parameters:
+            now: A float that represents the current time in seconds since the epoch, time.time() by default
+
+        Returns:
+            None
+        '''
+        now = time.time() if now is None else now
+        for session in list(self.active.values()):
+            if session.started is None or now - session.started >= self.timeout:
+                self.finish(session, 'timeout')
+
+    def next_expiry(self, now: float = None):
+        '''
+        next_expiry is a method that returns the number of seconds until the next open session times out.
+
+        Parameters:
+            now: A float that represents the current time in seconds since the epoch, time.time() by default
+
+        Returns:
+            float: The number of seconds until the oldest open session times out, None when no session is open
+        '''
+        if not self.active:
+            return None
+        now = time.time() if now is None else now
+        started = min(session.started or 0 for session in self.active.values())
+        return max(0, started + self.timeout - now)
+
+    def publish(self, type: str, session: Session):
+        '''
+        publish is a method that offers a state change to every client.
+
+        Parameters:
+            type: A string that represents the state change (tx_start or tx_end)
+            session: The Session object that started or ended
+
+        Returns:
+            None
+        '''
+        self.sequence += 1
+        record = SessionRecord(type, session, self.epoch, self.sequence)
+        self.records.append(record)
+        for queue in self.subscribers:
+            queue.offer(record)
+
+    def subscribe(self, cursor: str = None, queue=None):
+        '''
+        subscribe is a method that registers a client of the state changes.
+
+        Parameters:
+            cursor: A string that represents the cursor of the last state change the client received, or None for a new client
+            queue: The SubscriberQueue object the state changes are offered to
+
+        Variables:
+            oldest: An integer that represents the oldest cursor the kept state changes can resume from, a client that missed state
+                changes that are no longer kept gets a snapshot instead of a partial backlog
+
+        Returns:
+            tuple: A tuple of (queue, backlog, snapshot) where backlog is a list of the SessionRecord objects published after the cursor
+                and snapshot is a string that represents the open and recent sessions as JSON, None with a cursor this run can resume from
+        '''
+        self.subscribers.add(queue)
+        epoch, _, sequence = (cursor or '').partition(':')
+        oldest = self.records[0].sequence - 1 if self.records else self.sequence
+        if epoch == str(self.epoch) and sequence.isdigit() and oldest <= int(sequence) <= self.sequence:
+            return queue, [record for record in self.records if record.sequence > int(sequence)], None
+        return queue, [], json.dumps(dict(self.summary(), log='sessions', id=self.records[-1].id if self.records else None),
+                                     separators=(',', ':'))
+
+    def unsubscribe(self, queue):
+        '''
+        unsubscribe is a method that removes a client of the state changes.
+
+        Parameters:
+            queue: The SubscriberQueue object passed to subscribe
+
+        Returns:
+            None
+        '''
+        self.subscribers.discard(queue)
+
+    def summary(self):
+        '''
+        summary is a method that returns the open sessions and the last ended ones.
+
+        Parameters:
+            None
+
+        Returns:
+            dict: A dictionary with the open sessions under active and the ended ones under recent, most recent first
+        '''
+        return {'active': [session.to_dict() for session in self.active.values()],
+                'recent': [session.to_dict() for session in reversed(self.recent)]}
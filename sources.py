@@ -0,0 +1,144 @@
+import io
+import gzip
+import mmap
+import contextlib
+from collections import deque
+
+try:
+    # Python 3.14 ships zstd in the standard library, older versions need the zstandard package
+    from compression import zstd as _zstd
+    _zstandard = None
+except ImportError:
+    _zstd = None
+    try:
+        import zstandard as _zstandard
+    except ImportError:
+        _zstandard = None
+
+'''
+sources is a module that opens the plain and compressed files of a log the same way.
+
+Rotated Pi-Star logs can be compressed with gzip (or zstd) to save space and wear on the SD card, so the files that match a log prefix
+are a mix of plain files (MMDVM-2024-04-04.log) and compressed ones (MMDVM-2024-03-01.log.gz). Compressed files are decompressed as a
+stream, a few kilobytes at a time, and are never written back to disk or loaded whole in memory. Plain files are memory-mapped so the
+tail and search paths slice them without copying, and only the lines that are returned are decoded.
+
+zstd files are only read when the compression.zstd module (Python 3.14+) or the zstandard package is available.
+
+Constants:
+    COMPRESSED_SUFFIXES: A tuple of strings that represent the suffixes of the compressed files
+
+Functions:
+    is_compressed: A function that returns whether a file is compressed from its name
+    open_source: A function that opens a plain or compressed file for reading bytes
+    map_file: A context manager that memory-maps a plain file
+    read_lines: A function that yields the decoded lines of a plain or compressed file
+    tail_stream: A function that returns the last lines of a compressed file
+
+Exceptions:
+    OSError: An exception that is raised when a file cannot be read, or it is a zstd file and no zstd module is available
+'''
+
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+
+def is_compressed(path: str):
+    '''
+    is_compressed is a function that returns whether a file is compressed from its name.
+
+    Parameters:
+        path: A string that represents the path of the file
+
+    Returns:
+        bool: True if the file is compressed with gzip or zstd, otherwise False
+    '''
+    return path.endswith(COMPRESSED_SUFFIXES)
+
+
+def open_source(path: str):
+    '''
+    open_source is a function that opens a plain or compressed file for reading bytes.
+
+    Compressed files are wrapped in a decompressing reader, so reading them returns the plain bytes of the log.
+
+    Parameters:
+        path: A string that represents the path of the file
+
+    Returns:
+        file: A binary file object that reads the plain bytes of the file
+
+    Exceptions:
+        OSError: An exception that is raised when the file cannot be opened, or it is a zstd file and no zstd module is available
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if _zstd is not None:
+            return _zstd.open(path, 'rb')
+        if _zstandard is not None:
+            return io.BufferedReader(_zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+        raise OSError('The zstandard package is needed to read zstd files')
+    return open(path, 'rb')
+
+
+@contextlib.contextmanager
+def map_file(path: str):
+    '''
+    map_file is a context manager that memory-maps a plain file for reading.
+
+    Parameters:
+        path: A string that represents the path of the file
+
+    Returns:
+        mmap: A mmap object of the whole file, or None if the file is empty or cannot be memory-mapped (e.g. it is not a regular file)
+    '''
+    with open(path, 'rb') as f:
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and special files cannot be memory-mapped
+            yield None
+            return
+        with view:
+            yield view
+
+
+def read_lines(path: str):
+    '''
+    read_lines is a function that yields the lines of a plain or compressed file, decoded and stripped.
+
+    Parameters:
+        path: A string that represents the path of the file
+
+    Returns:
+        generator: A generator that yields the lines as strings, oldest first
+
+    Exceptions:
+        OSError: An exception that is raised when the file cannot be read
+    '''
+    with open_source(path) as f:
+        for line in f:
+            yield line.decode('utf-8', errors='replace').strip()
+
+
+def tail_stream(path: str, lines: int):
+    '''
+    tail_stream is a function that returns the last lines of a compressed file.
+
+    A compressed file cannot be read backwards, so it is decompressed as a stream and only the last lines are kept.
+
+    Parameters:
+        path: A string that represents the path of the file
+        lines: An integer that represents the number of lines to return
+
+    Returns:
+        list: A list of strings that represent the last lines of the file, oldest first
+
+    Exceptions:
+        OSError: An exception that is raised when the file cannot be read
+    '''
+    if lines <= 0:
+        return []
+    with open_source(path) as f:
+        last_lines = deque(f, maxlen=lines)
+    return [line.rstrip(b'\r\n').decode('utf-8', errors='replace') for line in last_lines]
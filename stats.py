@@ -0,0 +1,459 @@
+import calendar
+import json
+import os
+import threading
+import time
+from tailer import parse_cursor
+
+'''
+stats is a module that keeps rolling statistics of the activity of the hotspot, updated as each event is parsed.
+
+Questions like "top callsigns today", calls per hour, RF against network and total airtime used to need a script over the whole MMDVMHost
+log. ActivityStats counts every header and end event into fixed-size time buckets (minutes, hours and days) as the API ingests the log,
+so adding an event costs the same whatever the traffic and a query only merges a few dozen buckets. Each resolution is a ring of
+buckets indexed by the bucket number modulo the size of the ring: a bucket is reused for a newer period once it falls out of the window,
+so the memory used is fixed.
+
+The buckets and the cursor of the last line counted are written to a JSON checkpoint every stats_checkpoint_interval seconds and when
+the API stops. After a restart the statistics are loaded from the checkpoint and only the lines written since its cursor are read
+(see catch_up). Without a checkpoint, the plain log files modified during the day window are read once.
+
+Classes:
+    StatsBucket: The counters of one period
+    BucketRing: A fixed number of buckets of the same period length
+    ActivityStats: The rolling statistics of a log
+
+Functions:
+    parse_time: A function that converts a log timestamp to seconds since the epoch
+    event_seconds: A function that converts a log timestamp to seconds since the epoch, with its milliseconds
+    format_time: A function that formats seconds since the epoch as a log timestamp without seconds
+'''
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+# Midnight (UTC) of the dates seen, log timestamps are only split and added to it
+midnights = {}
+
+
+def parse_time(text: str):
+    '''
+    parse_time is a function that converts a log timestamp to seconds since the epoch, without parsing the whole string each time.
+
+    Parameters:
+        text: A string that represents a timestamp in the format YYYY-MM-DD HH:MM:SS.mmm (UTC)
+
+    Returns:
+        int: The number of seconds since the epoch, or None if the timestamp is malformed
+    '''
+    try:
+        midnight = midnights.get(text[:10])
+        if midnight is None:
+            midnight = midnights[text[:10]] = calendar.timegm(time.strptime(text[:10], '%Y-%m-%d'))
+            if len(midnights) > 64:
+                midnights.clear()
+        return midnight + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+    except (ValueError, TypeError):
+        return None
+
+
+def event_seconds(text: str):
+    '''
+    event_seconds is a function that converts a log timestamp to seconds since the epoch, with its milliseconds.
+
+    Parameters:
+        text: A string that represents a timestamp in the format YYYY-MM-DD HH:MM:SS.mmm (UTC)
+
+    Returns:
+        float: The number of seconds since the epoch, or None if the timestamp is malformed
+    '''
+    seconds = parse_time(text)
+    if seconds is None:
+        return None
+    try:
+        return seconds + int(text[20:23]) / 1000
+    except ValueError:
+        return float(seconds)
+
+
+def format_time(seconds: int):
+    '''
+    format_time is a function that formats seconds since the epoch as the start of a bucket.
+
+    Parameters:
+        seconds: An integer that represents the number of seconds since the epoch
+
+    Returns:
+        str: A string in the format YYYY-MM-DD HH:MM (UTC)
+    '''
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(seconds))
+
+
+class StatsBucket:
+    __slots__ = ('key', 'calls', 'rf', 'network', 'airtime', 'callsigns', 'modes')
+
+    def __init__(self, key: int):
+        '''
+        StatsBucket constructor.
+
+        Parameters:
+            key: An integer that represents the number of the period (its start divided by its length)
+
+        Variables:
+            calls: An integer that represents the number of transmissions (header events)
+            rf: An integer that represents the number of transmissions received over RF
+            network: An integer that represents the number of transmissions received from the network
+            airtime: A float that represents the total length of the transmissions in seconds (from the end events)
+            callsigns: A dictionary that maps each callsign to its number of transmissions
+            modes: A dictionary that maps each mode to its number of transmissions
+
+        Returns:
+            None
+        '''
+        self.key = key
+        self.calls = 0
+        self.rf = 0
+        self.network = 0
+        self.airtime = 0.0
+        self.callsigns = {}
+        self.modes = {}
+
+    def add(self, event):
+        '''
+        add is a method that counts an event.
+
+        Parameters:
+            event: A LogEvent object of type header or end
+
+        Returns:
+            None
+        '''
+        if event.type == 'header':
+            self.calls += 1
+            if event.source == 'RF':
+                self.rf += 1
+            elif event.source == 'network':
+                self.network += 1
+            if event.callsign:
+                self.callsigns[event.callsign] = self.callsigns.get(event.callsign, 0) + 1
+            if event.mode:
+                self.modes[event.mode] = self.modes.get(event.mode, 0) + 1
+        elif event.duration is not None:
+            self.airtime += event.duration
+
+    def merge(self, other):
+        '''
+        merge is a method that adds the counters of another bucket to this one.
+
+        Parameters:
+            other: A StatsBucket object
+
+        Returns:
+            None
+        '''
+        self.calls += other.calls
+        self.rf += other.rf
+        self.network += other.network
+        self.airtime += other.airtime
+        for callsign, calls in other.callsigns.items():
+            self.callsigns[callsign] = self.callsigns.get(callsign, 0) + calls
+        for mode, calls in other.modes.items():
+            self.modes[mode] = self.modes.get(mode, 0) + calls
+
+    def summary(self, top: int = 0):
+        '''
+        summary is a method that returns the counters of the bucket for the /stats route.
+
+        Parameters:
+            top: An integer that represents the number of top callsigns to return, 0 for none
+
+        Returns:
+            dict: A dictionary with the calls, the RF and network calls, the airtime, the number of callsigns, the modes and the top callsigns
+        '''
+        summary = {'calls': self.calls, 'rf': self.rf, 'network': self.network, 'airtime': round(self.airtime, 1),
+                   'callsigns': len(self.callsigns), 'modes': self.modes}
+        if top:
+            ranked = sorted(self.callsigns.items(), key=lambda item: (-item[1], item[0]))[:top]
+            summary['top_callsigns'] = [{'callsign': callsign, 'calls': calls} for callsign, calls in ranked]
+        return summary
+
+    def to_dict(self):
+        '''
+        to_dict is a method that returns the bucket as a dictionary for the checkpoint.
+
+        Returns:
+            dict: A dictionary with every counter of the bucket
+        '''
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        '''
+        from_dict is a method that builds a bucket from a dictionary of the checkpoint.
+
+        Parameters:
+            data: A dictionary returned by to_dict
+
+        Returns:
+            StatsBucket: The bucket
+        '''
+        bucket = cls(int(data['key']))
+        for key in cls.__slots__[1:]:
+            setattr(bucket, key, data[key])
+        return bucket
+
+
+class BucketRing:
+    def __init__(self, length: int, count: int):
+        '''
+        BucketRing constructor.
+
+        Parameters:
+            length: An integer that represents the length of the period of a bucket in seconds
+            count: An integer that represents the number of buckets kept
+
+        Returns:
+            None
+        '''
+        self.length = length
+        self.count = count
+        self.buckets = [None] * count
+
+    def bucket(self, seconds: int):
+        '''
+        bucket is a method that returns the bucket of a time, replacing the bucket of an older period in its slot.
+
+        Parameters:
+            seconds: An integer that represents the number of seconds since the epoch
+
+        Returns:
+            StatsBucket: The bucket of the period, or None if the period is older than the ring
+        '''
+        key = seconds // self.length
+        index = key % self.count
+        bucket = self.buckets[index]
+        if bucket is None or bucket.key < key:
+            bucket = self.buckets[index] = StatsBucket(key)
+        elif bucket.key > key:
+            return None
+        return bucket
+
+    def recent(self, seconds: int, count: int = None):
+        '''
+        recent is a method that returns the buckets of the last periods up to a time, oldest first, with empty buckets for quiet periods.
+
+        Parameters:
+            seconds: An integer that represents the number of seconds since the epoch of the last period
+            count: An integer that represents the number of periods, the size of the ring by default
+
+        Returns:
+            list: A list of StatsBucket objects
+        '''
+        last = seconds // self.length
+        buckets = []
+        for key in range(last - min(count or self.count, self.count) + 1, last + 1):
+            bucket = self.buckets[key % self.count]
+            buckets.append(bucket if bucket is not None and bucket.key == key else StatsBucket(key))
+        return buckets
+
+    def to_list(self):
+        '''
+        to_list is a method that returns the buckets in use as a list of dictionaries for the checkpoint.
+
+        Returns:
+            list: A list of dictionaries
+        '''
+        return [bucket.to_dict() for bucket in self.buckets if bucket is not None]
+
+    def load(self, buckets: list):
+        '''
+        load is a method that puts the buckets of a checkpoint back in the ring.
+
+        Parameters:
+            buckets: A list of dictionaries returned by to_list
+
+        Returns:
+            None
+        '''
+        for data in buckets:
+            bucket = StatsBucket.from_dict(data)
+            current = self.buckets[bucket.key % self.count]
+            if current is None or current.key < bucket.key:
+                self.buckets[bucket.key % self.count] = bucket
+
+
+class ActivityStats:
+    def __init__(self, path: str = None, days: int = 7):
+        '''
+        ActivityStats constructor.
+
+        Parameters:
+            path: A string that represents the path of the JSON checkpoint, None to never write one
+            days: An integer that represents the number of days kept
+
+        Variables:
+            minutes: A BucketRing object of the minutes of the last hour
+            hours: A BucketRing object of the hours of the last two days
+            days: A BucketRing object of the days of the window
+            cursor: A string that represents the cursor of the last line counted
+            last_time: A string that represents the timestamp of the last event counted
+            lock: A threading.Lock object, the statistics are rebuilt in a thread while the API may read them
+
+        Returns:
+            None
+        '''
+        self.path = path
+        self.minutes = BucketRing(MINUTE, 60)
+        self.hours = BucketRing(HOUR, 48)
+        self.days = BucketRing(DAY, max(1, int(days)))
+        self.cursor = None
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def add(self, event, cursor: str = None):
+        '''
+        add is a method that counts an event in its minute, hour and day buckets.
+
+        Parameters:
+            event: A LogEvent object, events other than header and end (and lines that are not events) are ignored
+            cursor: A string that represents the cursor of the line of the event
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            if cursor is not None:
+                self.cursor = cursor
+            if event is None or event.type not in ('header', 'end'):
+                return
+            seconds = parse_time(event.time)
+            if seconds is None:
+                return
+            self.last_time = event.time
+            for ring in (self.minutes, self.hours, self.days):
+                bucket = ring.bucket(seconds)
+                if bucket is not None:
+                    bucket.add(event)
+
+    def catch_up(self, tailer, published: tuple):
+        '''
+        catch_up is a method that counts the lines written since the cursor of the checkpoint, up to a published cursor of the tailer.
+
+        It runs in a thread and reads the lines as a stream (see LogTailer.read_from), so the memory used does not depend on the number
+        of lines. When the file of the cursor is gone (or there is no checkpoint), the plain log files modified during the day window are
+        read instead, skipping the events the checkpoint already counted.
+
+        Parameters:
+            tailer: The LogTailer object of the log
+            published: A tuple (path, inode, position) that represents the cursor to stop at
+
+        Variables:
+            records: A generator of the TailRecord objects to count
+            since: A string that represents the timestamp of the last event of the checkpoint, older events are skipped
+
+        Returns:
+            str: A string that represents the cursor of the last line counted, to subscribe from
+        '''
+        position = parse_cursor(self.cursor)
+        records = tailer.read_from(*position, published) if position is not None else None
+        since = None
+        if records is None:
+            since = self.last_time
+            window = time.time() - self.days.count * DAY
+            for path in tailer.files():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime >= window:
+                    records = tailer.read_from(stat.st_ino, 0, published)
+                    break
+        for record in records or ():
+            event = record.event
+            if since is not None and event is not None and event.time <= since:
+                continue
+            self.add(event, record.id)
+        return f'{published[1]}:{published[2]}'
+
+    def summary(self, now: float = None, top: int = 10, hours: int = 24):
+        '''
+        summary is a method that returns the statistics for the /stats route.
+
+        Parameters:
+            now: A float that represents the current time in seconds since the epoch, time.time() by default
+            top: An integer that represents the number of top callsigns to return
+            hours: An integer that represents the number of hours to return calls per hour for (at most 48)
+
+        Variables:
+            last_hour: A StatsBucket object that merges the minute buckets of the last hour
+            last_day: A StatsBucket object that merges the hour buckets of the last 24 hours
+
+        Returns:
+            dict: A dictionary with today, the last hour, the last 24 hours, the calls per hour and the calls per day
+        '''
+        now = int(now if now is not None else time.time())
+        with self.lock:
+            last_hour = StatsBucket(0)
+            for bucket in self.minutes.recent(now):
+                last_hour.merge(bucket)
+            last_day = StatsBucket(0)
+            for bucket in self.hours.recent(now, 24):
+                last_day.merge(bucket)
+            return {
+                'today': dict(self.days.recent(now, 1)[0].summary(top), start=format_time(now // DAY * DAY)),
+                'last_hour': last_hour.summary(top),
+                'last_24_hours': last_day.summary(top),
+                'hours': [dict(bucket.summary(), start=format_time(bucket.key * HOUR)) for bucket in self.hours.recent(now, hours)],
+                'days': [dict(bucket.summary(top), start=format_time(bucket.key * DAY)) for bucket in self.days.recent(now)],
+                'last_event': self.last_time,
+                'cursor': self.cursor,
+            }
+
+    def save(self):
+        '''
+        save is a method that writes the checkpoint, to a temporary file that then replaces the previous checkpoint.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+
+        Exceptions:
+            OSError: An exception that is raised when the checkpoint cannot be written
+        '''
+        if self.path is None:
+            return
+        with self.lock:
+            data = {'cursor': self.cursor, 'last_time': self.last_time, 'minutes': self.minutes.to_list(), 'hours': self.hours.to_list(),
+                    'days': self.days.to_list()}
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temporary, self.path)
+
+    def load(self):
+        '''
+        load is a method that reads the checkpoint, if there is one.
+
+        Parameters:
+            None
+
+        Returns:
+            bool: True if a checkpoint was loaded
+        '''
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            with self.lock:
+                self.minutes.load(data['minutes'])
+                self.hours.load(data['hours'])
+                self.days.load(data['days'])
+                self.cursor = data['cursor']
+                self.last_time = data['last_time']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f'Ignoring the statistics checkpoint {self.path}: {e}')
+            return False
+        return True
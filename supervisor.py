@@ -0,0 +1,490 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+'''
+supervisor is a module that runs the processes of the Pi-Star CallerID application and keeps them running.
+
+launcher.py used to start the processes with "nohup ... &" and find their PIDs afterwards with pgrep -f, which can match the wrong
+process (an editor with api.py open, a second checkout), killed the API with kill -9, and ran git fetch before every start, so an
+offline hotspot waited for the network timeout before the dashboard came up.
+
+A Supervisor starts every Service as its own child with subprocess.Popen, so it knows the real PIDs, and then watches them:
+    1. A child that exits is started again after a backoff that doubles on every restart in a row (1, 2, 4 ... supervisor_backoff_max
+       seconds) and is reset once the child stays up for supervisor_stable_after seconds, so a crashing service does not spin the CPU.
+    2. Every supervisor_health_interval seconds each child is sent an HTTP request. A child that does not answer
+       supervisor_health_failures times in a row is stopped and started again. A child is given supervisor_start_grace seconds to answer
+       the first time (importing FastAPI on a Pi Zero takes a while).
+    3. Children are stopped with SIGTERM, and only killed with SIGKILL if they have not exited after supervisor_stop_timeout seconds
+       (uvicorn waits for the open SSE connections to close).
+    4. SIGTERM and SIGINT stop the children and the supervisor, SIGHUP restarts the children (launcher.py -r).
+
+The PIDs are written to the pid file ("Supervisor PID: 123", "API PID: 124", ...) and the state of every child (PID, health, restarts)
+to a JSON file next to it every time it changes, launcher.py --status reads both.
+
+Checking for updates (git fetch) runs in a background thread, update_check_delay seconds after the start and then at most once every
+update_check_interval seconds across restarts (the time of the last check is kept in the state directory), so the dashboard comes up
+without waiting for the network and an offline hotspot does not retry on every start.
+
+The supervisor settings are read from config.json, every one of them is optional.
+
+Classes:
+    Service: A class that represents one child process and its health check
+    Supervisor: A class that starts, watches and restarts the services
+
+Functions:
+    load_config: A function that reads the supervisor settings from config.json
+    read_pids: A function that reads the pid file
+    is_running: A function that returns whether a process is running
+    read_state: A function that reads the state file written by the supervisor
+'''
+
+DEFAULTS = {
+    'supervisor_health_interval': 10,
+    'supervisor_health_timeout': 2,
+    'supervisor_health_failures': 3,
+    'supervisor_start_grace': 60,
+    'supervisor_backoff_max': 60,
+    'supervisor_stable_after': 60,
+    'supervisor_stop_timeout': 10,
+    'update_check_interval': 21600,
+    'update_check_delay': 60,
+}
+
+
+def load_config(path: str = 'config.json'):
+    '''
+    load_config is a function that reads config.json and fills in the supervisor settings that are not set.
+
+    Parameters:
+        path: A string that represents the path of config.json
+
+    Returns:
+        dict: A dictionary with the values of config.json and the default supervisor settings
+    '''
+    config = dict(DEFAULTS)
+    try:
+        with open(path) as f:
+            config.update(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f'Could not read {path}: {e}, using the default ports and settings.')
+    return config
+
+
+def read_pids(pid_path: str):
+    '''
+    read_pids is a function that reads the pid file, one "<name> PID: <pid>" line per process.
+
+    Parameters:
+        pid_path: A string that represents the path of the pid file
+
+    Returns:
+        list: A list of (name, pid) tuples, the pid is an integer
+
+    Exceptions:
+        FileNotFoundError: An exception that is raised when the pid file does not exist
+    '''
+    with open(pid_path, 'r') as f:
+        processes = [line.strip().split(' PID: ') for line in f if line.strip()]
+    return [(name, int(pid)) for name, pid in processes]
+
+
+def is_running(pid: int):
+    '''
+    is_running is a function that returns whether a process is running, without sending it a signal.
+
+    Parameters:
+        pid: An integer that represents the process ID
+
+    Returns:
+        bool: True if the process exists (and is not a zombie)
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+def read_state(state_path: str):
+    '''
+    read_state is a function that reads the state file written by the supervisor.
+
+    Parameters:
+        state_path: A string that represents the path of the state file
+
+    Returns:
+        dict: A dictionary with the state of the supervisor and its services, or an empty dictionary if there is none
+    '''
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class Service:
+    def __init__(self, name: str, module: str, port: int, health_path: str, log_path: str, cwd: str, python: str = sys.executable):
+        '''
+        Service constructor.
+
+        Parameters:
+            name: A string that represents the name of the service in the pid file (e.g. API, Web or App)
+            module: A string that represents the module to run with python -m (e.g. api.api)
+            port: An integer that represents the port the service listens on
+            health_path: A string that represents the path requested to check that the service answers (e.g. /stream_stats)
+            log_path: A string that represents the file the output of the service is appended to
+            cwd: A string that represents the working directory of the service, where config.json is
+            python: A string that represents the Python interpreter to run the service with
+
+        Variables:
+            process: A Popen object that represents the running child, None when it is not running
+            failures: An integer that represents the number of health checks in a row the service did not answer
+            checked: A float that represents the monotonic time of the last health check
+            healthy: A boolean that represents whether the service answered its last health check, None until it answered once
+            restarts: An integer that represents the number of times the service was started again
+            backoff: An integer that represents the number of restarts in a row, used to compute the delay before the next one
+            restart_at: A float that represents the monotonic time the service is started again at, None when no restart is pending
+
+        Returns:
+            None
+        '''
+        self.name = name
+        self.module = module
+        self.port = port
+        self.health_path = health_path
+        self.log_path = log_path
+        self.cwd = cwd
+        self.python = python
+        self.process = None
+        self.log = None
+        self.started = None
+        self.checked = 0
+        self.failures = 0
+        self.healthy = None
+        self.restarts = 0
+        self.backoff = 0
+        self.restart_at = None
+        self.last_exit = None
+
+    @property
+    def pid(self):
+        '''
+        pid is a property that returns the PID of the running child, or None.
+        '''
+        return self.process.pid if self.process is not None else None
+
+    def start(self):
+        '''
+        start is a method that starts the child with its output appended to the log file.
+
+        The child gets its own session so a Ctrl+C in the terminal of the supervisor is handled by the supervisor only.
+
+        Returns:
+            None
+        '''
+        self.log = open(self.log_path, 'ab')
+        self.process = subprocess.Popen([self.python, '-m', self.module], cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=self.log,
+                                        stderr=subprocess.STDOUT, start_new_session=True)
+        self.started = time.monotonic()
+        self.checked = 0
+        self.failures = 0
+        self.healthy = None
+        self.restart_at = None
+        print(f'Started {self.name} ({self.module}) with PID {self.process.pid}')
+
+    def exited(self):
+        '''
+        exited is a method that returns the exit code of the child if it exited since the last call.
+
+        Returns:
+            int: The exit code (negative for a signal), or None if the child is running or was not started
+        '''
+        if self.process is None:
+            return None
+        code = self.process.poll()
+        if code is None:
+            return None
+        self.last_exit = code
+        self.process = None
+        self.log.close()
+        return code
+
+    def stop(self, timeout: float = 10):
+        '''
+        stop is a method that stops the child with SIGTERM, and with SIGKILL if it has not exited after timeout seconds.
+
+        Parameters:
+            timeout: A float that represents the number of seconds to wait for the child to exit
+
+        Returns:
+            None
+        '''
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print(f'{self.name} did not exit after {timeout} seconds, killing PID {self.process.pid}')
+            self.process.kill()
+            self.process.wait()
+        self.last_exit = self.process.returncode
+        self.process = None
+        self.log.close()
+
+    def check(self, timeout: float = 2):
+        '''
+        check is a method that sends the health check request to the child.
+
+        Any HTTP response means the server is serving requests, only a connection error or a timeout is a failure.
+
+        Parameters:
+            timeout: A float that represents the number of seconds to wait for the response
+
+        Returns:
+            bool: True if the child answered
+        '''
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.port}{self.health_path}', timeout=timeout):
+                return True
+        except urllib.error.HTTPError:
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def state(self):
+        '''
+        state is a method that returns the state of the service for the state file.
+
+        Returns:
+            dict: A dictionary with the PID, port, health, uptime, restarts and last exit code of the service
+        '''
+        return {'pid': self.pid, 'module': self.module, 'port': self.port, 'health_url': f'http://127.0.0.1:{self.port}{self.health_path}',
+                'healthy': self.healthy, 'uptime': round(time.monotonic() - self.started) if self.process is not None else None,
+                'restarts': self.restarts, 'last_exit': self.last_exit}
+
+
+class Supervisor:
+    def __init__(self, services: list, pid_path: str, state_path: str, config: dict = None, repository: str = None):
+        '''
+        Supervisor constructor.
+
+        Parameters:
+            services: A list of Service objects to run
+            pid_path: A string that represents the path of the pid file
+            state_path: A string that represents the path of the state file
+            config: A dictionary with the supervisor settings, see load_config
+            repository: A string that represents the git checkout to check for updates, None to never check
+
+        Variables:
+            stopping: A threading.Event object that is set when the supervisor has to stop
+            restarting: A boolean that is set by SIGHUP to restart every service
+            update: A dictionary with the result of the last update check (checked, available and error)
+
+        Returns:
+            None
+        '''
+        self.services = services
+        self.pid_path = pid_path
+        self.state_path = state_path
+        self.config = dict(DEFAULTS, **(config or {}))
+        self.repository = repository
+        self.stopping = threading.Event()
+        self.restarting = False
+        self.update = {'checked': None, 'available': None, 'error': None}
+
+    def write_pids(self):
+        '''
+        write_pids is a method that writes the PIDs of the supervisor and of the running services to the pid file.
+
+        The file is replaced at once so launcher.py never reads a half-written file.
+
+        Returns:
+            None
+        '''
+        lines = [f'Supervisor PID: {os.getpid()}'] + [f'{service.name} PID: {service.pid}' for service in self.services
+                                                        if service.pid is not None]
+        with open(f'{self.pid_path}.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f'{self.pid_path}.tmp', self.pid_path)
+
+    def write_state(self):
+        '''
+        write_state is a method that writes the state of the supervisor and of the services to the state file.
+
+        Returns:
+            None
+        '''
+        state = {'pid': os.getpid(), 'time': time.time(), 'update': self.update,
+                 'services': {service.name: service.state() for service in self.services}}
+        with open(f'{self.state_path}.tmp', 'w') as f:
+            json.dump(state, f, indent=4)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
+
+    def schedule_restart(self, service: Service, reason: str):
+        '''
+        schedule_restart is a method that schedules a service to be started again after its backoff.
+
+        Parameters:
+            service: The Service object to restart
+            reason: A string that represents why the service is restarted, for the log
+
+        Returns:
+            None
+        '''
+        if service.started is not None and time.monotonic() - service.started >= self.config['supervisor_stable_after']:
+            service.backoff = 0
+        delay = min(self.config['supervisor_backoff_max'], 2 ** service.backoff)
+        service.backoff += 1
+        service.restart_at = time.monotonic() + delay
+        print(f'{service.name} {reason}, starting it again in {delay} seconds')
+
+    def watch(self):
+        '''
+        watch is a method that checks the services once: restarts the ones that are due, notices the ones that exited and health-checks the others.
+
+        Returns:
+            bool: True if the state of a service changed and the pid and state files have to be written again
+        '''
+        now = time.monotonic()
+        changed = False
+        for service in self.services:
+            if service.restart_at is not None:
+                if now >= service.restart_at:
+                    service.restarts += 1
+                    service.start()
+                    changed = True
+                continue
+            code = service.exited()
+            if code is not None:
+                self.schedule_restart(service, f'exited with code {code}')
+                changed = True
+                continue
+            # A service that is starting is checked every second so it is reported healthy as soon as it answers
+            interval = 1 if service.healthy is None else self.config['supervisor_health_interval']
+            if now - service.checked < interval:
+                continue
+            service.checked = now
+            if service.check(self.config['supervisor_health_timeout']):
+                changed = changed or service.healthy is not True
+                service.healthy = True
+                service.failures = 0
+            elif service.healthy is not None or now - service.started >= self.config['supervisor_start_grace']:
+                # Failures only count once the service answered, or once it had the grace period to start
+                changed = changed or service.healthy is not False
+                service.healthy = False
+                service.failures += 1
+            if service.failures >= self.config['supervisor_health_failures']:
+                service.stop(self.config['supervisor_stop_timeout'])
+                self.schedule_restart(service, f'did not answer {service.failures} health checks')
+                changed = True
+        return changed
+
+    def check_updates(self):
+        '''
+        check_updates is a method that checks for updates with git fetch in the background, at most once every update_check_interval seconds.
+
+        The time of the last check is the modification time of a stamp file next to the state file, so restarting the application
+        does not check again. Only the result is logged, launcher.py -u updates the application.
+
+        Returns:
+            None
+        '''
+        stamp = os.path.join(os.path.dirname(os.path.abspath(self.state_path)), '.update_check')
+        if self.stopping.wait(self.config['update_check_delay']):
+            return
+        while not self.stopping.is_set():
+            try:
+                last = os.path.getmtime(stamp)
+            except OSError:
+                last = 0
+            remaining = last + self.config['update_check_interval'] - time.time()
+            if remaining <= 0:
+                try:
+                    subprocess.run(['git', 'fetch', '--quiet'], cwd=self.repository, check=True, timeout=120, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                    behind = subprocess.check_output(['git', 'rev-list', '--count', 'HEAD..origin/main'], cwd=self.repository, text=True,
+                                                     stderr=subprocess.DEVNULL).strip()
+                    self.update = {'checked': time.time(), 'available': behind != '0', 'error': None}
+                    if behind != '0':
+                        print(f'Update available ({behind} new commits). Please run the launcher with the -u or --update option to update the application.')
+                except (OSError, subprocess.SubprocessError) as e:
+                    self.update = {'checked': time.time(), 'available': None, 'error': str(e)}
+                    print(f'Error checking for updates: {e}')
+                try:
+                    with open(stamp, 'a'):
+                        pass
+                    os.utime(stamp)
+                except OSError:
+                    pass
+                remaining = self.config['update_check_interval']
+            self.stopping.wait(remaining)
+
+    def handle_signal(self, signum: int, frame):
+        '''
+        handle_signal is a method that stops the supervisor on SIGTERM and SIGINT and restarts the services on SIGHUP.
+
+        Parameters:
+            signum: An integer that represents the signal
+            frame: The current stack frame (unused)
+
+        Returns:
+            None
+        '''
+        if signum == signal.SIGHUP:
+            self.restarting = True
+        else:
+            self.stopping.set()
+
+    def run(self):
+        '''
+        run is a method that starts the services and watches them until the supervisor is stopped, then stops them.
+
+        Returns:
+            None
+        '''
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self.handle_signal)
+        for service in self.services:
+            service.start()
+        self.write_pids()
+        self.write_state()
+        if self.repository is not None and self.config['update_check_interval']:
+            threading.Thread(target=self.check_updates, daemon=True).start()
+        try:
+            while not self.stopping.wait(.5):
+                if self.restarting:
+                    self.restarting = False
+                    print('Restarting the services')
+                    for service in self.services:
+                        service.stop(self.config['supervisor_stop_timeout'])
+                        service.backoff = 0
+                        service.start()
+                    changed = True
+                else:
+                    changed = self.watch()
+                if changed:
+                    self.write_pids()
+                    self.write_state()
+        finally:
+            print('Stopping the services')
+            for service in self.services:
+                service.stop(self.config['supervisor_stop_timeout'])
+            for path in (self.pid_path, self.state_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
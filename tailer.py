@@ -0,0 +1,946 @@
+import asyncio
+import os
+import time
+from collections import deque
+from events import parse_line
+from recent import RecentEvents
+from metrics import (BYTES_READ, DROPPED, EVENT_RATE, EVENTS, FANOUT_SECONDS, LINES_PARSED, LINES_READ, PARSE_SECONDS, POLL_SECONDS,
+                     ROTATIONS)
+
+'''
+LogTailer and TailHub provide a single background reader per log file that is shared by every streaming client.
+
+Before the hub existed, every SSE client ran its own loop that re-read the newest log file every interval, so CPU grew with
+clients x file size. A LogTailer owns one open handle to the newest file for a log prefix (MMDVM, YSFGateway, or any log_override),
+reads only the bytes appended since the last poll and fans each complete line out to a bounded asyncio.Queue per subscriber.
+The cost of a poll is the same whether 1 or 200 browsers are connected.
+
+Every line is published as a TailRecord that carries the inode of the file it was read from and the byte offset just past its newline.
+The pair is used as a cursor: it is sent as the SSE event id, and a client that reconnects with it as Last-Event-ID is sent exactly
+the lines written after it, including the rest of the previous file if the log was rotated in the meantime.
+A TailRecord is shared by every subscriber, so when the line is parsed into a LogEvent (see events.py) it is parsed and serialized
+to JSON only once, no matter how many clients receive it.
+
+TailHub keeps one LogTailer per distinct log prefix. A tailer is started when its first client subscribes and stopped once
+the last client goes away, unless it is kept running (see TailHub.keep).
+
+Each tailer feeds the lines it publishes to a RecentEvents ring buffer (see recent.py), seeded from the end of the log when the tailer
+starts, and new clients get its snapshot of the recent events and the state of the log along with their backlog.
+
+The file work of a tailer (listing the log directory, reading the new bytes, reading a backlog to replay) runs in a thread of the
+executor passed to the hub, so a slow SD card delays the lines of that log and never the event loop that serves every client.
+Lines are published on the event loop, and the cursor of the last published line (published) is what subscribe replays up to, so
+the file position can move in a thread while a client subscribes without a line being replayed twice or skipped.
+
+Subscribers can pass a StreamFilter (see filters.py). The subscribers of a tailer are grouped by filter and each distinct filter is
+evaluated once per line, whatever the number of clients that share it.
+
+The poll, fan-out, parse and drop paths update the metrics of metrics.py, served by /metrics.
+
+Classes:
+    TailRecord: A log line with its cursor
+    SubscriberQueue: A bounded queue with a policy for subscribers that fall behind
+    LogTailer: Follows a single log prefix and publishes new lines to its subscribers
+    TailHub: Creates and shares LogTailer objects between clients
+
+Functions:
+    parse_cursor: A function that parses a cursor string back into an inode and an offset
+
+Exceptions:
+    None
+'''
+
+def parse_cursor(cursor: str):
+    '''
+    parse_cursor is a function that parses a cursor string in the form "inode:offset".
+
+    Parameters:
+        cursor: A string that represents the cursor, usually the Last-Event-ID header sent by the browser
+
+    Returns:
+        tuple: A tuple of two integers (inode, offset), or None if the cursor is missing or malformed
+    '''
+    try:
+        inode, offset = cursor.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+class TailRecord:
+    __slots__ = ('line', 'inode', 'offset', 'log', 'parsed', 'parsed_event', 'parsed_json')
+
+    def __init__(self, line: str, inode: int, offset: int, log: str = None):
+        '''
+        TailRecord constructor.
+
+        Parameters:
+            line: A string that represents the log line without its newline
+            inode: An integer that represents the inode of the file the line was read from
+            offset: An integer that represents the byte offset just past the newline of the line
+            log: A string that represents the log prefix the line was read from
+
+        Returns:
+            None
+        '''
+        self.line = line
+        self.inode = inode
+        self.offset = offset
+        self.log = log
+        self.parsed = False
+        self.parsed_event = None
+        self.parsed_json = None
+
+    @property
+    def id(self):
+        '''
+        id is a property that returns the cursor of the line as a string in the form "inode:offset".
+        '''
+        return f'{self.inode}:{self.offset}'
+
+    def parse(self):
+        '''
+        parse is a method that parses the line into a LogEvent and serializes it to JSON the first time it is called.
+
+        The tailer calls it in the thread that read the line (see LogTailer.poll), parsing enriches the event from the callbook index
+        (see callbook.py) and must not run on the event loop.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        if not self.parsed:
+            start = time.perf_counter()
+            self.parsed_event = parse_line(self.line)
+            self.parsed_json = self.parsed_event.to_json() if self.parsed_event is not None else None
+            self.parsed = True
+            log = self.log or ''
+            PARSE_SECONDS.labels(log).inc(time.perf_counter() - start)
+            LINES_PARSED.labels(log).inc()
+            if self.parsed_event is not None:
+                EVENTS.labels(log, self.parsed_event.type).inc()
+                EVENT_RATE.labels(log).mark()
+
+    @property
+    def event(self):
+        '''
+        event is a property that returns the LogEvent parsed from the line, or None if the line is not an event.
+        '''
+        self.parse()
+        return self.parsed_event
+
+    @property
+    def event_json(self):
+        '''
+        event_json is a property that returns the LogEvent parsed from the line as compact JSON, or None if the line is not an event.
+        '''
+        self.parse()
+        return self.parsed_json
+
+
+class SubscriberQueue(asyncio.Queue):
+    POLICIES = ('drop_oldest', 'latest', 'disconnect')
+
+    def __init__(self, maxsize: int = 100, policy: str = 'drop_oldest', client: str = None, stream: str = None):
+        '''
+        SubscriberQueue constructor.
+
+        SubscriberQueue is the queue a tailer publishes to for each client. It is bounded so a client that cannot keep up
+        (e.g. a phone on bad Wi-Fi) never makes the API use more memory, and its policy decides what happens when it is full:
+            drop_oldest: The oldest queued record is dropped to make room for the new one
+            latest: The queue is coalesced to the newest record of each log, which is all a display needs to show the current state, and
+                the logs that were queued least recently are dropped when there are more logs than room
+            disconnect: The new record is dropped and overflowed is set, the consumer is expected to close the connection
+
+        Parameters:
+            maxsize: An integer that represents the maximum number of records in the queue, 0 for an unbounded queue that never drops
+                (the ingest tasks, which must see every record)
+            policy: A string that represents the overflow policy (drop_oldest, latest or disconnect)
+            client: A string that identifies the client in /metrics (e.g. its address and port)
+            stream: A string that represents the route or task the queue serves in /metrics (e.g. watch_log, ws or history)
+
+        Variables:
+            dropped: An integer that represents the number of records dropped because the queue was full
+            overflowed: A boolean that represents whether the queue overflowed with the disconnect policy
+            dropped_total: The Counter of metrics.DROPPED for the policy, shared by every queue with that policy
+
+        Returns:
+            None
+
+        Exceptions:
+            ValueError: An exception that is raised when the policy is unknown
+        '''
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown overflow policy: {policy}, expected one of {", ".join(self.POLICIES)}')
+        super().__init__(maxsize=maxsize)
+        self.policy = policy
+        self.client = client
+        self.stream = stream
+        self.dropped = 0
+        self.overflowed = False
+        self.dropped_total = DROPPED.labels(policy)
+
+    def offer(self, record):
+        '''
+        offer is a method that puts a record on the queue without ever blocking, applying the overflow policy when the queue is full.
+
+        Parameters:
+            record: A TailRecord object to queue (consumers may also queue None to wake themselves up)
+
+        Returns:
+            None
+        '''
+        if self.full():
+            if self.policy == 'disconnect':
+                self.dropped += 1
+                self.dropped_total.inc()
+                self.overflowed = True
+                return
+            if self.policy == 'latest':
+                # The newest record of each log, the most recently queued last, so the oldest logs go first when there are more logs
+                # than room in the queue (e.g. ws_queue_size 1 with two logs)
+                latest = {}
+                taken = 0
+                while not self.empty():
+                    queued = self.get_nowait()
+                    if queued is not None:
+                        taken += 1
+                        latest.pop(queued.log, None)
+                        latest[queued.log] = queued
+                latest.pop(record.log, None)
+                kept = list(latest.values())[-(self.maxsize - 1):] if self.maxsize > 1 else []
+                self.dropped += taken - len(kept)
+                self.dropped_total.inc(taken - len(kept))
+                for queued in kept:
+                    self.put_nowait(queued)
+            else:
+                self.get_nowait()
+                self.dropped += 1
+                self.dropped_total.inc()
+        self.put_nowait(record)
+
+    async def get_batch(self, limit: int = 64, window: float = 0):
+        '''
+        get_batch is a coroutine that waits for a record and returns it with the records that arrive shortly after it.
+
+        Every record already queued is taken at once, and the batch then stays open for window seconds after the first record so a
+        burst spread over a few polls is still sent as one write. The first record is never held back longer than window, and the batch
+        is returned as soon as it holds limit records.
+
+        Parameters:
+            limit: An integer that represents the maximum number of records in the batch
+            window: A float that represents the number of seconds to wait for more records after the first one, 0 to only take the queued records
+
+        Variables:
+            deadline: A float that represents the loop time at which the batch is returned even if it is not full
+
+        Returns:
+            list: A list of TailRecord objects (or None wake up markers) in the order they were queued
+        '''
+        records = [await self.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while len(records) < limit:
+            if not self.empty():
+                records.append(self.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                records.append(await asyncio.wait_for(self.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return records
+
+
+class LogTailer:
+    def __init__(self, logdog, log_file: str, interval: float = .1, queue_size: int = 100, replay_limit: int = 1000, on_stop=None,
+                 executor=None, recent_size: int = 100, seed_bytes: int = 262144):
+        '''
+        LogTailer constructor.
+
+        Parameters:
+            logdog: A LogDog object used for the log directory
+            log_file: A string that represents the log file prefix to follow (e.g. MMDVM or YSFGateway)
+            interval: A float that represents the number of seconds between polls of the log file
+            queue_size: An integer that represents the maximum number of lines buffered per subscriber
+            replay_limit: An integer that represents the maximum number of missed lines sent to a reconnecting subscriber
+            on_stop: An optional callable that is called with the tailer once its background task has stopped
+            executor: An optional concurrent.futures.Executor object that runs the file reads, the default executor of the loop if None
+            recent_size: An integer that represents the number of recent events kept for new subscribers, 0 to keep none
+            seed_bytes: An integer that represents the number of bytes read from the end of the log to find the recent events when the tailer starts
+
+        Variables:
+            subscribers: A dictionary that maps each subscriber queue to its StreamFilter (None for every line)
+            groups: A dictionary that maps each StreamFilter (None for every line) to the set of queues that use it
+            pending: A dictionary that maps each queue whose backlog is being read to the lines published in the meantime
+            published: A tuple (path, inode, position) that represents the cursor of the last published line, None before the first file is opened
+            recent: A RecentEvents object that keeps the recent events and the state of the log (see recent.py), None if recent_size is 0
+            opening: An asyncio.Task object that opens the newest file of the log in a thread, None when it is not being opened
+            seeding: An asyncio.Task object that reads the recent events from the log file, None when they are not being read
+            kept: A boolean that represents whether the tailer keeps running without subscribers, see keep
+            poll_seconds, fanout_seconds, bytes_read, lines_read, rotations: The metrics of the log (see metrics.py), looked up once here
+
+        Returns:
+            None
+        '''
+        self.logdog = logdog
+        self.log_file = log_file
+        self.interval = interval
+        self.queue_size = queue_size
+        self.replay_limit = replay_limit
+        self.on_stop = on_stop
+        self.executor = executor
+        self.subscribers = {}
+        self.groups = {}
+        self.pending = {}
+        self.published = None
+        self.recent = RecentEvents(log_file, recent_size) if recent_size > 0 else None
+        self.seed_bytes = seed_bytes
+        self.opening = None
+        self.seeding = None
+        self.kept = False
+        self.task = None
+        self.path = None
+        self.handle = None
+        self.inode = None
+        self.position = 0
+        self.buffer = b''
+        self.poll_seconds = POLL_SECONDS.labels(log_file)
+        self.fanout_seconds = FANOUT_SECONDS.labels(log_file)
+        self.bytes_read = BYTES_READ.labels(log_file)
+        self.lines_read = LINES_READ.labels(log_file)
+        self.rotations = ROTATIONS.labels(log_file)
+
+    def files(self):
+        '''
+        files is a method that returns the plain files of the log prefix, oldest first, compressed rotated files are never followed.
+
+        Parameters:
+            None
+
+        Returns:
+            list: A list of strings that represent the paths of the log files sorted by ctime
+        '''
+        return self.logdog.log_files.files(self.log_file, compressed=False)
+
+    async def subscribe(self, cursor: str = None, queue: SubscriberQueue = None, line_filter=None):
+        '''
+        subscribe is a coroutine that registers a new client and starts the background task if it is not running.
+
+        Without a cursor the client is sent the most recent line of the log so it has something to display, along with the snapshot of
+        the recent events and the state of the log (see recent.py), taken at the same cursor as the backlog.
+        With a cursor (the id of the last line the client received), the client is sent every complete line written after it instead.
+        The queue is registered and the last published cursor is taken in the same step, then the backlog is read up to that cursor in
+        a thread. The lines published while it is read are held in pending and added to the end of the backlog, so a line is never
+        both replayed and queued, never skipped, and the backlog always comes before the new lines.
+        When a subscriber falls behind and its queue is full, the overflow policy of its SubscriberQueue is applied (the oldest line is dropped by default).
+        A client that follows several logs can pass the same queue to the tailer of each log, TailRecord.log tells the lines apart.
+        With a filter, only the lines that pass it are queued and replayed.
+
+        Parameters:
+            cursor: A string that represents the cursor of the last line the client received, or None for a new client
+            queue: An optional SubscriberQueue object to publish to, a new queue of queue_size is created by default
+            line_filter: An optional StreamFilter object (see filters.py), shared with the other clients that use the same filter
+
+        Returns:
+            tuple: A tuple of (queue, backlog, snapshot) where queue is a SubscriberQueue object that receives each new TailRecord,
+                backlog is a list of TailRecord objects to send before reading from the queue and snapshot is a string that
+                represents the JSON snapshot of the log, or None with a cursor or when no recent events are kept
+        '''
+        await self.start()
+        published = self.published
+        snapshot = self.recent.snapshot(line_filter) if self.recent is not None and cursor is None else None
+        if queue is None:
+            queue = SubscriberQueue(maxsize=self.queue_size)
+        self.unsubscribe(queue)
+        self.subscribers[queue] = line_filter
+        pending = self.pending[queue] = []
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        try:
+            backlog = await asyncio.get_running_loop().run_in_executor(self.executor, self.backlog, cursor, published, line_filter)
+        except BaseException:
+            self.unsubscribe(queue)
+            raise
+        if self.pending.get(queue) is pending:
+            del self.pending[queue]
+            self.groups.setdefault(line_filter, set()).add(queue)
+        return queue, backlog + pending, snapshot
+
+    async def start(self):
+        '''
+        start is a coroutine that opens the log and reads its recent events if nothing polls the log yet.
+
+        The background task is not started here, it is started once there is a subscriber or the tailer is kept. The file is opened in
+        a thread (listing the directory and reading its end can take a while on an SD card), and clients that subscribe while the file is
+        opened or the recent events are read wait for the same open and read.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        if self.task is None and self.handle is None:
+            # Nothing polls the log yet, open it here so the first client gets its last line
+            if self.opening is None:
+                self.opening = asyncio.get_running_loop().create_task(self.open_log())
+            await asyncio.shield(self.opening)
+        if self.recent is not None and not self.recent.seeded:
+            if self.seeding is None:
+                self.seeding = asyncio.get_running_loop().create_task(self.seed())
+            await asyncio.shield(self.seeding)
+
+    async def open_log(self):
+        '''
+        open_log is a coroutine that opens the newest file of the log in a thread and commits its end as the published cursor.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.open_newest)
+            self.commit()
+        finally:
+            self.opening = None
+
+    async def seed(self):
+        '''
+        seed is a coroutine that adds the events written before the tailer started to the recent events, read in a thread.
+
+        Only the last seed_bytes of the file are read, so the time taken does not depend on the size of the log. The background task
+        is not running yet, so nothing is published while they are read.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        records = []
+        try:
+            records = await asyncio.get_running_loop().run_in_executor(self.executor, self.last_records, self.published)
+        except OSError as e:
+            print(f'Error reading the recent events of {self.log_file}: {e}')
+        finally:
+            self.recent.seed(records)
+            self.seeding = None
+
+    async def keep(self):
+        '''
+        keep is a coroutine that starts the tailer and keeps it running without subscribers, so its recent events stay current.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        self.kept = True
+        await self.start()
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def backlog(self, cursor: str, published: tuple, line_filter=None):
+        '''
+        backlog is a method that reads the lines to send to a new subscriber, it runs in a thread.
+
+        Parameters:
+            cursor: A string that represents the cursor of the last line the client received, or None for a new client
+            published: A tuple (path, inode, position) that represents the cursor of the last published line when the client subscribed
+            line_filter: An optional StreamFilter object the lines have to pass
+
+        Returns:
+            list: A list of TailRecord objects, oldest first
+        '''
+        position = parse_cursor(cursor)
+        if position is not None:
+            backlog = self.replay(*position, published)
+        else:
+            backlog = self.last_record(published)
+        for record in backlog:
+            # Parsed (and enriched from the callbook index) here in the thread, not by the first consumer on the event loop
+            record.parse()
+        if line_filter is not None:
+            backlog = [record for record in backlog if line_filter.matches(record)]
+        return backlog
+
+    def commit(self):
+        '''
+        commit is a method that records the position of the tailer as the cursor of the last published line.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        self.published = (self.path, self.inode, self.position) if self.handle is not None else None
+
+    def unsubscribe(self, queue: SubscriberQueue):
+        '''
+        unsubscribe is a method that removes a client queue. The background task stops on its next poll when no clients are left.
+
+        Parameters:
+            queue: The SubscriberQueue object returned by subscribe
+
+        Returns:
+            None
+        '''
+        if queue not in self.subscribers:
+            return
+        line_filter = self.subscribers.pop(queue)
+        if self.pending.pop(queue, None) is not None:
+            return
+        group = self.groups[line_filter]
+        group.discard(queue)
+        if not group:
+            del self.groups[line_filter]
+
+    def set_filter(self, queue: SubscriberQueue, line_filter=None):
+        '''
+        set_filter is a method that changes the filter of a subscriber without replaying anything.
+
+        Parameters:
+            queue: The SubscriberQueue object returned by subscribe
+            line_filter: The new StreamFilter object, or None for every line
+
+        Returns:
+            None
+        '''
+        if queue in self.subscribers and queue not in self.pending:
+            self.unsubscribe(queue)
+            self.subscribers[queue] = line_filter
+            self.groups.setdefault(line_filter, set()).add(queue)
+
+    def publish(self, record: TailRecord):
+        '''
+        publish is a method that offers a record to every subscriber queue whose filter it passes.
+
+        Each distinct filter is evaluated once for the record and the record is offered to every queue of its group,
+        see SubscriberQueue.offer for subscribers that are full.
+
+        Parameters:
+            record: A TailRecord object that represents the log line
+
+        Returns:
+            None
+        '''
+        if self.recent is not None:
+            self.recent.add(record)
+        for line_filter, queues in self.groups.items():
+            if line_filter is None or line_filter.matches(record):
+                for queue in queues:
+                    queue.offer(record)
+        for queue, pending in self.pending.items():
+            line_filter = self.subscribers[queue]
+            if line_filter is None or line_filter.matches(record):
+                pending.append(record)
+
+    def open_newest(self):
+        '''
+        open_newest is a method that opens the newest file of the log prefix and positions the tailer after its last complete line.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        files = self.files()
+        if not files:
+            return
+        self.open(files[-1])
+        size = os.fstat(self.handle.fileno()).st_size
+        # Start after the last newline so a line that is still being written is read in full on the next poll
+        start = max(0, size - 65536)
+        self.handle.seek(start)
+        end = self.handle.read(size - start).rfind(b'\n')
+        self.position = start + end + 1 if end != -1 else start
+        self.handle.seek(self.position)
+
+    def open(self, path: str):
+        '''
+        open is a method that opens a log file from its beginning and makes it the file followed by the tailer.
+
+        Parameters:
+            path: A string that represents the path of the log file
+
+        Returns:
+            None
+        '''
+        self.path = path
+        self.handle = open(path, 'rb')
+        self.inode = os.fstat(self.handle.fileno()).st_ino
+        self.position = 0
+        self.buffer = b''
+
+    def last_records(self, published: tuple):
+        '''
+        last_records is a method that returns the complete lines in the last seed_bytes before a published cursor.
+
+        Parameters:
+            published: A tuple (path, inode, position) that represents the cursor of the last published line
+
+        Returns:
+            list: A list of TailRecord objects, oldest first
+        '''
+        if published is None or published[2] == 0:
+            return []
+        path, inode, position = published
+        start = max(0, position - self.seed_bytes)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(position - start)
+        lines = data.split(b'\n')[:-1]
+        if start > 0:
+            # The first line is cut by the start of the read, skip it
+            start += len(lines[0]) + 1
+            lines = lines[1:]
+        records = []
+        for line in lines:
+            start += len(line) + 1
+            record = TailRecord(line.decode('utf-8', errors='replace').strip(), inode, start, self.log_file)
+            record.parse()
+            records.append(record)
+        return records
+
+    def last_record(self, published: tuple):
+        '''
+        last_record is a method that returns the last complete line before a published cursor.
+
+        Parameters:
+            published: A tuple (path, inode, position) that represents the cursor of the last published line
+
+        Returns:
+            list: A list with one TailRecord object, or an empty list if the file has no complete line yet
+        '''
+        if published is None or published[2] == 0:
+            return []
+        path, inode, position = published
+        with open(path, 'rb') as f:
+            start = max(0, position - 65536)
+            f.seek(start)
+            data = f.read(position - start)
+        line = data[:-1].rsplit(b'\n', 1)[-1]
+        return [TailRecord(line.decode('utf-8', errors='replace').strip(), inode, position, self.log_file)]
+
+    def replay(self, inode: int, offset: int, published: tuple):
+        '''
+        replay is a method that returns the complete lines written after a cursor, up to a published cursor.
+
+        The file the cursor points to is found by its inode. If it is an older, rotated file, the rest of that file is returned
+        followed by every newer file. At most replay_limit of the most recent lines are returned.
+
+        Parameters:
+            inode: An integer that represents the inode of the file the cursor points to
+            offset: An integer that represents the byte offset of the cursor in that file
+            published: A tuple (path, inode, position) that represents the cursor of the last published line
+
+        Variables:
+            records: A generator of the TailRecord objects after the cursor, see read_from
+            backlog: A deque object that keeps the most recent missed lines
+
+        Returns:
+            list: A list of TailRecord objects, oldest first
+        '''
+        if published is None:
+            return []
+        records = self.read_from(inode, offset, published)
+        if records is None:
+            return self.last_record(published)
+        backlog = deque(records, maxlen=self.replay_limit)
+        return list(backlog)
+
+    def read_from(self, inode: int, offset: int, published: tuple):
+        '''
+        read_from is a method that returns a generator of the complete lines written after a cursor, up to a published cursor.
+
+        The lines are read as the generator is consumed, so a consumer that does not keep them (e.g. the statistics catching up after a
+        restart) reads any number of lines in constant memory.
+
+        Parameters:
+            inode: An integer that represents the inode of the file the cursor points to
+            offset: An integer that represents the byte offset of the cursor in that file
+            published: A tuple (path, inode, position) that represents the cursor of the last published line
+
+        Variables:
+            files: A list of strings that represent the log files, oldest first
+            inodes: A list of the inodes of the files, None for a file that disappeared
+
+        Returns:
+            generator: A generator of TailRecord objects, oldest first, or None if the file of the cursor or of published is gone
+        '''
+        current_inode, current_position = published[1], published[2]
+        files = self.files()
+        inodes = []
+        for path in files:
+            try:
+                inodes.append(os.stat(path).st_ino)
+            except FileNotFoundError:
+                inodes.append(None)
+        if inode not in inodes or current_inode not in inodes:
+            return None
+        first = inodes.index(inode)
+        def records():
+            for path, file_inode in zip(files[first:], inodes[first:]):
+                start = offset if file_inode == inode else 0
+                end = current_position if file_inode == current_inode else None
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    position = start
+                    for raw in f:
+                        if end is not None and position + len(raw) > end:
+                            break
+                        if not raw.endswith(b'\n'):
+                            break
+                        position += len(raw)
+                        yield TailRecord(raw.decode('utf-8', errors='replace').strip(), file_inode, position, self.log_file)
+                if file_inode == current_inode:
+                    break
+        return records()
+
+    def read_new(self):
+        '''
+        read_new is a method that reads the bytes appended to the open file since the last call and returns the complete lines.
+
+        A trailing partial line is kept in self.buffer until the rest of it is written.
+
+        Parameters:
+            None
+
+        Returns:
+            records: A list of TailRecord objects that represent the new log lines
+        '''
+        data = self.handle.read()
+        if not data:
+            return []
+        self.bytes_read.inc(len(data))
+        self.buffer += data
+        records = []
+        start = 0
+        end = self.buffer.find(b'\n')
+        while end != -1:
+            self.position += end + 1 - start
+            records.append(TailRecord(self.buffer[start:end].decode('utf-8', errors='replace').strip(), self.inode, self.position, self.log_file))
+            start = end + 1
+            end = self.buffer.find(b'\n', start)
+        self.buffer = self.buffer[start:]
+        self.lines_read.inc(len(records))
+        return records
+
+    def poll(self):
+        '''
+        poll is a method that checks the log directory for the newest file and returns the lines appended since the last poll.
+
+        When a newer file appears (e.g. the daily rotation), the rest of the old file is read before the new file is followed
+        from its beginning so no lines are dropped at the boundary.
+
+        Parameters:
+            None
+
+        Returns:
+            records: A list of TailRecord objects that represent the new log lines
+        '''
+        if self.handle is None:
+            self.open_newest()
+            return []
+        files = self.files()
+        if not files:
+            return []
+        newest_file = files[-1]
+        records = []
+        if newest_file != self.path:
+            # The log rotated: finish the old file, including a last line without a newline, before following the new one
+            records += self.read_new()
+            if self.buffer:
+                self.position += len(self.buffer)
+                records.append(TailRecord(self.buffer.decode('utf-8', errors='replace').strip(), self.inode, self.position, self.log_file))
+            self.handle.close()
+            self.open(newest_file)
+            self.rotations.inc()
+        elif os.fstat(self.handle.fileno()).st_size < self.position + len(self.buffer):
+            # The file was truncated in place, start again from the beginning
+            self.handle.seek(0)
+            self.position = 0
+            self.buffer = b''
+            self.rotations.inc()
+        records += self.read_new()
+        for record in records:
+            # Parsed (and enriched from the callbook index, which can fault pages in from the SD card) here in the thread, before the
+            # records are published, so no consumer parses on the event loop
+            record.parse()
+        return records
+
+    async def run(self):
+        '''
+        run is a coroutine that polls the log file every interval and publishes new lines until there are no subscribers left.
+
+        The poll runs in a thread of the executor, the lines it read are published on the event loop and then committed as the cursor new
+        subscribers replay up to. The duration of every poll and of the fan-out of the lines it read are observed in the poll and
+        fan-out histograms.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers or self.kept:
+                start = time.perf_counter()
+                try:
+                    records = await loop.run_in_executor(self.executor, self.poll)
+                except OSError as e:
+                    # A file can disappear between listing the directory and reading it, try again on the next poll
+                    print(f'Error reading {self.log_file} logs: {e}')
+                    records = []
+                self.poll_seconds.observe(time.perf_counter() - start)
+                if records:
+                    start = time.perf_counter()
+                    for record in records:
+                        self.publish(record)
+                    self.fanout_seconds.observe(time.perf_counter() - start)
+                self.commit()
+                await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self.handle is not None:
+                self.handle.close()
+            self.handle = None
+            self.path = None
+            self.inode = None
+            self.position = 0
+            self.buffer = b''
+            self.published = None
+            if self.recent is not None:
+                # The lines written until the next start are not followed, they are read again from the file by seed
+                self.recent.clear()
+            self.task = None
+            if self.on_stop is not None:
+                self.on_stop(self)
+
+
+class TailHub:
+    def __init__(self, logdog, interval: float = .1, queue_size: int = 100, replay_limit: int = 1000, executor=None,
+                 recent_size: int = 100, seed_bytes: int = 262144):
+        '''
+        TailHub constructor.
+
+        Parameters:
+            logdog: A LogDog object that is shared with every LogTailer
+            interval: A float that represents the number of seconds between polls of each log file
+            queue_size: An integer that represents the maximum number of lines buffered per subscriber
+            replay_limit: An integer that represents the maximum number of missed lines sent to a reconnecting subscriber
+            executor: An optional concurrent.futures.Executor object that runs the file reads of every tailer
+            recent_size: An integer that represents the number of recent events each tailer keeps for new subscribers, 0 to keep none
+            seed_bytes: An integer that represents the number of bytes read from the end of a log to find its recent events
+
+        Returns:
+            None
+        '''
+        self.logdog = logdog
+        self.interval = interval
+        self.queue_size = queue_size
+        self.replay_limit = replay_limit
+        self.executor = executor
+        self.recent_size = recent_size
+        self.seed_bytes = seed_bytes
+        self.tailers = {}
+
+    async def subscribe(self, log_file: str, cursor: str = None, queue: SubscriberQueue = None, line_filter=None):
+        '''
+        subscribe is a coroutine that subscribes a client to a log prefix, creating the LogTailer for it if needed.
+
+        Parameters:
+            log_file: A string that represents the log file prefix to follow
+            cursor: A string that represents the cursor of the last line the client received, or None for a new client
+            queue: An optional SubscriberQueue object to publish to, shared by the logs of a client that follows several logs
+            line_filter: An optional StreamFilter object, only the lines that pass it are sent to the client
+
+        Returns:
+            tuple: A tuple of (queue, backlog, snapshot), see LogTailer.subscribe
+        '''
+        return await self.tailer(log_file).subscribe(cursor, queue, line_filter)
+
+    async def keep(self, log_file: str):
+        '''
+        keep is a coroutine that keeps the tailer of a log prefix running without subscribers, see LogTailer.keep.
+
+        Parameters:
+            log_file: A string that represents the log file prefix to follow
+
+        Returns:
+            None
+        '''
+        await self.tailer(log_file).keep()
+
+    def tailer(self, log_file: str):
+        '''
+        tailer is a method that returns the LogTailer of a log prefix, creating it if needed.
+
+        Parameters:
+            log_file: A string that represents the log file prefix
+
+        Returns:
+            LogTailer: The LogTailer object of the log prefix
+        '''
+        tailer = self.tailers.get(log_file)
+        if tailer is None:
+            tailer = LogTailer(self.logdog, log_file, self.interval, self.queue_size, self.replay_limit, on_stop=self.remove,
+                               executor=self.executor, recent_size=self.recent_size, seed_bytes=self.seed_bytes)
+            self.tailers[log_file] = tailer
+        return tailer
+
+    def unsubscribe(self, log_file: str, queue: SubscriberQueue):
+        '''
+        unsubscribe is a method that removes a client queue from the tailer of a log prefix.
+
+        Parameters:
+            log_file: A string that represents the log file prefix
+            queue: The SubscriberQueue object returned by subscribe
+
+        Returns:
+            None
+        '''
+        tailer = self.tailers.get(log_file)
+        if tailer is not None:
+            tailer.unsubscribe(queue)
+
+    def set_filter(self, log_file: str, queue: SubscriberQueue, line_filter=None):
+        '''
+        set_filter is a method that changes the filter of a client queue on the tailer of a log prefix.
+
+        Parameters:
+            log_file: A string that represents the log file prefix
+            queue: The SubscriberQueue object returned by subscribe
+            line_filter: The new StreamFilter object, or None for every line
+
+        Returns:
+            None
+        '''
+        tailer = self.tailers.get(log_file)
+        if tailer is not None:
+            tailer.set_filter(queue, line_filter)
+
+    def remove(self, tailer: LogTailer):
+        '''
+        remove is a method that forgets a tailer once it has stopped, unless a client subscribed again in the meantime.
+
+        Parameters:
+            tailer: The LogTailer object that stopped
+
+        Returns:
+            None
+        '''
+        if self.tailers.get(tailer.log_file) is tailer and not tailer.subscribers and not tailer.kept:
+            del self.tailers[tailer.log_file]
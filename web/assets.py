@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import base64
+import gzip
+import shutil
+import hashlib
+import mimetypes
+import posixpath
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+assets is a module that builds the static files of the web interface once, and serves the built files without any work per request.
+
+The page used to load Bootstrap, jQuery (which was never used) and the Digital-7 font from public CDNs, so the first paint of a hotspot
+that is offline or on metered cellular waited on those requests, and flask_compress gzipped logdog.js and the CSS again on every request.
+
+The build step (python -m web.assets, run by install.py) does the following:
+    1. Downloads the third-party files the page needs into web/static/vendor (Bootstrap's CSS and the Digital-7 font) if they are missing,
+       and checks every vendored file against the digest pinned in VENDOR_FILES. A file that does not match fails the build, and a file
+       without a pinned digest is not vendored, the page loads it from the CDN.
+    2. Copies every file of web/static to web/static/dist with a content hash in its name (e.g. js/logdog.3f2a9c1b7d4e.js). url() references
+       in the stylesheets are rewritten to the hashed names.
+    3. Writes a gzip (.gz) and, when the brotli module is installed, a brotli (.br) copy of every text file next to it.
+    4. Writes dist/manifest.json, which maps each source file to its hashed name.
+
+At runtime Assets reads the manifest: the templates call asset(filename) to get the hashed URL, and the /static/dist/ route returns the
+precompressed copy that matches the Accept-Encoding header of the browser. A hashed file never changes, so it is sent with an ETag and
+Cache-Control: immutable and repeat page loads do not download or compress anything. A file that was not built is served from web/static
+as before.
+
+Classes:
+    Assets: A class that maps the static files to their built copies and returns the headers they are served with
+
+Functions:
+    vendor: A function that downloads the third-party files into the static directory
+    build: A function that writes the hashed and precompressed copies of the static files and the manifest
+'''
+
+static_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static')
+# Third-party files of the page, where to download them from and their digest in subresource integrity form (algorithm-base64).
+# Bootstrap's is the integrity it publishes for the release. The font has no published digest, pin it after checking a download with
+# openssl dgst -sha384 -binary digital-7.woff | openssl base64 -A
+VENDOR_FILES = {
+    'vendor/bootstrap.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+        'sha384-9ndCyUaIbzAi2FUVXJi0CjmCapSmO7SnpJef0486qhLnuZ2cdeRhO02iuK6FUUVM',
+    ),
+    'vendor/digital-7.woff': ('https://fonts.cdnfonts.com/s/17796/digital-7.woff', None),
+}
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.map')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+url_regex = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+
+def vendor(directory: str = static_directory):
+    '''
+    vendor is a function that downloads the third-party files of the page into the static directory if they are missing.
+
+    Every file is checked against its pinned digest, the ones already in the directory too, and only written when it matches. A file
+    without a pinned digest is removed from the directory instead of being downloaded.
+
+    Parameters:
+        directory: A string that represents the static directory
+
+    Variables:
+        mismatched: A list of strings that represent the files whose content does not match their pinned digest
+
+    Returns:
+        list: A list of strings that represent the files that were not vendored, the page falls back to the CDN for those
+
+    Exceptions:
+        ValueError: If a downloaded or vendored file does not match its pinned digest, the mismatched file is not kept
+    '''
+    missing = []
+    mismatched = []
+    for filename, (url, integrity) in VENDOR_FILES.items():
+        path = os.path.join(directory, filename)
+        if integrity is None:
+            if os.path.exists(path):
+                os.remove(path)
+            print(f'Not vendoring {filename}, it has no pinned digest')
+            missing.append(filename)
+            continue
+        algorithm, _, expected = integrity.partition('-')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            if base64.b64encode(hashlib.new(algorithm, data).digest()).decode() == expected:
+                continue
+            print(f'{filename} does not match its pinned digest, downloading it again')
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as e:
+            print(f'Could not download {url}: {e}')
+            missing.append(filename)
+            continue
+        if base64.b64encode(hashlib.new(algorithm, data).digest()).decode() != expected:
+            print(f'{url} does not match the pinned digest {integrity}')
+            mismatched.append(filename)
+            continue
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f'Downloaded {filename}')
+    if mismatched:
+        raise ValueError(f'Downloaded files do not match their pinned digest: {", ".join(mismatched)}')
+    return missing
+
+
+def build(directory: str = static_directory):
+    '''
+    build is a function that writes the hashed and precompressed copies of the static files to the dist directory and its manifest.
+
+    Stylesheets are built last so the url() references to the other files can be rewritten to their hashed names.
+
+    Parameters:
+        directory: A string that represents the static directory
+
+    Variables:
+        dist: A string that represents the directory the built files are written to, it is emptied first
+        manifest: A dictionary that maps the path of each source file to the path of its hashed copy, relative to the directories
+
+    Returns:
+        dict: The manifest
+    '''
+    dist = os.path.join(directory, 'dist')
+    shutil.rmtree(dist, ignore_errors=True)
+    sources = []
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(name for name in directories if os.path.join(root, name) != dist)
+        for name in sorted(files):
+            sources.append(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/'))
+    manifest = {}
+    for filename in sorted(sources, key=lambda filename: filename.endswith('.css')):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            data = f.read()
+        if filename.endswith('.css'):
+            def hashed_url(match):
+                reference = posixpath.normpath(posixpath.join(posixpath.dirname(filename), match.group(2)))
+                if reference not in manifest:
+                    return match.group(0)
+                return f'url({match.group(1)}{posixpath.relpath(manifest[reference], posixpath.dirname(filename))}{match.group(1)})'
+            data = url_regex.sub(hashed_url, data.decode('utf-8')).encode('utf-8')
+        root, extension = posixpath.splitext(filename)
+        hashed = f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+        path = os.path.join(dist, hashed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if extension in COMPRESSIBLE:
+            with open(f'{path}.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(f'{path}.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+        manifest[filename] = hashed
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+class Assets:
+    def __init__(self, directory: str = static_directory, prefix: str = '/static'):
+        '''
+        Assets constructor that reads the manifest written by build, if there is one.
+
+        Parameters:
+            directory: A string that represents the static directory
+            prefix: A string that represents the URL the static directory is served at
+
+        Variables:
+            manifest: A dictionary that maps each source file to its hashed copy, empty if the build step was not run
+            hashed: A set of strings that represent the hashed copies that can be served from dist
+
+        Returns:
+            None
+        '''
+        self.directory = directory
+        self.dist = os.path.join(directory, 'dist')
+        self.prefix = prefix
+        try:
+            with open(os.path.join(self.dist, 'manifest.json')) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        self.hashed = set(self.manifest.values())
+
+    def url(self, filename: str):
+        '''
+        url is a method that returns the URL of a static file, the URL of its hashed copy when it was built.
+
+        Parameters:
+            filename: A string that represents the path of the file in the static directory
+
+        Returns:
+            str: A string that represents the URL of the file, or None if the file does not exist (e.g. a vendor file that was not downloaded)
+        '''
+        if filename in self.manifest:
+            return f'{self.prefix}/dist/{self.manifest[filename]}'
+        if os.path.isfile(os.path.join(self.directory, filename)):
+            return f'{self.prefix}/{filename}'
+        return None
+
+    def find(self, filename: str, accept_encoding: str = '', if_none_match: str = None):
+        '''
+        find is a method that picks the copy of a built file to send for a request and the headers to send it with.
+
+        The brotli copy is preferred, then the gzip copy, when the browser accepts them. The ETag names the encoding of the copy so
+        caches never mix them up.
+
+        Parameters:
+            filename: A string that represents the path of the hashed file in the dist directory
+            accept_encoding: A string that represents the Accept-Encoding header of the request
+            if_none_match: A string that represents the If-None-Match header of the request
+
+        Variables:
+            encoding: A string that represents the encoding of the copy (br or gzip), or None for the file itself
+
+        Returns:
+            tuple: A tuple (status, path, headers, mimetype) where status is 200, or 304 when the browser already has the copy (path is None),
+            or None if the file was not built
+        '''
+        if filename not in self.hashed:
+            return None
+        path = os.path.join(self.dist, filename)
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if candidate in accept_encoding and os.path.isfile(path + suffix):
+                encoding = candidate
+                path += suffix
+                break
+        etag = f'"{posixpath.basename(filename)}-{encoding or "identity"}"'
+        headers = {'Cache-Control': IMMUTABLE, 'ETag': etag, 'Vary': 'Accept-Encoding'}
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, None, headers, mimetype
+        return 200, path, headers, mimetype
+
+
+if __name__ == '__main__':
+    '''
+    This block of code runs the build step: python -m web.assets
+    '''
+    try:
+        missing = vendor()
+    except ValueError as e:
+        print(f'Error: {e}')
+        exit(1)
+    manifest = build()
+    print(f'Built {len(manifest)} static files in {os.path.join(static_directory, "dist")}')
+    if missing:
+        print(f'The page will load {", ".join(missing)} from the CDN until they are downloaded, run the build again when online.')
@@ -3,7 +3,7 @@
     *
     * Author: Jonathan L. Pressler
     * Date: 2024-04-04
-    * Version: 1.6
+    * Version: 2.5
     *
     * Changelog:
     * 1.0 - Initial version
@@ -11,19 +11,28 @@
     * clear log button to clear the log table and an expansion button to toggle the scrollable and sticky-header classes on the table.
     * 1.6 - Added a timeout to turn off the blinking indicator if the end of transmission is not received within 10 minutes.
     * 1.7 - Renamed to logdog.js as a part of a project rebranding.
+    * 1.8 - Removed the duplicate line check, the API now only sends each line once and resumes from the last received line on reconnect.
+    * 1.9 - Switched to the /events stream, log lines are now parsed into JSON events by the API instead of with regexes in the browser.
+    * 2.0 - Replaced the two EventSource objects with a single connection to /watch that carries both logs as named events.
+    * 2.1 - The API address is read from the page, so the streams are opened on the same origin when the page is served by the single-process app.
+    * 2.2 - The table, the reflector and the indicator are filled from the snapshot of recent events the API sends when the page connects.
+    * 2.3 - The name of the operator, added to the events by the callbook of the API, is shown after the callsign.
+    * 2.4 - The queue is drained once per animation frame instead of one entry every 100 ms, its rows are added to the table in one batch and the
+    * "radio display" only shows the latest entry. The table keeps at most max_rows rows. The update interval, which was started again on every
+    * reconnect, is gone.
+    * 2.5 - The indicator follows the tx_start and tx_end state changes of the sessions the API pairs from the headers and ends, instead of the type
+    * of the last event and a 10 minute timeout, the API times out the transmissions that are never ended.
 */
 
 /* global variables */
 const serverIP = document.getElementById("server_ip").value || "localhost"; // get the server IP from the hidden input element or if it is not set, use localhost
-var eventSource = new EventSource(`http://${serverIP}:8001/watch_log`); // create a new EventSource object with the server IP and port 8001
-var eventSource2 = new EventSource(`http://${serverIP}:8001/watch_log?log_override=YSFGateway`); // create a new EventSource object with the server IP and port 8001
+const logFile = document.getElementById("log_file").value || "MMDVM"; // get the MMDVMHost log name from the hidden input element or if it is not set, use MMDVM
+const apiBase = document.getElementById("api_base").value || `http://${serverIP}:8001`; // get the API address from the hidden input element or if it is not set, use the server IP and port 8001
+const gatewayLogFile = "YSFGateway"; // the YSFGateway log is used to identify the reflector/room
+var eventSource = new EventSource(`${apiBase}/watch?log=${logFile}&log=${gatewayLogFile}&events=true&sessions=true`); // create a new EventSource object with the API address for both logs and the sessions
 const callsignLine = document.getElementById("callsign");
 const dateLine = document.getElementById("date");
 const sourceLine = document.getElementById("source");
-const callsignRegex = /\b[A-Z0-9]{1,2}[0-9]{1}[A-Z]{1,3}\b/g; // regex matches callsigns with 1-2 numbers, 1 number, and 1-3 letters
-const rfOrNetworkRegex = /\bRF\b|\bnetwork\b/g; // regex matches RF or network strings
-const endOfTxRegex = /\bend of transmission\b/g; // regex matches end of transmission strings
-const dateRegex = /\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}\b/g; // regex matches date strings in the format YYYY-MM-DD HH:MM:SS.SSS
 const myCallsign = document.getElementById("my_callsign").textContent || "N0CALL"; // get the callsign from the hidden input element or if it is not set, use N0CALL
 const tableBody = document.getElementById("log_table");
 const table = document.getElementById("call_log");
@@ -31,22 +40,28 @@ const indicator = document.getElementById("indicator");
 const reflector = document.getElementById("reflector");
 const clearLogButton = document.getElementById("clear_log");
 const expansionButton = document.getElementById("expansion_button");
+const maxRows = parseInt(document.getElementById("max_rows").value, 10) || 200; // get the maximum number of rows of the table from the hidden input element or if it is not set, use 200
 let blinking = false; // boolean to determine if the indicator is blinking, starts as false when the page loads
-let endOfMessage = false; // boolean to determine if the end of the message has been reached, starts as false when the page loads
-let lastLine;  // variable to hold the last line logged to the table
-let queue = []; // queue to hold the log entries
+let queue = []; // queue to hold the log entries until the next animation frame
+let updateScheduled = false; // boolean to determine if updateLog is already requested for the next animation frame
+const activeSessions = new Map(); // the transmissions in progress by session id, the indicator blinks while there is one
 
 /* event listeners */
 /*
-    * eventSource.onmessage - This event listener listens for incoming messages from the server and parses the data to find the callsign, source, and date. It then
+    * eventSource logFile listener - This event listener listens for incoming MMDVMHost JSON events from the server with the callsign, source, and date. It then
     * pushes the data to the queue.
-    * 
-    * eventSource.onerror - This event listener listens for errors from the server and logs them to the console.
     *
-    * eventSource2.onmessage - This event listener listens for incoming messages from the server and parses the data to find the reflector/room. 
+    * eventSource gatewayLogFile listener - This event listener listens for incoming YSFGateway link and unlink events from the server. 
     * It then sets the text content of the reflector element to the reflector/room.
     * 
-    * eventSource2.onerror - This event listener listens for errors from the server and logs them to the console.
+    * eventSource snapshot listener - This event listener receives the recent events and state of each log when the page connects. The events of
+    * the MMDVMHost log are queued like new events and drawn in the next frame, the reflector is set from the YSFGateway state and the indicator
+    * blinks if the sessions snapshot has a transmission in progress.
+    * 
+    * eventSource sessions listener - This event listener receives the tx_start and tx_end state changes of the transmissions and blinks the
+    * indicator while one is in progress.
+    * 
+    * eventSource.onerror - This event listener listens for errors from the server and logs them to the console.
     * 
     * clearLogButton.addEventListener - This event listener listens for a click on the clear log button and clears the log table.
     * 
@@ -54,46 +69,107 @@ let queue = []; // queue to hold the log entries
     * sticky-header classes on the table.
     * 
 */
-eventSource.onmessage = function(event) {
-    const callsignMatch = event.data.match(callsignRegex);
-    const rfOrNetworkMatch = event.data.match(rfOrNetworkRegex);
-    const dateMatch = event.data.match(dateRegex);
-    const endOfTxMatch = event.data.match(endOfTxRegex);
-    let formattedDate = new Date(dateMatch[0]+'Z').toLocaleString();
-    if (callsignMatch) {
-        if (rfOrNetworkMatch.includes('RF')) {
-            queue.push(`Time: ${formattedDate} Source: RF: Callsign: ${callsignMatch[0]}`);
-        }
-        else if (rfOrNetworkMatch.includes('network')) {
-            queue.push(`Time: ${formattedDate} Source: Network: Callsign: ${callsignMatch[0]}`);
-        } else {
-            queue.push(`Time: ${formattedDate} Source: Unknown: Callsign: ${callsignMatch[0]}`);
-        }
+eventSource.addEventListener(logFile, function(message) {
+    queueEvent(JSON.parse(message.data));
+});
+
+eventSource.addEventListener('snapshot', function(message) {
+    const snapshot = JSON.parse(message.data);
+    if (snapshot.log === logFile) {
+        snapshot.events.forEach(queueEvent);
+    } else if (snapshot.log === gatewayLogFile) {
+        reflector.textContent = snapshot.reflector || '';
+    } else if (snapshot.log === 'sessions') {
+        activeSessions.clear();
+        snapshot.active.forEach(session => activeSessions.set(session.id, session));
+        updateIndicator();
     }
-    if (endOfTxMatch) {
-        endOfMessage = true;
-    } else {
-        endOfMessage = false;
+});
+
+eventSource.addEventListener('sessions', function(message) {
+    const change = JSON.parse(message.data);
+    if (change.type === 'tx_start') {
+        activeSessions.set(change.session.id, change.session);
+    } else if (change.type === 'tx_end') {
+        activeSessions.delete(change.session.id);
     }
-};
+    updateIndicator();
+});
 
-eventSource.onerror = function(error) {
-    console.error("Failed to connect to SSE at: ", eventSource.url, "with error: ", error);
-    console.error("This event source is for MMDVMHost logs and used to identify the callsign and source.");
-};
+/*
+    * sourceText - This function returns the source of an event as it is displayed.
+    *
+    * @param {object} event - The event parsed from the log line by the API.
+    * 
+    * @returns {string} - RF:, Network: or Unknown:
+    * 
+*/
+function sourceText(event) {
+    if (event.source === 'RF') {
+        return 'RF:';
+    } else if (event.source === 'network') {
+        return 'Network:';
+    }
+    return 'Unknown:';
+}
+
+/*
+    * callsignText - This function returns the callsign of an event as it is displayed, followed by the name of the operator when the callbook knows it.
+    *
+    * @param {object} event - The event parsed from the log line by the API.
+    * 
+    * @returns {string} - The callsign, e.g. K3JLP (Jonathan Pressler)
+    * 
+*/
+function callsignText(event) {
+    return event.name ? `${event.callsign} (${event.name})` : event.callsign;
+}
+
+/*
+    * queueEvent - This function pushes the callsign, source, and date of an MMDVMHost event to the queue and requests an update for the next
+    * animation frame.
+    *
+    * Browsers do not run animation frames in a background tab, so while the page is hidden the queue is cut back to the last maxRows entries,
+    * which is all the table can show once the page is visible again.
+    *
+    * @param {object} event - The event parsed from the log line by the API.
+    * 
+*/
+function queueEvent(event) {
+    if (!event.callsign) {
+        return;
+    }
+    queue.push({date: new Date(event.time+'Z').toLocaleString(), source: sourceText(event), callsign: callsignText(event)});
+    if (queue.length > maxRows * 2) {
+        queue.splice(0, queue.length - maxRows);
+    }
+    scheduleUpdate();
+}
 
-eventSource2.onmessage = function(event) {
-    if (event.data.includes('Linked to')) {
-        reflector.textContent = event.data.split('Linked to ')[1];
+/*
+    * scheduleUpdate - This function requests updateLog for the next animation frame, once however many entries are queued before it.
+    * 
+*/
+function scheduleUpdate() {
+    if (updateScheduled === false) {
+        updateScheduled = true;
+        requestAnimationFrame(updateLog);
     }
-    else if (event.data.includes('Disconnect by remote command')) {
+}
+
+eventSource.addEventListener(gatewayLogFile, function(message) {
+    const event = JSON.parse(message.data);
+    if (event.type === 'link') {
+        reflector.textContent = event.reflector;
+    }
+    else if (event.type === 'unlink') {
         reflector.textContent = '';
     }
-};
+});
 
-eventSource2.onerror = function(error) {
+eventSource.onerror = function(error) {
     console.error("Failed to connect to SSE at: ", eventSource.url, "with error: ", error);
-    console.error("This event source is for YSFGateway logs and used to identify the reflector/room.");
+    console.error("This event source is for MMDVMHost and YSFGateway logs and used to identify the callsign, source and reflector/room.");
 };
 
 clearLogButton.addEventListener('click', () => {
@@ -117,51 +193,61 @@ expansionButton.addEventListener('click', () => {
 /*
     * updateLog - This function updates the "radio display" with the latest activity and logs it to the table.
     *
-    * using the queue, the function checks if the queue is empty and if it is, it returns. If the queue is not empty, it shifts the first element from the queue
-    * and checks if the line is the same as the last line. If it is, it simple returns to avoid duplicate logging. If the line is not the same
-    * as the last line, it sets the last line to the current line and sets the text content of the callsign line to the callsign. 
-    * It then sets the text content of the date line to the date and the source line to the source. Finally, it then calls the createLogRow function with
-    * the date, source, and callsign as arguments.
+    * It runs once per animation frame while entries are queued and drains the whole queue, so the display never falls behind during a burst.
+    * The rows of the entries are built in a DocumentFragment and added to the table at once, then the oldest rows are removed so the table keeps
+    * at most maxRows rows. The "radio display" is only set to the latest entry.
     * 
 */
 function updateLog() {
-    if (queue.length === 0) {
+    updateScheduled = false;
+    const entries = queue;
+    queue = [];
+    if (entries.length === 0) {
         return;
     }
 
-    const line = queue.shift();
-    if (line === lastLine) { // if the line is the same as the last line, simply return as we don't want to log the same line multiple times
-        return;
+    const rows = entries.slice(-maxRows);
+    const latest = rows[rows.length - 1];
+    callsignLine.textContent = latest.callsign;
+    dateLine.textContent = latest.date;
+    sourceLine.textContent = latest.source;
+    const fragment = document.createDocumentFragment();
+    rows.forEach(entry => fragment.appendChild(createLogRow(entry.date, entry.source, entry.callsign)));
+    tableBody.appendChild(fragment);
+    while (tableBody.rows.length > maxRows) {
+        tableBody.deleteRow(0);
     }
-    if (blinking === false) {
-        toggleIndicator();
+    if (table.classList.contains('scrollable')) {
+        table.scrollTop = tableBody.scrollHeight; // scroll to the bottom of the table
     }
-    lastLine = line;
-    callsignLine.textContent = line.split("Callsign: ")[1];
-    dateLine.textContent = line.split("Time: ")[1].split(" Source: ")[0];
-    sourceLine.textContent = line.split("Source: ")[1].split(" Callsign: ")[0];
-    createLogRow(dateLine.textContent, sourceLine.textContent, callsignLine.textContent);
-    if (endOfMessage === true && blinking === true) { 
+}
+
+/*
+    * updateIndicator - This function turns the blinking of the indicator on while a transmission is in progress and off once none is.
+    * 
+*/
+function updateIndicator() {
+    if ((activeSessions.size > 0) !== blinking) {
         toggleIndicator();
-    }   
+    }
 }
 
 /*
-    * createLogRow - This function creates a new row in the table with the date, source, and callsign as the content.
+    * createLogRow - This function creates a row with the date, source, and callsign as the content, to be added to the table by updateLog.
     *
     * @param {string} date - The date of the log entry.
     * @param {string} source - The source of the log entry.
     * @param {string} callsign - The callsign of the log entry.
     * 
+    * @returns {HTMLTableRowElement} - The new row.
+    * 
 */
 function createLogRow(date, source, callsign) {
-    var newRow = tableBody.insertRow();
+    const newRow = document.createElement('tr');
     newRow.insertCell().textContent = date;
     newRow.insertCell().textContent = source;
     newRow.insertCell().textContent = callsign;
-    if (table.classList.contains('scrollable')) {
-        table.scrollTop = tableBody.scrollHeight; // scroll to the bottom of the table
-    }
+    return newRow;
 }
 
 /*
@@ -199,20 +285,5 @@ function toggleIndicator() {
                 indicator.textContent = '●';
             }
         }, 500);
-
-        setTimeout(() => {
-            if (blinking === false) {
-                return;
-            } else {
-                clearInterval(blinkInterval);
-                indicator.textContent = '○';
-                blinking = false;
-            }
-        }, 60000*10);  // If the end of transmission is not received within 10 minutes, turn off the blinking indicator
     }
 }
-
-/* on eventSource connect, set interval to update the "radio display" and log table from SSE queue providing Callsign/Source info */
-eventSource.onopen = function() {
-    updateLogInterval = setInterval(updateLog, 100);
-}
\ No newline at end of file
@@ -1,18 +1,24 @@
+import json
 import socket
-from flask import Flask, request, jsonify, render_template, url_for
+from flask import Flask, Response, request, render_template, send_file, make_response, abort, stream_with_context
 from flask_compress import Compress
-from logdog import LogDog
+from logdog import CursorExpired, LogDog
+from web.assets import Assets
 
 '''
 CallerID is a class that extends Parrot and adds a web interface to the LogDog application.
 
 CallerID is reliant on LogDogAPI to be running on port 8001 to provide the API for the web interface.
+Alternatively, CallerIDApp (api/unified.py) serves this interface and the API from a single process (./launcher.py --single).
 LogDogAPI is responsible for using the Parrot class to read the desired log file and serve the log lines using FastAPI.
 CallerID receives data from LogDogAPI utilizing SSE (Server-Sent Events) to update the Radio Display and log table in real-time.
 
+The static files built by python -m web.assets (see web/assets.py) are served precompressed from /static/dist/ with immutable cache headers.
+
 Attributes:
     app: A Flask object that represents the web application
     server_ip: A string that represents the IP address of the server
+    assets: An Assets object that maps the static files to their built copies
 
 Methods:
     get_server_ip: A method that gets the IP address of the server
@@ -27,6 +33,8 @@ class CallerID(LogDog):
         super().__init__()
         self.app = Flask(__name__)
         Compress(self.app)
+        self.assets = Assets()
+        self.app.jinja_env.globals['asset'] = self.assets.url
         self.server_ip = self.get_server_ip()
         self.setup_routes()
     
@@ -71,29 +79,82 @@ class CallerID(LogDog):
             '''
             index is a route that renders the index.html template.
             
+            The table of the page keeps at most dashboard_max_rows rows (200 by default).
+            
             Parameters:
                 None
                 
             Returns:
                 render_template: A Flask function that renders the index.html template
             '''
-            return render_template('index.html', callsign=self.callsign, server_ip=self.server_ip)
+            return render_template('index.html', callsign=self.callsign, server_ip=self.server_ip, log_file=self.log_file,
+                                   api_base=f'http://{self.server_ip}:{self.api_port}', max_rows=int(getattr(self, 'dashboard_max_rows', 200)))
+        
+        @self.app.route('/static/dist/<path:filename>')
+        def built_asset(filename):
+            '''
+            built_asset is a route that serves a static file built by python -m web.assets, precompressed and cached forever.
+            
+            Parameters:
+                filename: A string that represents the path of the hashed file in web/static/dist
+            
+            Returns:
+                Response: A Flask response with the brotli, gzip or plain copy of the file, or 304 if the browser already has it
+            '''
+            found = self.assets.find(filename, request.headers.get('Accept-Encoding', ''), request.headers.get('If-None-Match'))
+            if found is None:
+                abort(404)
+            status, path, headers, mimetype = found
+            if status == 304:
+                response = make_response('', 304)
+            else:
+                response = send_file(path, mimetype=mimetype, etag=False, conditional=False, max_age=None)
+            response.headers.update(headers)
+            return response
         
         @self.app.route('/read_log', methods=['GET'])
         def read_log():
             '''
-            read_log is a route that reads the log file and returns the log lines.
+            read_log is a route that streams a page of log lines as NDJSON, like /read_log of LogDogAPI (see LogDog.read_page).
+            
+            Each line is a JSON string and the last line is a JSON object with the older and newer cursors, to pass as before or after.
             
             Parameters:
                 None
             
             Returns:
-                jsonify: A Flask function that returns the log lines as a JSON object
+                Response: A Flask Response object that streams the lines as NDJSON
             '''
             lines = request.args.get('lines', None)
             filter = request.args.get('filter', None)
-            log_lines = self.read_log(lines=int(lines), filter=filter)
-            return jsonify(log_lines)
+            log_override = request.args.get('log_override', None)
+            before = request.args.get('before', None)
+            after = request.args.get('after', None)
+            if lines is not None:
+                try:
+                    lines = int(lines)
+                except ValueError:
+                    abort(400, 'lines must be an integer')
+                if lines < 1:
+                    abort(400, 'lines must be at least 1')
+            if log_override is not None and (not log_override or '/' in log_override or log_override.startswith('.')):
+                abort(400, f'Invalid log name: {log_override}')
+            if before is not None and after is not None:
+                abort(400, 'Pass either before or after')
+            page = self.read_page(lines, filter, log_override, before, after, limit=int(getattr(self, 'read_log_max_lines', 5000)))
+            try:
+                first = next(page)
+            except FileNotFoundError:
+                abort(404, f'No log file found for {log_override or self.log_file}')
+            except CursorExpired as e:
+                abort(410, str(e))
+            except ValueError:
+                abort(400, 'Invalid cursor')
+            def ndjson():
+                yield json.dumps(first) + '\n'
+                for item in page:
+                    yield json.dumps(item) + '\n'
+            return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
         
     def run(self):
         '''